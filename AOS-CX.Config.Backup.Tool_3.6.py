@@ -1,9 +1,8 @@
-import requests
-import csv
+import argparse
+import ipaddress
 import os
-import stat
+import re
 import time
-from datetime import datetime
 import schedule
 import tkinter as tk
 from tkinter import filedialog, messagebox
@@ -11,99 +10,100 @@ import ttkbootstrap as ttk
 from ttkbootstrap.constants import *
 import json
 import logging
-from logging.handlers import RotatingFileHandler
 import threading
 import sys
 from infi.systray import SysTrayIcon
-import urllib3
-from github import Github
-from cryptography.fernet import Fernet
-import boto3
-from botocore.exceptions import ClientError
-
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+import socket
+import sqlite3
+from datetime import datetime
+from aoscx_backup_engine import (
+    BackupEngine, CollectorQueue, ConfigChangeListener, LocalGitStore, ENCRYPTED_SUFFIX,
+    Alert, BackupTriggered, RunFinished, RunStarted, StatusChanged, StatusMessage, SwitchFinished, SwitchStarted, UploadDone,
+)
 
-class SwitchBackup:
-    VERSION = "3.6"
+class SwitchBackup(BackupEngine):
+    """Tray/desktop front end; subscribes to the engine's events once a window exists."""
 
     def __init__(self):
-        if getattr(sys, 'frozen', False):
-            self.base_dir_path = os.path.dirname(sys.executable)
-        else:
-            self.base_dir_path = os.path.dirname(os.path.abspath(__file__))
-
-        if not os.path.exists(self.base_dir_path):
-            os.makedirs(self.base_dir_path)
-
-        self.config_file = os.path.join(self.base_dir_path, "backup_config.json")
-        self.status_file = os.path.join(self.base_dir_path, "switch_status.json")
-        self.log_file = os.path.join(self.base_dir_path, "log.txt")
-        self.key_file = os.path.join(self.base_dir_path, "encryption_key.key")
-        self.max_backups = 5
-        self.schedule_enabled = True
-        self.git_repo_url = None
-        self.git_token = None
-        self.git_enabled = False
-        self.last_git_status = "Not attempted"
-        self.wasabi_access_key = None
-        self.wasabi_secret_key = None
-        self.wasabi_bucket = None
-        self.wasabi_region = "us-east-1"
-        self.wasabi_enabled = False
-        self.last_wasabi_status = "Not attempted"
-        self.verify_ssl = False
+        super().__init__()
         self.root = None
         self.systray = None
-        self.backup_lock = threading.Lock()
-        self.total_switches = 0
-        self.current_switch = 0
-        self.fernet = None
-        self.switch_status = None
         self.status_label = None
+        self.local_git_status_label = None
         self.progress = None
+        self._gui_events_attached = False
+        self._refresh_pending = False
+        self._tray_updated_at = 0.0
+        self._progress_run_id = None
+        self.queue_label = None
+
+    def _attach_gui_events(self):
+        """Route engine events to the window; headless runs never subscribe, so they skip Tk scheduling."""
+        if self._gui_events_attached:
+            return
+        self._gui_events_attached = True
+        self.events.subscribe(StatusMessage, lambda e: self._gui_set_status(e.text))
+        self.events.subscribe(Alert, self._gui_alert)
+        self.events.subscribe(RunStarted, self._gui_run_started)
+        self.events.subscribe(SwitchStarted, self._gui_switch_started)
+        self.events.subscribe(SwitchFinished, lambda e: self._gui_refresh_status())
+        self.events.subscribe(StatusChanged, lambda e: self._gui_refresh_status())
+        self.events.subscribe(UploadDone, self._gui_upload_done)
+        self.events.subscribe(BackupTriggered, lambda e: self._gui_set_status(f"Status: Change detected, backing up {', '.join(e.names)}"))
+
+    def _gui_run_started(self, event):
+        # On-demand runs overlap full runs; the progress bar stays with the full run
+        if event.mode == "Targeted" and self.backup_lock.locked():
+            return
+        self._progress_run_id = event.run_id
+        self._gui_set_progress(value=event.completed, maximum=event.total)
 
-    def _initialize_encryption(self):
-        if not os.path.exists(self.key_file):
-            key = Fernet.generate_key()
-            with open(self.key_file, 'wb') as f:
-                f.write(key)
-            # Set restrictive permissions on encryption key (Windows: read/write for owner only)
-            try:
-                if sys.platform == 'win32':
-                    # Windows: Use os.chmod with appropriate flags
-                    os.chmod(self.key_file, stat.S_IREAD | stat.S_IWRITE)
-                else:
-                    # Unix/Mac: 600 permissions
-                    os.chmod(self.key_file, 0o600)
-                logging.info(f"Set restrictive permissions on {self.key_file}")
-            except Exception as e:
-                logging.warning(f"Failed to set key file permissions: {str(e)}")
+    def _gui_switch_started(self, event):
+        if event.run_id == self._progress_run_id:
+            self._gui_set_progress(value=event.position)
+        self._gui_set_status(f"Status: Backing up {event.name} ({event.position}/{event.total})")
+
+    def _gui_refresh_status(self):
+        """Coalesce status table refreshes: at most one is queued on Tk at a time."""
+        if self._refresh_pending:
+            return
+        self._refresh_pending = True
+
+        def _refresh():
+            self._refresh_pending = False
+            self.refresh_status()
+        if not self._update_gui(_refresh):
+            self._refresh_pending = False
+
+    def _gui_upload_done(self, event):
+        if event.target == "local_git":
+            self._update_gui(lambda: self.local_git_status_label.config(text=event.status) if self.local_git_status_label else None)
+
+    def _gui_alert(self, event):
+        show = {"error": messagebox.showerror, "warning": messagebox.showwarning}.get(event.level, messagebox.showinfo)
+        self._update_gui(lambda: show(event.title, event.message))
+
+    def _tray_progress(self, event):
+        """Keep the tray tooltip on the current run's progress (at most once a second)."""
+        if isinstance(event, SwitchStarted):
+            if time.monotonic() - self._tray_updated_at < 1:
+                return
+            text = f"AOS-CX Config Backup Tool - backing up {event.position}/{event.total}"
         else:
-            with open(self.key_file, 'rb') as f:
-                key = f.read()
-        return Fernet(key)
-
-    def _encrypt(self, data):
-        if not data:
-            return ""
-        return self.fernet.encrypt(data.encode()).decode()
-
-    def _decrypt(self, encrypted_data):
-        if not encrypted_data:
-            return ""
-        try:
-            return self.fernet.decrypt(encrypted_data.encode()).decode()
-        except Exception as e:
-            logging.error(f"Decryption failed: {str(e)}")
-            return ""
+            text = f"AOS-CX Config Backup Tool - last run {datetime.now().strftime('%H:%M')}: {event.succeeded} ok, {event.failed} failed"
+        self._tray_updated_at = time.monotonic()
+        if self.systray:
+            self.systray.update(hover_text=text)
 
     def _update_gui(self, callback):
-        """Schedule a callback on the GUI main thread for thread-safe updates."""
+        """Schedule a callback on the GUI main thread for thread-safe updates; returns True if scheduled."""
         try:
             if self.root and self.root.winfo_exists():
                 self.root.after(0, callback)
+                return True
         except Exception:
             pass
+        return False
 
     def _gui_set_status(self, text):
         """Thread-safe status label update."""
@@ -126,183 +126,6 @@ class SwitchBackup:
             base_path = self.base_dir_path
         return os.path.join(base_path, relative_path)
 
-    def setup_logging(self):
-        try:
-            handler = RotatingFileHandler(
-                self.log_file, maxBytes=5*1024*1024, backupCount=3
-            )
-            handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-            logger = logging.getLogger()
-            logger.setLevel(logging.INFO)
-            logger.addHandler(handler)
-            logging.info("Logging initialized successfully")
-        except Exception as e:
-            logging.basicConfig(
-                level=logging.INFO,
-                format='%(asctime)s - %(levelname)s - %(message)s',
-                handlers=[logging.StreamHandler(sys.stdout)]
-            )
-            logging.error(f"Failed to set up file logging: {str(e)}")
-
-    def load_config(self):
-        default_config = {
-            'csv_path': os.path.join(self.base_dir_path, "switches.csv"),
-            'schedule_frequency': "daily",
-            'schedule_times': ["02:00"],
-            'schedule_day': "Monday",
-            'schedule_interval': 12,
-            'default_username': "",
-            'default_password': "",
-            'schedule_enabled': True,
-            'base_dir': '',
-            'timeout': 15,
-            'git_repo_url': '',
-            'git_token': '',
-            'git_enabled': False,
-            'wasabi_access_key': '',
-            'wasabi_secret_key': '',
-            'wasabi_bucket': '',
-            'wasabi_region': 'us-east-1',
-            'wasabi_enabled': False,
-            'verify_ssl': False,
-            'max_backups': 5
-        }
-        try:
-            with open(self.config_file, 'r') as f:
-                config = json.load(f)
-                self.csv_file = config.get('csv_path', default_config['csv_path'])
-                self.schedule_frequency = config.get('schedule_frequency', default_config['schedule_frequency'])
-                self.schedule_times = config.get('schedule_times', default_config['schedule_times'])
-                self.schedule_day = config.get('schedule_day', default_config['schedule_day'])
-                self.schedule_interval = config.get('schedule_interval', default_config['schedule_interval'])
-                self.default_username = self._decrypt(config.get('default_username', default_config['default_username']))
-                self.default_password = self._decrypt(config.get('default_password', default_config['default_password']))
-                self.schedule_enabled = config.get('schedule_enabled', default_config['schedule_enabled'])
-                self.base_dir = config.get('base_dir', default_config['base_dir'])
-                self.timeout = config.get('timeout', default_config['timeout'])
-                self.git_repo_url = config.get('git_repo_url', default_config['git_repo_url'])
-                self.git_token = self._decrypt(config.get('git_token', default_config['git_token']))
-                self.git_enabled = config.get('git_enabled', default_config['git_enabled'])
-                self.wasabi_access_key = self._decrypt(config.get('wasabi_access_key', default_config['wasabi_access_key']))
-                self.wasabi_secret_key = self._decrypt(config.get('wasabi_secret_key', default_config['wasabi_secret_key']))
-                self.wasabi_bucket = config.get('wasabi_bucket', default_config['wasabi_bucket'])
-                self.wasabi_region = config.get('wasabi_region', default_config['wasabi_region'])
-                self.wasabi_enabled = config.get('wasabi_enabled', default_config['wasabi_enabled'])
-                self.verify_ssl = config.get('verify_ssl', default_config['verify_ssl'])
-                self.max_backups = config.get('max_backups', default_config['max_backups'])
-                logging.info(f"Loaded config: git_enabled={self.git_enabled}, wasabi_enabled={self.wasabi_enabled}, verify_ssl={self.verify_ssl}")
-        except (FileNotFoundError, json.JSONDecodeError) as e:
-            self.csv_file = default_config['csv_path']
-            self.schedule_frequency = default_config['schedule_frequency']
-            self.schedule_times = default_config['schedule_times']
-            self.schedule_day = default_config['schedule_day']
-            self.schedule_interval = default_config['schedule_interval']
-            self.default_username = default_config['default_username']
-            self.default_password = default_config['default_password']
-            self.schedule_enabled = default_config['schedule_enabled']
-            self.base_dir = default_config['base_dir']
-            self.timeout = default_config['timeout']
-            self.git_repo_url = default_config['git_repo_url']
-            self.git_token = default_config['git_token']
-            self.git_enabled = default_config['git_enabled']
-            self.wasabi_access_key = default_config['wasabi_access_key']
-            self.wasabi_secret_key = default_config['wasabi_secret_key']
-            self.wasabi_bucket = default_config['wasabi_bucket']
-            self.wasabi_region = default_config['wasabi_region']
-            self.wasabi_enabled = default_config['wasabi_enabled']
-            self.verify_ssl = default_config['verify_ssl']
-            self.max_backups = default_config['max_backups']
-            if isinstance(e, json.JSONDecodeError):
-                logging.warning("Configuration file is corrupted, using default settings")
-            else:
-                logging.info("Configuration file not found, using default settings")
-
-    def load_status(self):
-        try:
-            with open(self.status_file, 'r') as f:
-                self.switch_status = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError) as e:
-            self.switch_status = {}
-            if isinstance(e, json.JSONDecodeError):
-                logging.warning("Switch status file is corrupted, initializing empty status")
-            else:
-                logging.info("Switch status file not found, initializing empty status")
-
-    def save_status(self):
-        try:
-            with open(self.status_file, 'w') as f:
-                json.dump(self.switch_status, f)
-            logging.info("Switch status saved successfully")
-        except Exception as e:
-            logging.error(f"Failed to save switch status: {str(e)}")
-
-    def save_config(self, switch_name=None, ip=None, config=None):
-        if switch_name and ip and config:
-            if not self.base_dir:
-                logging.error("Backup directory not set.")
-                self._gui_set_status("Error: Backup directory not set")
-                self._update_gui(lambda: messagebox.showerror("Error", "Backup directory not set."))
-                return
-            # Sanitize switch_name to prevent directory traversal
-            safe_switch_name = "".join(c for c in switch_name if c.isalnum() or c in ('-', '_', '.'))
-            if not safe_switch_name:
-                logging.error(f"Invalid switch name: {switch_name}")
-                return
-            switch_dir = os.path.join(self.base_dir, safe_switch_name)
-            if not os.path.exists(switch_dir):
-                os.makedirs(switch_dir)
-
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            # Sanitize filename components
-            safe_ip = "".join(c for c in ip if c.isalnum() or c in ('.', '-'))
-            filename = f"{safe_switch_name}_{safe_ip}_{timestamp}.txt"
-            filepath = os.path.join(switch_dir, filename)
-
-            try:
-                with open(filepath, 'w', encoding='utf-8') as f:
-                    f.write(config)
-                # Set appropriate file permissions
-                try:
-                    if sys.platform == 'win32':
-                        os.chmod(filepath, stat.S_IREAD | stat.S_IWRITE)
-                    else:
-                        os.chmod(filepath, 0o600)
-                except Exception as perm_error:
-                    logging.warning(f"Failed to set file permissions: {str(perm_error)}")
-                self.manage_retention(switch_dir)
-                logging.info(f"Saved config for {switch_name} ({ip})")
-            except Exception as e:
-                logging.error(f"Failed to save config for {switch_name} ({ip}): {str(e)}")
-        else:
-            config = {
-                'csv_path': self.csv_file,
-                'schedule_frequency': self.schedule_frequency,
-                'schedule_times': self.schedule_times,
-                'schedule_day': self.schedule_day,
-                'schedule_interval': self.schedule_interval,
-                'default_username': self._encrypt(self.default_username),
-                'default_password': self._encrypt(self.default_password),
-                'schedule_enabled': self.schedule_enabled,
-                'base_dir': self.base_dir,
-                'timeout': self.timeout,
-                'git_repo_url': self.git_repo_url,
-                'git_token': self._encrypt(self.git_token),
-                'git_enabled': self.git_enabled,
-                'wasabi_access_key': self._encrypt(self.wasabi_access_key),
-                'wasabi_secret_key': self._encrypt(self.wasabi_secret_key),
-                'wasabi_bucket': self.wasabi_bucket,
-                'wasabi_region': self.wasabi_region,
-                'wasabi_enabled': self.wasabi_enabled,
-                'verify_ssl': self.verify_ssl,
-                'max_backups': self.max_backups
-            }
-            try:
-                with open(self.config_file, 'w') as f:
-                    json.dump(config, f)
-                logging.info("Saved application configuration")
-            except Exception as e:
-                logging.error(f"Failed to save application configuration: {str(e)}")
-
     def scale_window(self):
         screen_width = self.root.winfo_screenwidth()
         screen_height = self.root.winfo_screenheight()
@@ -322,6 +145,7 @@ class SwitchBackup:
             logging.warning("Failed to set window icon; proceeding without icon.")
         self.scale_window()
         self.root.resizable(True, True)
+        self._attach_gui_events()
 
         notebook = ttk.Notebook(self.root)
         notebook.pack(fill="both", expand=True, padx=10, pady=10)
@@ -403,6 +227,18 @@ class SwitchBackup:
         verify_toggle = ttk.Checkbutton(adv_sub, text="Verify SSL certificates (recommended)", variable=self.verify_ssl_var, command=self.toggle_verify_ssl)
         verify_toggle.pack(pady=2, anchor="w")
 
+        self.structured_capture_var = tk.BooleanVar(value=self.structured_capture)
+        structured_toggle = ttk.Checkbutton(adv_sub, text="Also capture structured JSON config", variable=self.structured_capture_var)
+        structured_toggle.pack(pady=2, anchor="w")
+
+        self.encrypt_backups_var = tk.BooleanVar(value=self.encrypt_backups)
+        encrypt_toggle = ttk.Checkbutton(adv_sub, text="Encrypt backups at rest (turns off search; change reports show counts only)", variable=self.encrypt_backups_var)
+        encrypt_toggle.pack(pady=2, anchor="w")
+
+        self.metrics_enabled_var = tk.BooleanVar(value=self.metrics_enabled)
+        metrics_toggle = ttk.Checkbutton(adv_sub, text="Write Prometheus metrics file (.metrics)", variable=self.metrics_enabled_var)
+        metrics_toggle.pack(pady=2, anchor="w")
+
         timeout_frame = ttk.Frame(adv_sub)
         timeout_frame.pack(fill="x", pady=2)
         ttk.Label(timeout_frame, text="Timeout (s):").pack(side="left", padx=3)
@@ -417,6 +253,31 @@ class SwitchBackup:
         self.max_backups_entry.insert(0, str(self.max_backups))
         self.max_backups_entry.pack(side="left", padx=3)
 
+        workers_frame = ttk.Frame(adv_sub)
+        workers_frame.pack(fill="x", pady=2)
+        ttk.Label(workers_frame, text="Concurrent backups:").pack(side="left", padx=3)
+        self.concurrent_entry = ttk.Entry(workers_frame, width=8)
+        self.concurrent_entry.insert(0, str(self.concurrent_backups))
+        self.concurrent_entry.pack(side="left", padx=3)
+
+        resume_frame = ttk.Frame(adv_sub)
+        resume_frame.pack(fill="x", pady=2)
+        ttk.Label(resume_frame, text="Resume window (h, 0=off):").pack(side="left", padx=3)
+        self.resume_window_entry = ttk.Entry(resume_frame, width=8)
+        self.resume_window_entry.insert(0, str(self.resume_window_hours))
+        self.resume_window_entry.pack(side="left", padx=3)
+
+        session_frame = ttk.Frame(adv_sub)
+        session_frame.pack(fill="x", pady=2)
+        ttk.Label(session_frame, text="Keep REST sessions (min, 0=off):").pack(side="left", padx=3)
+        self.session_reuse_entry = ttk.Entry(session_frame, width=8)
+        self.session_reuse_entry.insert(0, str(self.session_reuse_minutes))
+        self.session_reuse_entry.pack(side="left", padx=3)
+
+        self.tls_resumption_var = tk.BooleanVar(value=self.tls_session_resumption)
+        tls_resumption_toggle = ttk.Checkbutton(adv_sub, text="TLS session resumption", variable=self.tls_resumption_var)
+        tls_resumption_toggle.pack(pady=2, anchor="w")
+
         adv_save = ttk.Button(adv_sub, text="Save Settings", command=self.save_advanced_settings)
         adv_save.pack(pady=5)
 
@@ -449,6 +310,26 @@ class SwitchBackup:
 
         ttk.Separator(right_column, orient="horizontal").pack(fill="x", pady=5)
 
+        local_git_frame = ttk.LabelFrame(right_column, text="Local Git History")
+        local_git_frame.pack(fill="x", pady=(0, 10))
+        self.local_git_enabled_var = tk.BooleanVar(value=self.local_git_enabled)
+        local_git_toggle = ttk.Checkbutton(local_git_frame, text="Enable", variable=self.local_git_enabled_var, command=self.toggle_local_git)
+        local_git_toggle.pack(pady=3, padx=10)
+        ttk.Label(local_git_frame, text="Push Remote (optional):").pack(pady=1, padx=10)
+        self.local_git_remote_entry = ttk.Entry(local_git_frame, width=20)
+        self.local_git_remote_entry.insert(0, self.local_git_remote)
+        self.local_git_remote_entry.pack(pady=1, padx=10)
+        ttk.Label(local_git_frame, text="Branch:").pack(pady=1, padx=10)
+        self.local_git_branch_entry = ttk.Entry(local_git_frame, width=20)
+        self.local_git_branch_entry.insert(0, self.local_git_branch)
+        self.local_git_branch_entry.pack(pady=1, padx=10)
+        local_git_save_button = ttk.Button(local_git_frame, text="Save", command=self.save_local_git_settings)
+        local_git_save_button.pack(pady=3, padx=10)
+        self.local_git_status_label = ttk.Label(local_git_frame, text=self.last_local_git_status, wraplength=180)
+        self.local_git_status_label.pack(pady=1, padx=10)
+
+        ttk.Separator(right_column, orient="horizontal").pack(fill="x", pady=5)
+
         wasabi_frame = ttk.LabelFrame(right_column, text="Wasabi Storage")
         wasabi_frame.pack(fill="x", pady=(0, 10))
         self.wasabi_enabled_var = tk.BooleanVar(value=self.wasabi_enabled)
@@ -475,26 +356,245 @@ class SwitchBackup:
 
         status_frame = ttk.Frame(notebook)
         notebook.add(status_frame, text="Status")
-        self.status_tree = ttk.Treeview(status_frame, columns=("Name", "IP", "Last Backup", "Status", "Git Status", "Wasabi Status"), show="headings")
+        self.status_tree = ttk.Treeview(status_frame, columns=("Name", "IP", "Last Backup", "Status", "Git Status", "Wasabi Status", "Changes", "Run", "Collector"), show="headings")
         self.status_tree.heading("Name", text="Switch")
         self.status_tree.heading("IP", text="IP")
         self.status_tree.heading("Last Backup", text="Last Backup")
         self.status_tree.heading("Status", text="Status")
         self.status_tree.heading("Git Status", text="Git Status")
         self.status_tree.heading("Wasabi Status", text="Wasabi Status")
+        self.status_tree.heading("Changes", text="Changes")
+        self.status_tree.heading("Run", text="Run")
+        self.status_tree.heading("Collector", text="Collector")
         self.status_tree.column("Name", width=80, anchor="center")
         self.status_tree.column("IP", width=80, anchor="center")
         self.status_tree.column("Last Backup", width=100, anchor="center")
         self.status_tree.column("Status", width=60, anchor="center")
         self.status_tree.column("Git Status", width=100, anchor="center")
         self.status_tree.column("Wasabi Status", width=100, anchor="center")
+        self.status_tree.column("Changes", width=80, anchor="center")
+        self.status_tree.column("Run", width=110, anchor="center")
+        self.status_tree.column("Collector", width=90, anchor="center")
         self.status_tree.pack(fill="both", expand=True)
         self.status_tree.tag_configure("oddrow", background="#2a2a2a")
         self.status_tree.tag_configure("evenrow", background="#1e1e1e")
-        refresh_button = ttk.Button(status_frame, text="Refresh", command=self.refresh_status)
-        refresh_button.pack(pady=5)
+        status_buttons = ttk.Frame(status_frame)
+        status_buttons.pack(pady=5)
+        ttk.Button(status_buttons, text="Refresh", command=self.refresh_fleet_status).pack(side="left", padx=5)
+        ttk.Button(status_buttons, text="Back Up Selected", command=self.backup_selected).pack(side="left", padx=5)
+        self.queue_label = ttk.Label(status_frame, text=self.queue_summary())
+        self.queue_label.pack(pady=(0, 5))
+        self.root.after(1000, self._poll_queue)
+
+        collectors_frame = ttk.Frame(notebook)
+        notebook.add(collectors_frame, text="Collectors")
+        dist_frame = ttk.LabelFrame(collectors_frame, text="Distributed Collection")
+        dist_frame.pack(fill="x", padx=10, pady=10)
+        self.distributed_enabled_var = tk.BooleanVar(value=self.distributed_enabled)
+        ttk.Checkbutton(dist_frame, text="Share work with other collectors", variable=self.distributed_enabled_var).pack(pady=3, padx=10, anchor="w")
+        queue_row = ttk.Frame(dist_frame)
+        queue_row.pack(fill="x", pady=2, padx=10)
+        ttk.Label(queue_row, text="Shared queue file:").pack(side="left", padx=3)
+        self.queue_path_entry = ttk.Entry(queue_row, width=40)
+        self.queue_path_entry.insert(0, self.distributed_queue_path)
+        self.queue_path_entry.pack(side="left", padx=3)
+        ttk.Button(queue_row, text="Browse", command=self.select_queue_file).pack(side="left", padx=3)
+        ident_row = ttk.Frame(dist_frame)
+        ident_row.pack(fill="x", pady=2, padx=10)
+        ttk.Label(ident_row, text="Collector name:").pack(side="left", padx=3)
+        self.collector_name_entry = ttk.Entry(ident_row, width=15)
+        self.collector_name_entry.insert(0, self.collector_name or socket.gethostname())
+        self.collector_name_entry.pack(side="left", padx=3)
+        ttk.Label(ident_row, text="Region:").pack(side="left", padx=3)
+        self.collector_region_entry = ttk.Entry(ident_row, width=12)
+        self.collector_region_entry.insert(0, self.collector_region)
+        self.collector_region_entry.pack(side="left", padx=3)
+        lease_row = ttk.Frame(dist_frame)
+        lease_row.pack(fill="x", pady=2, padx=10)
+        ttk.Label(lease_row, text="Lease (s):").pack(side="left", padx=3)
+        self.lease_entry = ttk.Entry(lease_row, width=8)
+        self.lease_entry.insert(0, str(self.lease_seconds))
+        self.lease_entry.pack(side="left", padx=3)
+        ttk.Button(dist_frame, text="Save", command=self.save_distributed_settings).pack(pady=5)
+        self.collector_summary_label = ttk.Label(collectors_frame, text="", justify="left")
+        self.collector_summary_label.pack(padx=10, pady=5, anchor="w")
+        ttk.Button(collectors_frame, text="Refresh", command=self.refresh_collector_summary).pack(pady=5)
+        self.refresh_collector_summary()
+
+        triggers_frame = ttk.Frame(notebook)
+        notebook.add(triggers_frame, text="Triggers")
+        trigger_box = ttk.LabelFrame(triggers_frame, text="Event-Triggered Backups")
+        trigger_box.pack(fill="x", padx=10, pady=10)
+        self.event_triggers_var = tk.BooleanVar(value=self.event_triggers_enabled)
+        ttk.Checkbutton(trigger_box, text="Back up a switch when it reports a config change", variable=self.event_triggers_var).pack(pady=3, padx=10, anchor="w")
+        port_row = ttk.Frame(trigger_box)
+        port_row.pack(fill="x", pady=2, padx=10)
+        ttk.Label(port_row, text="Syslog port (UDP/TCP, 0=off):").pack(side="left", padx=3)
+        self.syslog_port_entry = ttk.Entry(port_row, width=8)
+        self.syslog_port_entry.insert(0, str(self.syslog_port))
+        self.syslog_port_entry.pack(side="left", padx=3)
+        ttk.Label(port_row, text="Webhook port (localhost, 0=off):").pack(side="left", padx=3)
+        self.webhook_port_entry = ttk.Entry(port_row, width=8)
+        self.webhook_port_entry.insert(0, str(self.webhook_port))
+        self.webhook_port_entry.pack(side="left", padx=3)
+        bind_row = ttk.Frame(trigger_box)
+        bind_row.pack(fill="x", pady=2, padx=10)
+        ttk.Label(bind_row, text="Syslog listen address (0.0.0.0 = all interfaces):").pack(side="left", padx=3)
+        self.syslog_bind_entry = ttk.Entry(bind_row, width=16)
+        self.syslog_bind_entry.insert(0, self.syslog_bind_address)
+        self.syslog_bind_entry.pack(side="left", padx=3)
+        debounce_row = ttk.Frame(trigger_box)
+        debounce_row.pack(fill="x", pady=2, padx=10)
+        ttk.Label(debounce_row, text="Debounce (s):").pack(side="left", padx=3)
+        self.debounce_entry = ttk.Entry(debounce_row, width=8)
+        self.debounce_entry.insert(0, str(self.event_debounce_seconds))
+        self.debounce_entry.pack(side="left", padx=3)
+        pattern_row = ttk.Frame(trigger_box)
+        pattern_row.pack(fill="x", pady=2, padx=10)
+        ttk.Label(pattern_row, text="Change message regex:").pack(side="left", padx=3)
+        self.trigger_pattern_entry = ttk.Entry(pattern_row, width=50)
+        self.trigger_pattern_entry.insert(0, self.event_trigger_pattern)
+        self.trigger_pattern_entry.pack(side="left", padx=3, fill="x", expand=True)
+        ttk.Button(trigger_box, text="Save", command=self.save_trigger_settings).pack(pady=5)
+        self.trigger_state_label = ttk.Label(triggers_frame, text=self._trigger_state(), justify="left")
+        self.trigger_state_label.pack(padx=10, pady=5, anchor="w")
+
+        search_frame = ttk.Frame(notebook)
+        notebook.add(search_frame, text="Search")
+        search_bar = ttk.Frame(search_frame)
+        search_bar.pack(fill="x", padx=10, pady=5)
+        self.search_entry = ttk.Entry(search_bar, width=40)
+        self.search_entry.pack(side="left", padx=3)
+        self.search_entry.bind("<Return>", lambda event: self.run_search())
+        self.search_regex_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(search_bar, text="Regex", variable=self.search_regex_var).pack(side="left", padx=3)
+        self.search_all_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(search_bar, text="All versions", variable=self.search_all_var).pack(side="left", padx=3)
+        ttk.Button(search_bar, text="Search", command=self.run_search).pack(side="left", padx=3)
+        self.search_result_label = ttk.Label(search_frame, text="")
+        self.search_result_label.pack(padx=10, anchor="w")
+        self.search_tree = ttk.Treeview(search_frame, columns=("Switch", "IP", "Backup", "Line"), show="headings")
+        for column, width in (("Switch", 80), ("IP", 80), ("Backup", 120), ("Line", 300)):
+            self.search_tree.heading(column, text=column)
+            self.search_tree.column(column, width=width, anchor="w")
+        self.search_tree.pack(fill="both", expand=True)
+        self.refresh_status()
+
+    def select_queue_file(self):
+        filepath = filedialog.asksaveasfilename(title="Shared Queue File", defaultextension=".db", confirmoverwrite=False,
+                                                filetypes=[("SQLite database", "*.db")], initialdir=self.base_dir_path)
+        if filepath:
+            self.queue_path_entry.delete(0, "end")
+            self.queue_path_entry.insert(0, filepath)
+
+    def save_distributed_settings(self):
+        try:
+            lease_seconds = int(self.lease_entry.get())
+            if lease_seconds < 30 or lease_seconds > 3600:
+                raise ValueError("Lease must be 30-3600 seconds")
+        except ValueError as ve:
+            messagebox.showerror("Invalid Input", str(ve))
+            return
+        self.distributed_enabled = self.distributed_enabled_var.get()
+        self.distributed_queue_path = self.queue_path_entry.get().strip()
+        self.collector_name = self.collector_name_entry.get().strip()
+        self.collector_region = self.collector_region_entry.get().strip()
+        self.lease_seconds = lease_seconds
+        self.save_config()
+        self.refresh_collector_summary()
+        messagebox.showinfo("Success", "Distributed collection settings saved")
+        logging.info(f"Distributed collection {'enabled' if self.distributed_enabled else 'disabled'}: {self.distributed_queue_path}")
+
+    def save_trigger_settings(self):
+        try:
+            syslog_port = int(self.syslog_port_entry.get())
+            webhook_port = int(self.webhook_port_entry.get())
+            if not (0 <= syslog_port <= 65535 and 0 <= webhook_port <= 65535):
+                raise ValueError("Ports must be 0-65535")
+            bind_address = self.syslog_bind_entry.get().strip()
+            try:
+                ipaddress.ip_address(bind_address)
+            except ValueError:
+                raise ValueError("Syslog listen address must be an IP address")
+            debounce = int(self.debounce_entry.get())
+            if debounce < 1 or debounce > 3600:
+                raise ValueError("Debounce must be 1-3600 seconds")
+            pattern = self.trigger_pattern_entry.get().strip() or ConfigChangeListener.DEFAULT_PATTERN
+            re.compile(pattern)
+        except re.error as e:
+            messagebox.showerror("Invalid Input", f"Invalid regex: {str(e)}")
+            return
+        except ValueError as ve:
+            messagebox.showerror("Invalid Input", str(ve))
+            return
+        self.event_triggers_enabled = self.event_triggers_var.get()
+        self.syslog_port, self.webhook_port, self.event_debounce_seconds = syslog_port, webhook_port, debounce
+        self.syslog_bind_address = bind_address
+        self.event_trigger_pattern = pattern
+        self.save_config()
+        error = self.start_event_triggers()
+        self.trigger_state_label.config(text=self._trigger_state())
+        if error:
+            messagebox.showerror("Listener Error", f"Could not start the listener: {error}")
+        else:
+            messagebox.showinfo("Success", "Trigger settings saved")
+        logging.info(f"Event triggers {'enabled' if self.event_triggers_enabled else 'disabled'}: syslog {syslog_port}, webhook {webhook_port}, debounce {debounce}s")
+
+    def _trigger_state(self):
+        if self.change_listener is None:
+            return "Listener: stopped"
+        return (f"Listener: syslog {f'udp/tcp {self.syslog_bind_address}:{self.syslog_port}' if self.syslog_port else 'off'}, "
+                f"webhook {'http://127.0.0.1:' + str(self.webhook_port) + '/' if self.webhook_port else 'off'}")
+
+    def refresh_collector_summary(self):
+        if not (self.distributed_enabled and self.distributed_queue_path):
+            self.collector_summary_label.config(text="Distributed collection is off.")
+            return
+        try:
+            epoch, started, counts, collectors = CollectorQueue(self.distributed_queue_path).summary()
+        except sqlite3.Error as e:
+            self.collector_summary_label.config(text=f"Shared queue unavailable: {str(e)}")
+            return
+        lines = ["No distributed run yet."] if epoch is None else [
+            f"Run dist-{epoch} started {datetime.fromtimestamp(started):%Y-%m-%d %H:%M:%S}: "
+            + ", ".join(f"{counts.get(state, 0)} {state}" for state in ("pending", "claimed", "done", "failed"))]
+        for name, region, last_seen in collectors:
+            lines.append(f"  {name} ({region or 'no region'}) last seen {datetime.fromtimestamp(last_seen):%Y-%m-%d %H:%M:%S}")
+        self.collector_summary_label.config(text="\n".join(lines))
+
+    def refresh_fleet_status(self):
+        self.merge_collector_status()
         self.refresh_status()
 
+    def run_search(self):
+        pattern = self.search_entry.get()
+        if not pattern:
+            return
+        if self.encrypt_backups:
+            self.search_result_label.config(text="Search is off while backups are encrypted at rest")
+            return
+        regex, all_versions = self.search_regex_var.get(), self.search_all_var.get()
+        self.search_result_label.config(text="Searching...")
+
+        def _search():
+            try:
+                rows, elapsed = self.search_configs(pattern, regex=regex, all_versions=all_versions)
+                summary = f"{len(rows)} matches in {elapsed * 1000:.0f} ms"
+            except re.error as e:
+                rows, summary = [], f"Invalid regex: {str(e)}"
+            except (OSError, sqlite3.Error) as e:
+                logging.error(f"Search failed: {str(e)}")
+                rows, summary = [], f"Search failed: {str(e)}"
+
+            def _show():
+                for item in self.search_tree.get_children():
+                    self.search_tree.delete(item)
+                for switch, ip, saved, path, line in rows:
+                    self.search_tree.insert("", "end", values=(switch, ip, saved, line))
+                self.search_result_label.config(text=summary)
+            self._update_gui(_show)
+        threading.Thread(target=_search, daemon=True).start()
+
     def update_schedule_details(self):
         for widget in self.sched_details_frame.winfo_children():
             widget.destroy()
@@ -582,6 +682,21 @@ class SwitchBackup:
         messagebox.showinfo("Success", "Git settings saved")
         logging.info("Git settings updated")
 
+    def toggle_local_git(self):
+        self.local_git_enabled = self.local_git_enabled_var.get()
+        self.save_config()
+        if self.local_git_enabled and not LocalGitStore.available():
+            messagebox.showwarning("Git Not Found", "Local Git history needs the git executable on PATH.")
+        logging.info(f"Local Git history {'enabled' if self.local_git_enabled else 'disabled'}")
+
+    def save_local_git_settings(self):
+        self.local_git_remote = self.local_git_remote_entry.get().strip()
+        self.local_git_branch = self.local_git_branch_entry.get().strip() or "main"
+        self.local_git_enabled = self.local_git_enabled_var.get()
+        self.save_config()
+        messagebox.showinfo("Success", "Local Git settings saved")
+        logging.info("Local Git settings updated")
+
     def toggle_wasabi(self):
         self.wasabi_enabled = self.wasabi_enabled_var.get()
         self.save_config()
@@ -598,22 +713,6 @@ class SwitchBackup:
         messagebox.showinfo("Success", "Wasabi settings saved")
         logging.info("Wasabi settings updated")
 
-    def setup_schedule(self):
-        # Use wrapper function to avoid lambda closure issues
-        def run_scheduled_backup():
-            try:
-                self.backup_switches(is_manual=False)
-            except Exception as e:
-                logging.error(f"Scheduled backup failed: {str(e)}")
-        
-        if self.schedule_frequency == "daily":
-            for t in self.schedule_times:
-                schedule.every().day.at(t).do(run_scheduled_backup)
-        elif self.schedule_frequency == "weekly":
-            getattr(schedule.every(), self.schedule_day.lower()).at(self.schedule_times[0]).do(run_scheduled_backup)
-        else:
-            getattr(schedule.every(), self.schedule_day.lower()).at(self.schedule_times[0]).do(run_scheduled_backup)
-
     def toggle_schedule(self):
         self.schedule_enabled = self.schedule_toggle_var.get()
         schedule.clear()
@@ -643,84 +742,34 @@ class SwitchBackup:
             self.max_backups = int(self.max_backups_entry.get())
             if self.max_backups < 1 or self.max_backups > 20:
                 raise ValueError("Max backups must be 1-20")
+            self.resume_window_hours = int(self.resume_window_entry.get())
+            if self.resume_window_hours < 0 or self.resume_window_hours > 168:
+                raise ValueError("Resume window must be 0-168 hours")
+            self.concurrent_backups = int(self.concurrent_entry.get())
+            if self.concurrent_backups < 1 or self.concurrent_backups > 32:
+                raise ValueError("Concurrent backups must be 1-32")
+            self.session_reuse_minutes = int(self.session_reuse_entry.get())
+            if self.session_reuse_minutes < 0 or self.session_reuse_minutes > 15:
+                # AOS-CX drops idle REST sessions after 20 minutes by default
+                raise ValueError("REST session reuse must be 0-15 minutes")
+            self.tls_session_resumption = self.tls_resumption_var.get()
             self.verify_ssl = self.verify_ssl_var.get()
+            self.structured_capture = self.structured_capture_var.get()
+            self.encrypt_backups = self.encrypt_backups_var.get()
+            self.metrics_enabled = self.metrics_enabled_var.get()
             self.save_config()
             messagebox.showinfo("Success", "Advanced settings saved")
-            logging.info(f"Advanced settings updated: timeout={self.timeout}, max_backups={self.max_backups}, verify_ssl={self.verify_ssl}")
+            logging.info(f"Advanced settings updated: timeout={self.timeout}, max_backups={self.max_backups}, resume_window_hours={self.resume_window_hours}, concurrent_backups={self.concurrent_backups}, session_reuse_minutes={self.session_reuse_minutes}, tls_session_resumption={self.tls_session_resumption}, structured_capture={self.structured_capture}, encrypt_backups={self.encrypt_backups}, metrics_enabled={self.metrics_enabled}, verify_ssl={self.verify_ssl}")
         except ValueError as ve:
             messagebox.showerror("Invalid Input", str(ve))
         except Exception as e:
             logging.error(f"Failed to save advanced settings: {str(e)}")
             messagebox.showerror("Error", "Failed to save settings")
 
-    def get_switch_config(self, ip, username, password):
-        max_retries = 3
-        retry_delay = 5
-        session = requests.Session()
-        config_text = None
-        verify = self.verify_ssl
-
-        try:
-            response = requests.get(f"https://{ip}", timeout=5, verify=verify)
-            logging.info(f"Connectivity test to {ip}: {response.status_code}")
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Connectivity test to {ip} failed: {str(e)}")
-            return None
-
-        for attempt in range(max_retries):
-            logged_in = False
-            try:
-                login_url = f"https://{ip}/rest/v10.04/login"
-                login_response = session.post(login_url, data={"username": username, "password": password}, verify=verify, timeout=self.timeout)
-                login_response.raise_for_status()
-                logged_in = True
-                logging.info(f"Login successful for {ip} with API v10.04")
-
-                config_url = f"https://{ip}/rest/v10.04/configs/running-config"
-                config_response = session.get(config_url, headers={"Accept": "text/plain"}, verify=verify, timeout=self.timeout)
-                config_response.raise_for_status()
-                config_text = config_response.text
-                logging.info(f"Retrieved config from {ip} with API v10.04")
-                break
-            except requests.exceptions.HTTPError as e:
-                # More granular error reporting for API responses
-                status = e.response.status_code if e.response else "unknown"
-                text = e.response.text[:200] if e.response else ""
-                logging.error(f"HTTP error {status} from {ip}: {text}")
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                    continue
-                return None
-            except requests.exceptions.RequestException as e:
-                if attempt < max_retries - 1:
-                    logging.warning(f"Attempt {attempt + 1} failed for {ip}: {str(e)}. Retrying...")
-                    time.sleep(retry_delay)
-                else:
-                    logging.error(f"Failed to get config from {ip} after {max_retries} attempts: {str(e)}")
-                    return None
-            finally:
-                if logged_in:
-                    try:
-                        logout_url = f"https://{ip}/rest/v10.04/logout"
-                        session.post(logout_url, verify=verify, timeout=self.timeout)
-                        logging.info(f"Logged out from {ip}")
-                    except requests.exceptions.RequestException as e:
-                        logging.error(f"Failed to logout from {ip}: {str(e)}")
-        return config_text
-
-    def manage_retention(self, switch_dir):
-        try:
-            files = sorted([f for f in os.listdir(switch_dir) if f.endswith('.txt')], reverse=True)
-            while len(files) > self.max_backups:
-                os.remove(os.path.join(switch_dir, files.pop()))
-                logging.info(f"Removed old backup in {switch_dir}")
-        except Exception as e:
-            logging.error(f"Failed to manage retention for {switch_dir}: {str(e)}")
-
     def refresh_status(self):
         for item in self.status_tree.get_children():
             self.status_tree.delete(item)
-        for idx, (switch, status) in enumerate(self.switch_status.items()):
+        for idx, (switch, status) in enumerate(list(self.switch_status.items())):
             tag = "evenrow" if idx % 2 == 0 else "oddrow"
             self.status_tree.insert("", "end", values=(
                 status.get("name", switch),
@@ -728,154 +777,30 @@ class SwitchBackup:
                 status.get("last_backup", "Never"),
                 status.get("status", "Unknown"),
                 status.get("git_status", "Not attempted"),
-                status.get("wasabi_status", "Not attempted")
+                status.get("wasabi_status", "Not attempted"),
+                status.get("changes", ""),
+                status.get("run_id", ""),
+                status.get("collector", "")
             ), tags=(tag,))
 
-    def git_upload(self, is_manual=False):
-        if not self.git_enabled or not self.git_repo_url or not self.git_token or not self.base_dir:
-            self.last_git_status = "Skipped: Git settings incomplete"
-            logging.info("Git upload skipped: settings incomplete")
-            return
-        try:
-            g = Github(self.git_token)
-            # Extract "owner/repo" from various URL formats or direct input
-            repo_name = self.git_repo_url.strip().rstrip('/')
-            repo_name = repo_name.replace('.git', '')
-            for prefix in ['https://github.com/', 'http://github.com/', 'github.com/']:
-                if repo_name.lower().startswith(prefix):
-                    repo_name = repo_name[len(prefix):]
-                    break
-            repo = g.get_repo(repo_name)
-            files_to_upload = []
-            for switch_dir in [d for d in os.listdir(self.base_dir) if os.path.isdir(os.path.join(self.base_dir, d))]:
-                switch_path = os.path.join(self.base_dir, switch_dir)
-                files = sorted([f for f in os.listdir(switch_path) if f.endswith('.txt')], reverse=True)
-                if files:
-                    file_path = os.path.join(switch_path, files[0])
-                    relative_path = os.path.relpath(file_path, self.base_dir).replace(os.sep, '/')
-                    files_to_upload.append((file_path, relative_path))
-            for file_path, relative_path in files_to_upload:
-                with open(file_path, 'r') as f:
-                    content = f.read()
-                try:
-                    contents = repo.get_contents(relative_path)
-                    repo.update_file(relative_path, f"Update {relative_path}", content, contents.sha)
-                except Exception as e:
-                    # File doesn't exist, create it
-                    if "404" in str(e) or "Not Found" in str(e):
-                        repo.create_file(relative_path, f"Add {relative_path}", content)
-                    else:
-                        raise
-            self.last_git_status = "Success"
-            logging.info("Git upload successful")
-            if is_manual:
-                self._gui_set_status("Status: Git upload completed")
-        except Exception as e:
-            self.last_git_status = f"Failed: {str(e)}"
-            logging.error(f"Git upload failed: {str(e)}")
-            if is_manual:
-                self._gui_set_status("Status: Git upload failed")
-
-    def wasabi_upload(self, is_manual=False):
-        if not self.wasabi_enabled or not self.wasabi_access_key or not self.wasabi_secret_key or not self.wasabi_bucket or not self.base_dir:
-            self.last_wasabi_status = "Skipped: Wasabi settings incomplete"
-            logging.info("Wasabi upload skipped: settings incomplete")
-            return
-        try:
-            s3_client = boto3.Session().client(
-                's3',
-                endpoint_url=f"https://s3.{self.wasabi_region}.wasabisys.com",
-                aws_access_key_id=self.wasabi_access_key,
-                aws_secret_access_key=self.wasabi_secret_key
-            )
-            files_to_upload = []
-            for switch_dir in [d for d in os.listdir(self.base_dir) if os.path.isdir(os.path.join(self.base_dir, d))]:
-                switch_path = os.path.join(self.base_dir, switch_dir)
-                files = sorted([f for f in os.listdir(switch_path) if f.endswith('.txt')], reverse=True)
-                if files:
-                    file_path = os.path.join(switch_path, files[0])
-                    relative_path = os.path.relpath(file_path, self.base_dir).replace(os.sep, '/')
-                    files_to_upload.append((file_path, relative_path))
-            for file_path, relative_path in files_to_upload:
-                with open(file_path, 'rb') as f:
-                    s3_client.upload_fileobj(f, self.wasabi_bucket, relative_path)
-            self.last_wasabi_status = "Success"
-            logging.info("Wasabi upload successful")
-            if is_manual:
-                self._gui_set_status("Status: Wasabi upload completed")
-        except Exception as e:
-            self.last_wasabi_status = f"Failed: {str(e)}"
-            logging.error(f"Wasabi upload failed: {str(e)}")
-            if is_manual:
-                self._gui_set_status("Status: Wasabi upload failed")
-
-    def backup_switches(self, is_manual=False):
-        # Try to acquire lock with timeout protection
-        if not self.backup_lock.acquire(blocking=False):
-            logging.warning("Backup already in progress")
-            self._gui_set_status("Status: Backup in progress")
-            if is_manual:
-                self._update_gui(lambda: messagebox.showwarning("Backup In Progress", "A backup is already running. Please wait."))
-            return
-        try:
-            mode = "Manual" if is_manual else "Automatic"
-            self._gui_set_status(f"Status: Running {mode.lower()} backup")
-            logging.info(f"Starting {mode.lower()} backup")
-            try:
-                with open(self.csv_file, 'r') as f:
-                    reader = csv.DictReader(f)
-                    if not reader.fieldnames or not all(col in reader.fieldnames for col in ['name', 'ip']):
-                        self._gui_set_status("Error: CSV missing columns")
-                        logging.error("CSV missing 'name' or 'ip'")
-                        return
-                    switches = list(reader)
-                    self.total_switches = len(switches)
-                    self.current_switch = 0
-            except FileNotFoundError:
-                self._gui_set_status("Error: CSV not found")
-                logging.error(f"CSV not found: {self.csv_file}")
-                return
-            self._gui_set_progress(value=0, maximum=self.total_switches)
-            has_failure = False
-            for row in switches:
-                self.current_switch += 1
-                self._gui_set_progress(value=self.current_switch)
-                self._gui_set_status(f"Status: Backing up {row['name']} ({self.current_switch}/{self.total_switches})")
-                logging.info(f"Backing up {row['name']} ({row['ip']})")
-                config = self.get_switch_config(row['ip'], row.get('username', self.default_username), row.get('password', self.default_password))
-                if config:
-                    self.save_config(row['name'], row['ip'], config)
-                    if not self.base_dir:
-                        return
-                    self.switch_status[row['name']] = {
-                        "name": row['name'], "ip": row['ip'], "last_backup": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        "status": "Success", "git_status": self.last_git_status, "wasabi_status": self.last_wasabi_status
-                    }
-                else:
-                    has_failure = True
-                    self.switch_status[row['name']] = {
-                        "name": row['name'], "ip": row['ip'], "last_backup": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        "status": "Failed", "git_status": "Not attempted", "wasabi_status": "Not attempted"
-                    }
-                self.save_status()
-                self._update_gui(self.refresh_status)
-            if not has_failure:
-                self.git_upload(is_manual=is_manual)
-                for switch in self.switch_status:
-                    self.switch_status[switch]["git_status"] = self.last_git_status
-                self.wasabi_upload(is_manual=is_manual)
-                for switch in self.switch_status:
-                    self.switch_status[switch]["wasabi_status"] = self.last_wasabi_status
-                self.save_status()
-                self._update_gui(self.refresh_status)
-            self._gui_set_status(f"Status: {mode} backup {'completed' if not has_failure else 'partially completed'}")
-            logging.info(f"{mode} backup completed")
-        finally:
-            self.backup_lock.release()
-
     def manual_backup(self):
         threading.Thread(target=self.backup_switches, args=(True,), daemon=True).start()
 
+    def backup_selected(self):
+        """Back up the switches selected on the Status tab ahead of any running or scheduled backup."""
+        names = [self.status_tree.item(item, "values")[0] for item in self.status_tree.selection()]
+        if not names:
+            messagebox.showinfo("Back Up Selected", "Select one or more switches in the status table first.")
+            return
+        self.status_label.config(text=f"Status: Queued on-demand backup of {len(names)} switch(es)")
+        threading.Thread(target=self.backup_now, args=(names,), daemon=True).start()
+
+    def _poll_queue(self):
+        if not (self.root and self.root.winfo_exists() and self.queue_label):
+            return
+        self.queue_label.config(text=self.queue_summary())
+        self.root.after(1000, self._poll_queue)
+
     def update_schedule(self):
         self.schedule_frequency = self.freq_var.get()
         if self.schedule_frequency == "daily":
@@ -906,21 +831,6 @@ class SwitchBackup:
         messagebox.showinfo("Success", "Schedule updated")
         logging.info(f"Schedule updated: {self.schedule_frequency}")
 
-    def run_schedule(self):
-        if self.schedule_enabled:
-            self.setup_schedule()
-            logging.info(f"Scheduled backups set up")
-        while True:
-            schedule.run_pending()
-            time.sleep(60)
-
-    def initialize(self):
-        if self.fernet is None:
-            self.fernet = self._initialize_encryption()
-        self.setup_logging()
-        self.load_config()
-        self.load_status()
-
     def open_gui(self, systray):
         if self.root is None or not tk.Tk.winfo_exists(self.root):
             self.setup_gui()
@@ -934,6 +844,7 @@ class SwitchBackup:
             self.root.withdraw()
 
     def quit_app(self, systray):
+        self.shutdown()
         if self.systray:
             self.systray.shutdown()
         if self.root:
@@ -942,6 +853,7 @@ class SwitchBackup:
 
     def run(self):
         self.initialize()
+        self.start_event_triggers()
         menu_options = (
             ("Open GUI", None, self.open_gui),
             ("Exit", None, self.quit_app),
@@ -952,10 +864,103 @@ class SwitchBackup:
             menu_options, default_menu_index=None
         )
         self.systray.start()
+        self.events.subscribe(SwitchStarted, self._tray_progress)
+        self.events.subscribe(RunFinished, self._tray_progress)
         schedule_thread = threading.Thread(target=self.run_schedule, daemon=True)
         schedule_thread.start()
         self.open_gui(self.systray)
 
-if __name__ == "__main__":
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AOS-CX Config Backup Tool (no arguments starts the tray app)")
+    subparsers = parser.add_subparsers(dest="command")
+    search_parser = subparsers.add_parser("search", help="search the latest (or all) backed-up configs")
+    search_parser.add_argument("pattern", help="substring (case-insensitive) or regular expression")
+    search_parser.add_argument("--regex", action="store_true", help="treat pattern as a regular expression")
+    search_parser.add_argument("--all-versions", action="store_true", help="include older backups kept by retention")
+    search_parser.add_argument("--reindex", action="store_true", help="rebuild the index from the backup directory first")
+    search_parser.add_argument("--limit", type=int, default=1000, help="maximum number of results (default 1000)")
+    query_parser = subparsers.add_parser("query", help="print one field of a table from the latest structured backups")
+    query_parser.add_argument("table", help="JSON config table, e.g. Interface, VLAN, ACL")
+    query_parser.add_argument("field", help="field name within each record, e.g. admin, description")
+    backup_parser = subparsers.add_parser("backup", help="back up every switch in the inventory (or just the named ones) now, without the GUI")
+    backup_parser.add_argument("switches", nargs="*", help="switch names from the CSV; back up only these")
+    subparsers.add_parser("listen", help="run headless: scheduled backups plus syslog/webhook-triggered ones")
+    subparsers.add_parser("bench", help="benchmark storage size, query speed and encryption cost of the backups")
+    decrypt_parser = subparsers.add_parser("decrypt", help="decrypt/restore encrypted backups (.enc) with this install's key")
+    decrypt_parser.add_argument("source", help="an encrypted backup file, or a directory to decrypt recursively")
+    decrypt_parser.add_argument("-o", "--output", help="output file or directory (default: source without .enc / <source>-decrypted)")
+    args = parser.parse_args(argv)
+
     app = SwitchBackup()
-    app.run()
\ No newline at end of file
+    if args.command is None:
+        app.run()
+        return 0
+    app.initialize()
+    if args.command == "decrypt":
+        output = args.output
+        if not output:
+            source = args.source.rstrip("/\\")
+            output = source[:-len(ENCRYPTED_SUFFIX)] if source.endswith(ENCRYPTED_SUFFIX) else source + "-decrypted"
+        try:
+            count = app.decrypt_backups(args.source, output)
+        except (OSError, ValueError) as e:
+            print(f"Decryption failed: {str(e)}", file=sys.stderr)
+            return 1
+        print(f"Decrypted {count} file(s) to {output}", file=sys.stderr)
+        return 0
+    if not app.base_dir:
+        print("Backup directory not set.", file=sys.stderr)
+        return 1
+    if args.command == "search":
+        if app.encrypt_backups:
+            print("Search is off while backups are encrypted at rest (the index would hold plaintext).", file=sys.stderr)
+            return 1
+        if args.reindex:
+            index_path = os.path.join(app.base_dir, ".index", "search.db")
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(index_path + suffix):
+                    os.remove(index_path + suffix)
+        try:
+            rows, elapsed = app.search_configs(args.pattern, regex=args.regex, all_versions=args.all_versions, limit=args.limit)
+        except re.error as e:
+            print(f"Invalid regex: {str(e)}", file=sys.stderr)
+            return 2
+        for switch, ip, saved, path, line in rows:
+            print(f"{switch}\t{ip}\t{saved}\t{line}")
+        print(f"{len(rows)} matches in {elapsed * 1000:.1f} ms", file=sys.stderr)
+    elif args.command == "query":
+        for switch, record_id, value in app.query_structured(args.table, args.field):
+            print(f"{switch}\t{record_id}\t{json.dumps(value)}")
+    elif args.command == "backup":
+        app.events.subscribe(SwitchFinished, lambda e: print(f"{e.name}\t{e.ip}\t{e.status}\t{e.seconds:.1f}s\t{e.changes}"))
+        app.events.subscribe(UploadDone, lambda e: print(f"{e.target} upload: {e.status}", file=sys.stderr))
+        app.events.subscribe(StatusMessage, lambda e: print(e.text, file=sys.stderr))
+        try:
+            results = app.backup_now(args.switches) if args.switches else app.collect(is_manual=True)
+        finally:
+            app.shutdown()
+        if results is None:
+            return 1
+        failed = sum(1 for status in results.values() if status.get("status") != "Success")
+        print(f"{len(results)} switches backed up, {failed} failed", file=sys.stderr)
+        return 1 if failed else 0
+    elif args.command == "listen":
+        app.event_triggers_enabled = True
+        error = app.start_event_triggers()
+        if error:
+            print(f"Could not start the listener: {error}", file=sys.stderr)
+            return 1
+        app.events.subscribe(SwitchFinished, lambda e: print(f"{e.name}\t{e.ip}\t{e.status}\t{e.seconds:.1f}s\t{e.changes}"))
+        try:
+            app.run_schedule()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            app.shutdown()
+    elif args.command == "bench":
+        print("\n".join(app.run_benchmark()))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,3235 @@
+"""Backup engine for the AOS-CX Config Backup Tool.
+
+Everything needed to collect, store and upload switch configs without a GUI:
+
+    engine = BackupEngine()
+    engine.initialize()
+    engine.events.subscribe(SwitchFinished, lambda e: print(e.name, e.status))
+    results = engine.collect()          # or engine.collect(inventory)
+
+Progress is reported as typed events on engine.events (see EventBus); the
+desktop app, tray icon, metrics file and CLI are all subscribers.
+"""
+import requests
+from requests.adapters import HTTPAdapter
+import base64
+import csv
+import gzip
+import hashlib
+import heapq
+import hmac
+import html
+import io
+import ipaddress
+import itertools
+import os
+import re
+import shutil
+import socket
+import socketserver
+import sqlite3
+import ssl
+import subprocess
+import stat
+import tempfile
+import time
+import urllib.parse
+from collections import deque, namedtuple
+from contextlib import contextmanager
+from datetime import datetime
+import difflib
+import schedule
+import json
+import logging
+from logging.handlers import RotatingFileHandler
+import struct
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+import sys
+import urllib3
+from github import Github
+from cryptography.fernet import Fernet
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+import boto3
+from botocore.exceptions import ClientError
+
+try:
+    import re._parser as sre_parse
+    import re._constants as sre_constants
+except ImportError:
+    import sre_parse
+    import sre_constants
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+BACKUP_SUFFIXES = ('.txt', '.txt.enc')
+STRUCTURED_SUFFIXES = ('.json.gz', '.json.gz.enc')
+ENCRYPTED_SUFFIX = '.enc'
+# Tool data kept next to the switch directories in the backup directory
+TOOL_DIRS = ('.git-history', '.index', '.reports', '.metrics')
+
+class EncryptedBackupWriter:
+    """Write-only stream that seals data in fixed-size AES-256-GCM chunks as it goes.
+
+    Layout: MAGIC, chunk size (u32), 8-byte random nonce prefix, then chunks of
+    u32 length (top bit marks the final chunk) + ciphertext. Each chunk's nonce
+    is prefix + counter and its AAD binds the header, counter and final flag,
+    so reordered, dropped or truncated chunks fail authentication.
+    """
+    MAGIC = b"ACXENC1\x00"
+    FINAL = 0x80000000
+
+    def __init__(self, fileobj, key, chunk_size=64 * 1024):
+        self.fileobj = fileobj
+        self.aead = AESGCM(key)
+        self.chunk_size = chunk_size
+        self.prefix = os.urandom(8)
+        self.header = self.MAGIC + struct.pack(">I", chunk_size) + self.prefix
+        self.counter = 0
+        self.buffer = bytearray()
+        self.closed = False
+        fileobj.write(self.header)
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.buffer += data
+        while len(self.buffer) >= self.chunk_size:
+            self._seal(bytes(self.buffer[:self.chunk_size]), final=False)
+            del self.buffer[:self.chunk_size]
+        return len(data)
+
+    def write_text(self, text):
+        """Encode and write a str in chunk-sized slices so no full encoded copy is held."""
+        for start in range(0, len(text), self.chunk_size):
+            self.write(text[start:start + self.chunk_size])
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def close(self):
+        if not self.closed:
+            self._seal(bytes(self.buffer), final=True)
+            self.buffer = bytearray()
+            self.fileobj.flush()
+            self.closed = True
+
+    def _seal(self, plaintext, final):
+        nonce = self.prefix + struct.pack(">I", self.counter)
+        aad = self.header + struct.pack(">I?", self.counter, final)
+        ciphertext = self.aead.encrypt(nonce, plaintext, aad)
+        self.fileobj.write(struct.pack(">I", len(ciphertext) | (self.FINAL if final else 0)) + ciphertext)
+        self.counter += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+
+class EncryptedBackupReader:
+    """Read-only stream that authenticates and decrypts one chunk at a time."""
+
+    def __init__(self, fileobj, key):
+        self.fileobj = fileobj
+        self.aead = AESGCM(key)
+        header = fileobj.read(len(EncryptedBackupWriter.MAGIC) + 12)
+        if len(header) != len(EncryptedBackupWriter.MAGIC) + 12 or not header.startswith(EncryptedBackupWriter.MAGIC):
+            raise ValueError("Not an encrypted backup")
+        self.header = header
+        self.chunk_size = struct.unpack(">I", header[8:12])[0]
+        self.prefix = header[12:20]
+        self.counter = 0
+        self.buffer = b""
+        self.done = False
+
+    def _next_chunk(self):
+        length_field = self.fileobj.read(4)
+        if len(length_field) != 4:
+            raise ValueError("Encrypted backup is truncated")
+        length = struct.unpack(">I", length_field)[0]
+        final = bool(length & EncryptedBackupWriter.FINAL)
+        length &= ~EncryptedBackupWriter.FINAL
+        if length > self.chunk_size + 16:
+            raise ValueError("Encrypted backup is corrupted")
+        ciphertext = self.fileobj.read(length)
+        nonce = self.prefix + struct.pack(">I", self.counter)
+        aad = self.header + struct.pack(">I?", self.counter, final)
+        try:
+            plaintext = self.aead.decrypt(nonce, ciphertext, aad)
+        except InvalidTag:
+            raise ValueError("Encrypted backup failed authentication (wrong key or tampered file)")
+        self.counter += 1
+        if final:
+            if self.fileobj.read(1):
+                raise ValueError("Encrypted backup has trailing data")
+            self.done = True
+        return plaintext
+
+    def read(self, size=-1):
+        chunks = [self.buffer]
+        have = len(self.buffer)
+        while (size < 0 or have < size) and not self.done:
+            chunk = self._next_chunk()
+            chunks.append(chunk)
+            have += len(chunk)
+        data = b"".join(chunks)
+        if size < 0:
+            self.buffer = b""
+            return data
+        self.buffer = data[size:]
+        return data[:size]
+
+    def close(self):
+        pass
+
+class SwitchInventory:
+    """Switch inventory parsed once per CSV revision and validated up front."""
+    REQUIRED_COLUMNS = ('name', 'ip')
+    HOSTNAME_RE = re.compile(r'^(?=.{1,253}$)[A-Za-z0-9]([A-Za-z0-9-]{0,61}[A-Za-z0-9])?(\.[A-Za-z0-9]([A-Za-z0-9-]{0,61}[A-Za-z0-9])?)*$')
+
+    def __init__(self):
+        self.path = None
+        self.file_hash = None
+        self.switches = {}
+        self.errors = []
+        self.last_diff = {'added': [], 'removed': [], 'changed': []}
+        self._stat_key = None
+        self._lock = threading.Lock()
+
+    def load(self, path):
+        """Return {name: entry} for path, re-parsing only if the file content changed.
+
+        Raises FileNotFoundError if the CSV is missing and ValueError if it lacks
+        the required columns; invalid rows are skipped and listed in self.errors.
+        """
+        with self._lock:
+            real_path = os.path.realpath(path)
+            st = os.stat(real_path)
+            stat_key = (real_path, st.st_mtime_ns, st.st_size)
+            if stat_key == self._stat_key:
+                return self.switches
+            with open(real_path, 'rb') as f:
+                data = f.read()
+            file_hash = hashlib.sha256(data).hexdigest()
+            if real_path == self.path and file_hash == self.file_hash:
+                self._stat_key = stat_key
+                return self.switches
+            switches, errors = self._parse(data.decode('utf-8-sig', errors='replace'))
+            diff = self.diff(self.switches, switches)
+            if self.path is not None:
+                logging.info(f"Inventory changed: {len(diff['added'])} added, {len(diff['removed'])} removed, {len(diff['changed'])} changed")
+            self.path, self.file_hash, self._stat_key = real_path, file_hash, stat_key
+            self.switches, self.errors, self.last_diff = switches, errors, diff
+            logging.info(f"Loaded inventory {real_path}: {len(switches)} switches, {len(errors)} invalid rows")
+            return self.switches
+
+    def _parse(self, text):
+        reader = csv.DictReader(io.StringIO(text))
+        fieldnames = [(c or '').strip().lower() for c in (reader.fieldnames or [])]
+        if not all(col in fieldnames for col in self.REQUIRED_COLUMNS):
+            raise ValueError("CSV missing 'name' or 'ip'")
+        reader.fieldnames = fieldnames
+        return self._validate_rows(reader, start=2)
+
+    @classmethod
+    def _validate_rows(cls, rows, start):
+        """Validate inventory rows, returning ({name: entry}, [(line_no, name, error)]).
+
+        Every name is claimed by the first row that uses it, valid or not, so a
+        later row cannot slip in under the name of a rejected one.
+        """
+        switches = {}
+        first_row = {}
+        errors = []
+        for line_no, row in enumerate(rows, start=start):
+            row = {k: ('' if v is None else str(v)) for k, v in row.items() if k}
+            name = row.get('name', '').strip()
+            ip = row.get('ip', '').strip()
+            if not name:
+                if ip or any(v.strip() for v in row.values()):
+                    errors.append((line_no, '', "missing switch name"))
+                continue
+            if name in first_row:
+                errors.append((line_no, name, f"duplicate name (first defined on row {first_row[name]})"))
+                continue
+            first_row[name] = line_no
+            if not cls.valid_address(ip):
+                errors.append((line_no, name, f"invalid IP address or hostname '{ip}'"))
+                continue
+            # Blank override cells fall back to the default credentials
+            username = row.get('username', '').strip() or None
+            if username and any(c.isspace() for c in username):
+                errors.append((line_no, name, "username override contains whitespace"))
+                continue
+            timeout = row.get('timeout', '').strip() or None
+            if timeout is not None:
+                if not timeout.isdigit() or not 5 <= int(timeout) <= 120:
+                    errors.append((line_no, name, f"timeout override '{timeout}' must be 5-120 seconds"))
+                    continue
+                timeout = int(timeout)
+            switches[name] = {
+                'name': name,
+                'ip': ip,
+                'username': username,
+                'password': row.get('password') or None,
+                'timeout': timeout,
+                'region': row.get('region', '').strip(),
+            }
+        return switches, errors
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build an inventory from dicts with at least 'name' and 'ip' (for callers embedding the engine)."""
+        inventory = cls()
+        inventory.switches, inventory.errors = cls._validate_rows(rows, start=1)
+        return inventory
+
+    @classmethod
+    def valid_address(cls, value):
+        if not value:
+            return False
+        try:
+            ipaddress.ip_address(value)
+            return True
+        except ValueError:
+            pass
+        # All-numeric dotted strings that failed IP parsing (e.g. 10.0.0.300) are typos, not hostnames
+        if value.replace('.', '').isdigit():
+            return False
+        return bool(cls.HOSTNAME_RE.match(value))
+
+    @staticmethod
+    def diff(old, new):
+        """Compare two {name: entry} maps and return added/removed/changed switch names."""
+        added = [name for name in new if name not in old]
+        removed = [name for name in old if name not in new]
+        changed = [name for name in new if name in old and new[name] != old[name]]
+        return {'added': added, 'removed': removed, 'changed': changed}
+
+    def __iter__(self):
+        return iter(self.switches.values())
+
+    def __len__(self):
+        return len(self.switches)
+
+class RunJournal:
+    """Append-only, fsync'd progress journal that lets a crashed run be resumed."""
+
+    def __init__(self, path):
+        self.path = path
+        self.run_id = None
+        self.started = None
+        self.completed = {}
+        self._lock = threading.Lock()
+
+    def read_unfinished(self):
+        """Return the last journaled run if it never reached its end marker, else None."""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return None
+        run = None
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A torn final line is expected if the process died mid-write
+                continue
+            event = record.get('event')
+            if event == 'start':
+                run = {'run_id': record['run_id'], 'started': record['started'], 'mode': record.get('mode', ''), 'completed': {}}
+            elif run and record.get('run_id') == run['run_id']:
+                if event == 'switch':
+                    run['completed'][record['name']] = record['status']
+                elif event == 'end':
+                    run = None
+        return run
+
+    def start(self, mode, resume=None):
+        """Begin a new run (truncating the journal) or continue an unfinished one."""
+        with self._lock:
+            if resume:
+                self.run_id, self.started = resume['run_id'], resume['started']
+                self.completed = dict(resume['completed'])
+                self._append({'event': 'resume', 'run_id': self.run_id, 'time': time.time()}, repair=True)
+            else:
+                self.run_id = f"{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}"
+                self.started = time.time()
+                self.completed = {}
+                self._append({'event': 'start', 'run_id': self.run_id, 'started': self.started, 'mode': mode}, mode='w')
+            return self.run_id
+
+    def record(self, name, status):
+        with self._lock:
+            self.completed[name] = status
+            self._append({'event': 'switch', 'run_id': self.run_id, 'name': name, 'status': status})
+
+    def finish(self):
+        with self._lock:
+            self._append({'event': 'end', 'run_id': self.run_id, 'time': time.time()})
+            self.run_id = None
+
+    def _append(self, record, mode='a', repair=False):
+        prefix = ''
+        if repair:
+            try:
+                with open(self.path, 'rb') as f:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b'\n':
+                        prefix = '\n'
+            except OSError:
+                pass
+        with open(self.path, mode, encoding='utf-8') as f:
+            f.write(prefix + json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+class LatencyProfile:
+    """Learned per-switch phase latencies (EWMA mean and deviation), persisted as JSON."""
+    ALPHA = 0.25
+    BETA = 0.25
+    PHASES = ('probe', 'login', 'download')
+
+    def __init__(self, path):
+        self.path = path
+        self.profiles = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                self.profiles = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError) as e:
+            self.profiles = {}
+            if isinstance(e, json.JSONDecodeError):
+                logging.warning("Latency profile file is corrupted, relearning timings")
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            tmp_path = self.path + ".tmp"
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump(self.profiles, f)
+                os.replace(tmp_path, self.path)
+                self._dirty = False
+            except Exception as e:
+                logging.error(f"Failed to save latency profile: {str(e)}")
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def observe(self, name, phase, seconds):
+        """Fold one successful measurement into the switch's EWMA for a phase."""
+        with self._lock:
+            stats = self.profiles.setdefault(name, {}).get(phase)
+            if stats is None:
+                self.profiles[name][phase] = {'avg': seconds, 'dev': seconds / 2, 'n': 1}
+            else:
+                error = seconds - stats['avg']
+                stats['avg'] += self.ALPHA * error
+                stats['dev'] += self.BETA * (abs(error) - stats['dev'])
+                stats['n'] += 1
+            self._dirty = True
+
+    def observe_timeout(self, name, phase, timeout):
+        """Count a timed-out attempt as a sample of at least `timeout` so the learned timeout grows."""
+        self.observe(name, phase, timeout)
+
+    def timeout(self, name, phase, default, minimum, maximum):
+        """Timeout for a phase: mean plus generous headroom, or default if not yet learned."""
+        stats = self.profiles.get(name, {}).get(phase)
+        if stats is None:
+            return default
+        headroom = max(4 * stats['dev'], stats['avg']) + 2
+        return max(minimum, min(maximum, stats['avg'] + headroom))
+
+    def expected_duration(self, name):
+        """Sum of learned phase means, or None for a switch never backed up successfully."""
+        stats = self.profiles.get(name)
+        if not stats or not all(phase in stats for phase in self.PHASES):
+            return None
+        return sum(stats[phase]['avg'] for phase in self.PHASES)
+
+class LocalGitStore:
+    """Local Git repository holding the latest backup of each switch, one commit per run."""
+    AUTHOR_NAME = "AOS-CX Config Backup Tool"
+    AUTHOR_EMAIL = "backup-tool@localhost"
+    # Push output for a remote that has diverged; retrying the same push can never succeed
+    REJECTED_RE = re.compile(r'\[rejected\]|\[remote rejected\]|non-fast-forward|fetch first')
+
+    def __init__(self, repo_dir):
+        self.repo_dir = repo_dir
+        self._lock = threading.Lock()
+        self._digests = None
+
+    @staticmethod
+    def available():
+        return shutil.which('git') is not None
+
+    def _git(self, *args, check=True, env=None):
+        # Keep the windowed build from flashing a console for every git call
+        flags = subprocess.CREATE_NO_WINDOW if sys.platform == 'win32' else 0
+        return subprocess.run(['git', '-C', self.repo_dir, *args], capture_output=True, text=True,
+                              check=check, creationflags=flags, timeout=300,
+                              env=None if env is None else {**os.environ, **env})
+
+    def ensure_repo(self):
+        if os.path.isdir(os.path.join(self.repo_dir, '.git')):
+            return
+        os.makedirs(self.repo_dir, exist_ok=True)
+        self._git('init', '-q')
+        self._git('config', 'user.name', self.AUTHOR_NAME)
+        self._git('config', 'user.email', self.AUTHOR_EMAIL)
+        logging.info(f"Initialized local Git history in {self.repo_dir}")
+
+    def stage(self, safe_switch_name, backup_path, digest=None):
+        """Copy a freshly saved backup to the switch's single tracked path.
+
+        Encrypted backups get a fresh nonce every run, so their ciphertext always
+        differs; digest (a keyed hash of the plaintext) lets an unchanged config
+        keep the tracked file as is instead of producing an empty-change commit.
+        """
+        with self._lock:
+            self.ensure_repo()
+            suffix = '.txt.enc' if backup_path.endswith(ENCRYPTED_SUFFIX) else '.txt'
+            stale = os.path.join(self.repo_dir, safe_switch_name + ('.txt' if suffix == '.txt.enc' else '.txt.enc'))
+            if os.path.exists(stale):
+                os.remove(stale)
+            target = os.path.join(self.repo_dir, safe_switch_name + suffix)
+            digests = self._load_digests()
+            if suffix == '.txt.enc' and digest is not None and digests.get(safe_switch_name) == digest and os.path.exists(target):
+                return
+            shutil.copyfile(backup_path, target)
+            if suffix == '.txt.enc' and digest is not None:
+                digests[safe_switch_name] = digest
+            else:
+                digests.pop(safe_switch_name, None)
+
+    def _digest_path(self):
+        # Inside .git so the digests are never committed or pushed
+        return os.path.join(self.repo_dir, '.git', 'aoscx-digests.json')
+
+    def _load_digests(self):
+        if self._digests is None:
+            try:
+                with open(self._digest_path(), 'r', encoding='utf-8') as f:
+                    self._digests = json.load(f)
+            except (OSError, ValueError):
+                self._digests = {}
+        return self._digests
+
+    def _save_digests(self):
+        if self._digests is None:
+            return
+        tmp_path = self._digest_path() + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._digests, f)
+            os.replace(tmp_path, self._digest_path())
+        except OSError as e:
+            logging.warning(f"Failed to save local Git digests: {str(e)}")
+
+    def commit(self, message, switches=None):
+        """Commit everything staged since the last commit, or just the given switches' files.
+
+        switches are safe switch names; returns the short id or None if unchanged.
+        """
+        with self._lock:
+            if not os.path.isdir(os.path.join(self.repo_dir, '.git')):
+                return None
+            self._save_digests()
+            if switches is not None:
+                if not switches:
+                    return None
+                # One pattern covers the .txt and .txt.enc variants (safe names hold no wildcards)
+                paths = ['--'] + [f"{name}.txt*" for name in switches]
+                self._git('add', '-A', *paths)
+                if self._git('diff', '--cached', '--quiet', *paths, check=False).returncode == 0:
+                    return None
+                self._git('commit', '-q', '-m', message, *paths)
+                return self._git('rev-parse', '--short', 'HEAD').stdout.strip()
+            self._git('add', '-A')
+            if self._git('diff', '--cached', '--quiet', check=False).returncode == 0:
+                return None
+            self._git('commit', '-q', '-m', message)
+            return self._git('rev-parse', '--short', 'HEAD').stdout.strip()
+
+    def push(self, remote_url, branch):
+        """Push all local commits not yet on the remote; failures leave them for the next run."""
+        with self._lock:
+            if not os.path.isdir(os.path.join(self.repo_dir, '.git')):
+                return
+            remote_url, env = self._push_auth(remote_url)
+            self._git('push', '-q', remote_url, f"HEAD:refs/heads/{branch}", env=env)
+
+    @staticmethod
+    def _push_auth(remote_url):
+        """Split credentials out of an http(s) remote URL so they never reach git's command line.
+
+        Returns the bare URL and an environment passing the credentials as an
+        http.extraHeader config entry, which is not visible in the process list.
+        """
+        env = {'GIT_TERMINAL_PROMPT': '0'}
+        parts = urllib.parse.urlsplit(remote_url)
+        if parts.scheme not in ('http', 'https') or '@' not in parts.netloc:
+            return remote_url, env
+        userinfo, host = parts.netloc.rsplit('@', 1)
+        username, _, password = userinfo.partition(':')
+        token = base64.b64encode(f"{urllib.parse.unquote(username)}:{urllib.parse.unquote(password)}".encode('utf-8')).decode('ascii')
+        env.update({
+            'GIT_CONFIG_COUNT': '1',
+            'GIT_CONFIG_KEY_0': 'http.extraHeader',
+            'GIT_CONFIG_VALUE_0': f"Authorization: Basic {token}",
+        })
+        return urllib.parse.urlunsplit(parts._replace(netloc=host)), env
+
+class ConfigDiffer:
+    """Line-hash diff between consecutive backups of a switch, ignoring volatile lines."""
+    DEFAULT_IGNORE_PATTERNS = [
+        r'^Current configuration:',
+        r'^!\s*(Last|Generated|Time|Date)\b',
+        r'^!.*\b\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}\b',
+    ]
+    # Earlier defaults still found in saved settings, mapped to their replacement
+    SUPERSEDED_PATTERNS = {
+        r'\b\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}\b': r'^!.*\b\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}:\d{2}\b',
+    }
+    MAX_HUNK_LINES = 200
+
+    def __init__(self, ignore_patterns=None):
+        self.patterns = list(self.DEFAULT_IGNORE_PATTERNS if ignore_patterns is None else ignore_patterns)
+        self.ignore = re.compile('|'.join(f'(?:{p})' for p in self.patterns)) if self.patterns else None
+
+    def normalize(self, text):
+        lines = [line.rstrip() for line in text.splitlines()]
+        if self.ignore:
+            lines = [line for line in lines if not self.ignore.search(line)]
+        return lines
+
+    def digest(self, lines):
+        return hashlib.blake2b('\n'.join(lines).encode('utf-8'), digest_size=16).hexdigest()
+
+    def diff(self, old_text, new_text):
+        """Return a compact changeset dict, or None if the normalized configs are identical."""
+        old, new = self.normalize(old_text), self.normalize(new_text)
+        old_hashes, new_hashes = [hash(line) for line in old], [hash(line) for line in new]
+        if old_hashes == new_hashes and old == new:
+            return None
+        # Trim the common prefix/suffix so the matcher only sees the changed middle
+        start = 0
+        limit = min(len(old_hashes), len(new_hashes))
+        while start < limit and old_hashes[start] == new_hashes[start]:
+            start += 1
+        end = 0
+        while end < limit - start and old_hashes[-1 - end] == new_hashes[-1 - end]:
+            end += 1
+        matcher = difflib.SequenceMatcher(None, old_hashes[start:len(old_hashes) - end],
+                                          new_hashes[start:len(new_hashes) - end], autojunk=False)
+        hunks = []
+        added = removed = 0
+        for op, i1, i2, j1, j2 in matcher.get_opcodes():
+            if op == 'equal':
+                continue
+            removed += i2 - i1
+            added += j2 - j1
+            hunks.append({
+                'op': op,
+                'old_line': start + i1 + 1,
+                'new_line': start + j1 + 1,
+                'old': old[start + i1:start + i2][:self.MAX_HUNK_LINES],
+                'new': new[start + j1:start + j2][:self.MAX_HUNK_LINES],
+            })
+        return {'added': added, 'removed': removed, 'digest': self.digest(new), 'hunks': hunks}
+
+class ConfigSearchIndex:
+    """Incremental fleet-wide index of backup lines in SQLite.
+
+    Each distinct line is stored once and linked to the backup versions that
+    contain it; an FTS5 trigram table narrows substring and regex queries to
+    candidate lines before they are verified in Python.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS versions (id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, switch TEXT NOT NULL,
+                                             ip TEXT, saved TEXT NOT NULL, latest INTEGER NOT NULL DEFAULT 1);
+        CREATE INDEX IF NOT EXISTS versions_switch ON versions(switch, latest);
+        CREATE TABLE IF NOT EXISTS lines (id INTEGER PRIMARY KEY, text TEXT UNIQUE NOT NULL);
+        CREATE TABLE IF NOT EXISTS postings (line_id INTEGER NOT NULL, version_id INTEGER NOT NULL,
+                                             PRIMARY KEY (line_id, version_id)) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS postings_version ON postings(version_id);
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        try:
+            self._conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS lines_fts USING fts5(text, tokenize='trigram')")
+            self.has_fts = True
+        except sqlite3.OperationalError:
+            # SQLite without FTS5/trigram support: queries scan the deduplicated lines instead
+            self.has_fts = False
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def version_count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM versions").fetchone()[0]
+
+    def paths(self):
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT path FROM versions")]
+
+    def add_version(self, switch, ip, path, saved, text):
+        """Index one backup; path is relative to base_dir and identifies the version."""
+        lines = {line.rstrip() for line in text.splitlines()}
+        lines.discard('')
+        with self._lock, self._conn:
+            conn = self._conn
+            conn.execute("UPDATE versions SET latest = 0 WHERE switch = ? AND latest = 1", (switch,))
+            conn.execute("DELETE FROM postings WHERE version_id IN (SELECT id FROM versions WHERE path = ?)", (path,))
+            conn.execute("DELETE FROM versions WHERE path = ?", (path,))
+            version_id = conn.execute("INSERT INTO versions (path, switch, ip, saved, latest) VALUES (?, ?, ?, ?, 1)",
+                                      (path, switch, ip, saved)).lastrowid
+            max_line_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM lines").fetchone()[0]
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS new_lines (text TEXT PRIMARY KEY) WITHOUT ROWID")
+            conn.execute("DELETE FROM new_lines")
+            conn.executemany("INSERT OR IGNORE INTO new_lines (text) VALUES (?)", ((line,) for line in lines))
+            conn.execute("INSERT OR IGNORE INTO lines (text) SELECT text FROM new_lines")
+            if self.has_fts:
+                conn.execute("INSERT INTO lines_fts (rowid, text) SELECT id, text FROM lines WHERE id > ?", (max_line_id,))
+            conn.execute("INSERT OR IGNORE INTO postings (line_id, version_id) "
+                         "SELECT l.id, ? FROM new_lines n JOIN lines l ON l.text = n.text", (version_id,))
+        return version_id
+
+    def remove_version(self, path):
+        """Drop a version (e.g. deleted by retention) and any lines no other version uses."""
+        with self._lock, self._conn:
+            conn = self._conn
+            row = conn.execute("SELECT id, switch, latest FROM versions WHERE path = ?", (path,)).fetchone()
+            if not row:
+                return
+            version_id, switch, latest = row
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS gone_lines (id INTEGER PRIMARY KEY)")
+            conn.execute("DELETE FROM gone_lines")
+            conn.execute("INSERT INTO gone_lines SELECT line_id FROM postings WHERE version_id = ?", (version_id,))
+            conn.execute("DELETE FROM postings WHERE version_id = ?", (version_id,))
+            conn.execute("DELETE FROM versions WHERE id = ?", (version_id,))
+            conn.execute("DELETE FROM gone_lines WHERE EXISTS (SELECT 1 FROM postings p WHERE p.line_id = gone_lines.id)")
+            conn.execute("DELETE FROM lines WHERE id IN (SELECT id FROM gone_lines)")
+            if self.has_fts:
+                conn.execute("DELETE FROM lines_fts WHERE rowid IN (SELECT id FROM gone_lines)")
+            if latest:
+                conn.execute("UPDATE versions SET latest = 1 WHERE id = (SELECT id FROM versions WHERE switch = ? ORDER BY saved DESC LIMIT 1)", (switch,))
+
+    def search(self, pattern, regex=False, all_versions=False, limit=1000):
+        """Return [(switch, ip, saved, path, line)] for lines matching a substring or regex."""
+        if regex:
+            matcher = re.compile(pattern).search
+            literals = self.required_literals(pattern)
+        else:
+            needle = pattern.lower()
+            def matcher(line):
+                return needle in line.lower()
+            literals = [needle]
+        literals = [lit for lit in literals if len(lit) >= 3]
+        with self._lock:
+            conn = self._conn
+            if literals and self.has_fts:
+                query = ' AND '.join('"' + lit.replace('"', '""') + '"' for lit in literals)
+                candidates = conn.execute("SELECT l.id, l.text FROM lines_fts f JOIN lines l ON l.id = f.rowid "
+                                          "WHERE lines_fts MATCH ?", (query,))
+            else:
+                candidates = conn.execute("SELECT id, text FROM lines")
+            matched = [(line_id,) for line_id, text in candidates if matcher(text)]
+            if not matched:
+                return []
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS hit_lines (id INTEGER PRIMARY KEY)")
+            conn.execute("DELETE FROM hit_lines")
+            conn.executemany("INSERT OR IGNORE INTO hit_lines (id) VALUES (?)", matched)
+            rows = conn.execute(
+                "SELECT v.switch, v.ip, v.saved, v.path, l.text FROM hit_lines h "
+                "JOIN postings p ON p.line_id = h.id JOIN versions v ON v.id = p.version_id "
+                "JOIN lines l ON l.id = h.id "
+                + ("" if all_versions else "WHERE v.latest = 1 ")
+                + "ORDER BY v.switch, v.saved DESC, l.text LIMIT ?", (limit,)).fetchall()
+            conn.commit()
+            return rows
+
+    @staticmethod
+    def required_literals(pattern):
+        """Literal runs every match of pattern must contain (empty if alternation makes that unknowable)."""
+        try:
+            parsed = sre_parse.parse(pattern)
+        except re.error:
+            return []
+        literals, run = [], []
+        for op, arg in parsed:
+            if op is sre_constants.LITERAL:
+                run.append(chr(arg))
+                continue
+            if run:
+                literals.append(''.join(run).lower())
+                run = []
+            if op is sre_constants.BRANCH:
+                return []
+        if run:
+            literals.append(''.join(run).lower())
+        return literals
+
+class StructuredConfig:
+    """Compact normalized form of the JSON running-config.
+
+    Tables (top-level objects whose values are all objects, e.g. Interface,
+    VLAN, ACL) become rows of [record_id, presence_mask, values...] over a
+    per-table column list that indexes one shared key dictionary; everything
+    else is kept verbatim under "other".
+    """
+    FORMAT = "aoscx-normalized/1"
+
+    @staticmethod
+    def normalize(data):
+        keys, key_ids = [], {}
+        tables, other = {}, {}
+        for table_name, table in data.items():
+            if not (isinstance(table, dict) and table and all(isinstance(r, dict) for r in table.values())):
+                other[table_name] = table
+                continue
+            columns, positions, rows = [], {}, []
+            for record_id, record in table.items():
+                present = []
+                for key, value in record.items():
+                    key_id = key_ids.get(key)
+                    if key_id is None:
+                        key_id = key_ids[key] = len(keys)
+                        keys.append(key)
+                    position = positions.get(key_id)
+                    if position is None:
+                        position = positions[key_id] = len(columns)
+                        columns.append(key_id)
+                    present.append((position, value))
+                present.sort(key=lambda item: item[0])
+                mask = 0
+                for position, _ in present:
+                    mask |= 1 << position
+                rows.append([record_id, mask] + [value for _, value in present])
+            tables[table_name] = {'columns': columns, 'rows': rows}
+        return {'format': StructuredConfig.FORMAT, 'keys': keys, 'tables': tables, 'other': other}
+
+    @staticmethod
+    def denormalize(doc):
+        data = dict(doc['other'])
+        for table_name in doc['tables']:
+            data[table_name] = dict(StructuredConfig.records(doc, table_name))
+        return data
+
+    @staticmethod
+    def records(doc, table_name):
+        """Yield (record_id, {key: value}) for one table."""
+        table = doc['tables'].get(table_name)
+        if not table:
+            return
+        names = [doc['keys'][key_id] for key_id in table['columns']]
+        for row in table['rows']:
+            mask, values, record = row[1], iter(row[2:]), {}
+            position = 0
+            while mask:
+                if mask & 1:
+                    record[names[position]] = next(values)
+                mask >>= 1
+                position += 1
+            yield row[0], record
+
+    @staticmethod
+    def field(doc, table_name, key):
+        """Return {record_id: value} for one field without rebuilding whole records."""
+        table = doc['tables'].get(table_name)
+        try:
+            position = table['columns'].index(doc['keys'].index(key))
+        except (TypeError, ValueError):
+            return {}
+        bit, below = 1 << position, (1 << position) - 1
+        return {row[0]: row[2 + (row[1] & below).bit_count()] for row in table['rows'] if row[1] & bit}
+
+    @staticmethod
+    def diff_fields(old_doc, new_doc, limit=500):
+        """List field-level changes as [table, record_id, field, old, new] (None = absent).
+
+        Top-level sections that are not tables (System, ...) are compared too,
+        with record_id None, and field None when the section is not an object.
+        """
+        changes = []
+        for table_name in sorted(set(old_doc['tables']) | set(new_doc['tables'])):
+            old_records = dict(StructuredConfig.records(old_doc, table_name))
+            new_records = dict(StructuredConfig.records(new_doc, table_name))
+            for record_id in sorted(set(old_records) | set(new_records)):
+                old_record, new_record = old_records.get(record_id, {}), new_records.get(record_id, {})
+                if old_record == new_record:
+                    continue
+                for key in sorted(set(old_record) | set(new_record)):
+                    if old_record.get(key) != new_record.get(key):
+                        changes.append([table_name, record_id, key, old_record.get(key), new_record.get(key)])
+                        if len(changes) >= limit:
+                            return changes
+        old_other, new_other = old_doc.get('other', {}), new_doc.get('other', {})
+        for section in sorted(set(old_other) | set(new_other)):
+            old_value, new_value = old_other.get(section), new_other.get(section)
+            if old_value == new_value:
+                continue
+            old_fields = {} if old_value is None else old_value
+            new_fields = {} if new_value is None else new_value
+            if isinstance(old_fields, dict) and isinstance(new_fields, dict):
+                pairs = [(key, old_fields.get(key), new_fields.get(key)) for key in sorted(set(old_fields) | set(new_fields))
+                         if old_fields.get(key) != new_fields.get(key)]
+            else:
+                pairs = [(None, old_value, new_value)]
+            for key, old, new in pairs:
+                changes.append([section, None, key, old, new])
+                if len(changes) >= limit:
+                    return changes
+        return changes
+
+    @staticmethod
+    def save(path, doc, key=None, chunk_size=64 * 1024):
+        """Write gzipped JSON; with a key the gzip stream is encrypted as it is written.
+
+        The file only appears at path once it was written completely.
+        """
+        tmp_path = path + ".tmp"
+        try:
+            if key is None:
+                with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+                    json.dump(doc, f, separators=(',', ':'))
+            else:
+                with open(tmp_path, 'wb') as raw, EncryptedBackupWriter(raw, key, chunk_size) as sealed:
+                    with gzip.GzipFile(fileobj=sealed, mode='wb') as gz, io.TextIOWrapper(gz, encoding='utf-8') as f:
+                        json.dump(doc, f, separators=(',', ':'))
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @staticmethod
+    def load(path, key=None):
+        if not path.endswith(ENCRYPTED_SUFFIX):
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                return json.load(f)
+        with open(path, 'rb') as raw, gzip.GzipFile(fileobj=EncryptedBackupReader(raw, key), mode='rb') as gz:
+            return json.load(io.TextIOWrapper(gz, encoding='utf-8'))
+
+class CollectorQueue:
+    """Shared SQLite work queue through which several collectors split one inventory.
+
+    Switches are claimed with time-limited leases that the holder renews while
+    working; expired or failed claims become claimable again, so a collector
+    that dies mid-run leaves no gaps. Every call opens its own short-lived
+    connection so the file can live on a share used by several machines.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS epochs (id INTEGER PRIMARY KEY, started REAL NOT NULL, seeded_by TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS work (epoch INTEGER NOT NULL, switch TEXT NOT NULL, ip TEXT NOT NULL,
+                                         region TEXT NOT NULL DEFAULT '', state TEXT NOT NULL DEFAULT 'pending',
+                                         owner TEXT, last_owner TEXT, lease_expires REAL, attempts INTEGER NOT NULL DEFAULT 0,
+                                         result TEXT, finished REAL, PRIMARY KEY (epoch, switch));
+        CREATE INDEX IF NOT EXISTS work_state ON work(epoch, state);
+        CREATE TABLE IF NOT EXISTS collectors (name TEXT PRIMARY KEY, region TEXT, last_seen REAL);
+    """
+
+    def __init__(self, path):
+        self.path = path
+        conn = self._connect()
+        try:
+            conn.executescript(self.SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self):
+        # Rollback journal rather than WAL: WAL needs shared memory, which network filesystems lack
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=DELETE")
+        return conn
+
+    def _transaction(self, conn):
+        conn.execute("BEGIN IMMEDIATE")
+        return conn
+
+    def open_epoch(self, entries, window_seconds, collector):
+        """Join the current collection epoch, or start and seed a new one; returns (epoch, created).
+
+        Starting an epoch prunes those older than the window except the previous
+        one, which keeps the merged status populated while the new epoch fills in.
+        """
+        conn = self._connect()
+        try:
+            self._transaction(conn)
+            now = time.time()
+            latest = conn.execute("SELECT id, started FROM epochs ORDER BY id DESC LIMIT 1").fetchone()
+            created = not latest or now - latest[1] >= window_seconds
+            epoch = conn.execute("INSERT INTO epochs (started, seeded_by) VALUES (?, ?)", (now, collector)).lastrowid if created else latest[0]
+            if created and latest:
+                expired = [row[0] for row in conn.execute("SELECT id FROM epochs WHERE started < ? AND id != ?", (now - window_seconds, latest[0]))]
+                conn.executemany("DELETE FROM work WHERE epoch = ?", ((old,) for old in expired))
+                conn.executemany("DELETE FROM epochs WHERE id = ?", ((old,) for old in expired))
+            # Joining collectors add any switches only their copy of the inventory knows about
+            conn.executemany("INSERT OR IGNORE INTO work (epoch, switch, ip, region) VALUES (?, ?, ?, ?)",
+                             ((epoch, e['name'], e['ip'], e.get('region') or '') for e in entries))
+            conn.execute("COMMIT")
+            return epoch, created
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def claim(self, epoch, collector, region, lease_seconds, max_attempts):
+        """Lease the next claimable switch; returns (switch, ip) or None if nothing is claimable now."""
+        conn = self._connect()
+        try:
+            self._transaction(conn)
+            now = time.time()
+            conn.execute("INSERT OR REPLACE INTO collectors (name, region, last_seen) VALUES (?, ?, ?)", (collector, region, now))
+            conn.execute("UPDATE work SET state = 'failed', owner = NULL WHERE epoch = ? AND state = 'claimed' "
+                         "AND lease_expires < ? AND attempts >= ?", (epoch, now, max_attempts))
+            row = conn.execute(
+                "SELECT switch, ip FROM work WHERE epoch = ? AND (state = 'pending' OR (state = 'claimed' AND lease_expires < ?)) "
+                "ORDER BY region = ? DESC, COALESCE(last_owner = ?, 0), attempts LIMIT 1",
+                (epoch, now, region or '', collector)).fetchone()
+            if row:
+                conn.execute("UPDATE work SET state = 'claimed', owner = ?, last_owner = ?, lease_expires = ?, attempts = attempts + 1 "
+                             "WHERE epoch = ? AND switch = ?", (collector, collector, now + lease_seconds, epoch, row[0]))
+            conn.execute("COMMIT")
+            return row
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def renew(self, epoch, collector, switches, lease_seconds):
+        conn = self._connect()
+        try:
+            now = time.time()
+            conn.execute("UPDATE collectors SET last_seen = ? WHERE name = ?", (now, collector))
+            conn.executemany("UPDATE work SET lease_expires = ? WHERE epoch = ? AND switch = ? AND owner = ? AND state = 'claimed'",
+                             ((now + lease_seconds, epoch, switch, collector) for switch in switches))
+        finally:
+            conn.close()
+
+    def complete(self, epoch, switch, collector, result):
+        conn = self._connect()
+        try:
+            updated = conn.execute("UPDATE work SET state = 'done', result = ?, finished = ? WHERE epoch = ? AND switch = ? AND owner = ? AND state = 'claimed'",
+                                   (json.dumps(result), time.time(), epoch, switch, collector)).rowcount
+        finally:
+            conn.close()
+        if not updated:
+            logging.warning(f"Result for {switch} from {collector} not recorded: its lease expired and the switch was reclaimed or given up")
+
+    def release(self, epoch, switch, collector, result, max_attempts):
+        """Hand a failed claim back; it is retried (preferably elsewhere) until max_attempts."""
+        conn = self._connect()
+        try:
+            conn.execute("UPDATE work SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, owner = NULL, "
+                         "lease_expires = NULL, result = ?, finished = ? WHERE epoch = ? AND switch = ? AND owner = ? AND state = 'claimed'",
+                         (max_attempts, json.dumps(result), time.time(), epoch, switch, collector))
+        finally:
+            conn.close()
+
+    def outstanding(self, epoch):
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT COUNT(*) FROM work WHERE epoch = ? AND state IN ('pending', 'claimed')", (epoch,)).fetchone()[0]
+        finally:
+            conn.close()
+
+    def size(self, epoch):
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT COUNT(*) FROM work WHERE epoch = ?", (epoch,)).fetchone()[0]
+        finally:
+            conn.close()
+
+    def merged_status(self):
+        """Latest recorded result per switch across all collectors and epochs."""
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT switch, result, last_owner FROM work WHERE result IS NOT NULL ORDER BY finished").fetchall()
+        finally:
+            conn.close()
+        merged = {}
+        for switch, result, owner in rows:
+            try:
+                merged[switch] = dict(json.loads(result), collector=owner)
+            except (TypeError, ValueError):
+                continue
+        return merged
+
+    def summary(self):
+        """Return (epoch_id, started, {state: count}, [(collector, region, last_seen)]) for the latest epoch."""
+        conn = self._connect()
+        try:
+            latest = conn.execute("SELECT id, started FROM epochs ORDER BY id DESC LIMIT 1").fetchone()
+            counts = dict(conn.execute("SELECT state, COUNT(*) FROM work WHERE epoch = ? GROUP BY state", (latest[0],)).fetchall()) if latest else {}
+            collectors = conn.execute("SELECT name, region, last_seen FROM collectors ORDER BY name").fetchall()
+        finally:
+            conn.close()
+        return (latest[0] if latest else None, latest[1] if latest else None, counts, collectors)
+
+class _ResumableSSLSocket(ssl.SSLSocket):
+    def close(self):
+        # TLS 1.3 tickets arrive after the handshake, so the session is only resumable once data was read
+        self.context.remember_session(self)
+        super().close()
+
+class _ResumingSSLContext(ssl.SSLContext):
+    """SSLContext that offers each peer its last TLS session so reconnects skip the full handshake."""
+    sslsocket_class = _ResumableSSLSocket
+
+    def wrap_socket(self, sock, *args, session=None, **kwargs):
+        try:
+            peer = sock.getpeername()[:2]
+        except OSError:
+            peer = None
+        cached = self.tls_sessions.get(peer) if session is None else session
+        ssl_sock = super().wrap_socket(sock, *args, session=cached, **kwargs)
+        self.remember_session(ssl_sock)
+        return ssl_sock
+
+    def remember_session(self, ssl_sock):
+        try:
+            peer = ssl_sock.getpeername()[:2]
+            session = ssl_sock.session
+            resumable = session is not None and (session.has_ticket or ssl_sock.version() != "TLSv1.3")
+        except (OSError, ValueError, AttributeError):
+            return
+        if resumable:
+            self.tls_sessions[peer] = session
+
+class _PooledAdapter(HTTPAdapter):
+    """One keep-alive connection per switch, optionally with a shared resuming SSLContext."""
+
+    def __init__(self, ssl_context=None):
+        self.ssl_context = ssl_context
+        super().__init__(pool_connections=1, pool_maxsize=1)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.ssl_context is not None:
+            kwargs['ssl_context'] = self.ssl_context
+        super().init_poolmanager(*args, **kwargs)
+
+class SwitchSession:
+    """Keep-alive HTTPS session to one switch and the REST login it holds, if any."""
+
+    def __init__(self, session, verify, tls_resumption):
+        self.session = session
+        self.verify = verify
+        self.tls_resumption = tls_resumption
+        self.lock = threading.Lock()
+        self.username = None
+        self.logged_in = False
+        self.last_used = 0.0
+
+class SwitchSessionPool:
+    """Per-switch REST sessions reused across fetches (and, if enabled, across runs).
+
+    Each switch gets one requests.Session holding a single pooled keep-alive
+    connection, and at most one REST login from this process at a time, so
+    concurrent workers never spend more than one of the switch's sessions.
+    Logged-in sessions idle longer than the reuse window are logged out by
+    expire_idle(); close_all() logs everything out on shutdown.
+    """
+    API = "rest/v10.04"
+    KEEPALIVE_SECONDS = 60
+
+    def __init__(self):
+        self._hosts = {}
+        self._lock = threading.Lock()
+        self._contexts = {}
+
+    def _context(self, verify):
+        # One context per verify mode: cached TLS sessions only resume within the context that made them
+        if verify not in self._contexts:
+            context = _ResumingSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            # urllib3 still matches the hostname itself when verification is on
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_REQUIRED if verify else ssl.CERT_NONE
+            if verify:
+                context.load_default_certs()
+            context.tls_sessions = {}
+            self._contexts[verify] = context
+        return self._contexts[verify]
+
+    @contextmanager
+    def host(self, ip, verify, tls_resumption=False):
+        """Yield the SwitchSession for ip with exclusive use of it for the duration."""
+        stale, fresh = None, False
+        with self._lock:
+            entry = self._hosts.get(ip)
+            if entry is None or (entry.verify, entry.tls_resumption) != (verify, tls_resumption):
+                stale, fresh = entry, True
+                session = requests.Session()
+                session.mount("https://", _PooledAdapter(self._context(verify) if tls_resumption else None))
+                entry = self._hosts[ip] = SwitchSession(session, verify, tls_resumption)
+                # Taken before the pool lock is released (a new lock never blocks) so nobody logs in
+                # on the replacement until the stale session has logged out
+                entry.lock.acquire()
+        if not fresh:
+            entry.lock.acquire()
+        try:
+            if stale is not None:
+                # Outside the pool lock: this waits for whoever is still using the stale session
+                self._discard(ip, stale)
+            yield entry
+        finally:
+            entry.last_used = time.monotonic()
+            entry.lock.release()
+
+    def login(self, entry, ip, username, password, timeout):
+        if entry.logged_in and entry.username != username:
+            self.logout(entry, ip, timeout)
+        response = entry.session.post(f"https://{ip}/{self.API}/login", data={"username": username, "password": password}, verify=entry.verify, timeout=timeout)
+        if response.status_code in (401, 503) and "session" in response.text.lower():
+            # Reported separately so a full session table is not mistaken for bad credentials
+            logging.error(f"{ip} refused login: REST session limit reached ({response.text[:200].strip()})")
+        response.raise_for_status()
+        entry.logged_in = True
+        entry.username = username
+
+    def logout(self, entry, ip, timeout=10):
+        if not entry.logged_in:
+            return
+        entry.logged_in = False
+        try:
+            entry.session.post(f"https://{ip}/{self.API}/logout", verify=entry.verify, timeout=timeout)
+            logging.info(f"Logged out from {ip}")
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Failed to logout from {ip}: {str(e)}")
+
+    def expire_idle(self, max_idle_seconds):
+        """Log out sessions idle longer than max_idle_seconds and drop idle connections; busy ones are skipped."""
+        now = time.monotonic()
+        with self._lock:
+            entries = list(self._hosts.items())
+        for ip, entry in entries:
+            idle = now - entry.last_used
+            if idle <= min(max_idle_seconds, self.KEEPALIVE_SECONDS) or not entry.lock.acquire(blocking=False):
+                continue
+            try:
+                if entry.logged_in and idle > max_idle_seconds:
+                    self.logout(entry, ip)
+                if not entry.logged_in and idle > self.KEEPALIVE_SECONDS:
+                    # Large fleets would otherwise keep one idle socket per switch open between runs
+                    with self._lock:
+                        if self._hosts.get(ip) is entry:
+                            del self._hosts[ip]
+                    entry.session.close()
+            finally:
+                entry.lock.release()
+
+    def _discard(self, ip, entry):
+        with entry.lock:
+            self.logout(entry, ip)
+            entry.session.close()
+
+    def close_all(self):
+        """Log out of every switch and drop pooled connections."""
+        with self._lock:
+            entries, self._hosts = self._hosts, {}
+        for ip, entry in entries.items():
+            self._discard(ip, entry)
+
+class BackupJob:
+    """One queued switch backup; `done` is set once `result` (True on success) is known.
+
+    progress is (position, total) for on-demand batches; None counts the job
+    against the full run's progress. change is the diff recorded under run_id,
+    for runs that adopted the job instead of queuing their own.
+    """
+    __slots__ = ('priority', 'row', 'run_id', 'journaled', 'progress', 'enqueued', 'started', 'result', 'change', 'done')
+
+    def __init__(self, priority, row, run_id, journaled=True, progress=None):
+        self.priority = priority
+        self.row = row
+        self.run_id = run_id
+        self.journaled = journaled
+        self.progress = progress
+        self.enqueued = time.monotonic()
+        self.started = None
+        self.result = None
+        self.change = None
+        self.done = threading.Event()
+
+class BackupJobQueue:
+    """Priority queue between collection runs and the backup workers.
+
+    Lower priority values are served first, FIFO within a priority, so an
+    on-demand backup only waits for the switches already in progress, never for
+    the rest of a full run. A switch is never queued twice: queuing one that is
+    still waiting returns that job (promoted if the new request is more urgent),
+    and a less urgent request for a switch being backed up right now adopts the
+    running job, since it would only fetch the same config again.
+    """
+    URGENT, TRIGGERED, SCHEDULED = 0, 1, 2
+    NAMES = {URGENT: "on-demand", TRIGGERED: "triggered", SCHEDULED: "scheduled"}
+    WAIT_SAMPLES = 200
+
+    def __init__(self):
+        self._heap = []
+        self._seq = itertools.count()
+        self._waiting = {}
+        self._running = {}
+        self._cond = threading.Condition()
+        self.running = 0
+        self.waits = {priority: deque(maxlen=self.WAIT_SAMPLES) for priority in self.NAMES}
+
+    def put(self, row, run_id, priority=SCHEDULED, journaled=True, progress=None):
+        with self._cond:
+            job = self._waiting.get(row['name'])
+            if job is not None:
+                if priority < job.priority:
+                    # The stale heap entry is skipped in get()
+                    job.priority = priority
+                    heapq.heappush(self._heap, (priority, next(self._seq), job))
+                    self._cond.notify()
+                return job
+            job = self._running.get(row['name'])
+            if job is not None and priority > job.priority:
+                return job
+            job = BackupJob(priority, row, run_id, journaled, progress)
+            self._waiting[row['name']] = job
+            heapq.heappush(self._heap, (priority, next(self._seq), job))
+            self._cond.notify()
+            return job
+
+    def get(self, timeout=None):
+        """Take the most urgent waiting job, or return None after `timeout` seconds without one."""
+        with self._cond:
+            while True:
+                while self._heap:
+                    priority, _, job = heapq.heappop(self._heap)
+                    if job.started is not None or priority != job.priority:
+                        continue
+                    job.started = time.monotonic()
+                    if self._waiting.get(job.row['name']) is job:
+                        del self._waiting[job.row['name']]
+                    self._running[job.row['name']] = job
+                    self.running += 1
+                    self.waits[priority].append(job.started - job.enqueued)
+                    return job
+                if not self._cond.wait(timeout):
+                    return None
+
+    def task_done(self, job, result):
+        with self._cond:
+            self.running -= 1
+            if self._running.get(job.row['name']) is job:
+                del self._running[job.row['name']]
+        job.result = result
+        job.done.set()
+
+    def pending(self):
+        with self._cond:
+            return any(job.started is None and priority == job.priority for priority, _, job in self._heap)
+
+    def stats(self):
+        """Waiting jobs per priority name, running jobs and wait times in seconds.
+
+        'average' covers the last WAIT_SAMPLES jobs started in each class and
+        'oldest' is how long the longest-waiting queued job has been waiting.
+        """
+        now = time.monotonic()
+        with self._cond:
+            waiting = dict.fromkeys(self.NAMES.values(), 0)
+            oldest = dict.fromkeys(self.NAMES.values(), 0.0)
+            for priority, _, job in self._heap:
+                if job.started is None and priority == job.priority:
+                    name = self.NAMES[priority]
+                    waiting[name] += 1
+                    oldest[name] = max(oldest[name], now - job.enqueued)
+            average = {self.NAMES[priority]: sum(samples) / len(samples) for priority, samples in self.waits.items() if samples}
+            return {'waiting': waiting, 'running': self.running, 'oldest': oldest, 'average': average}
+
+class ConfigChangeListener:
+    """Syslog (UDP and TCP) and local webhook listener that turns config changes into targeted backups.
+
+    resolve(source_ip, hostname) maps a message to an inventory switch name and
+    trigger(names) queues the backup and must return without waiting for it.
+    Changes are debounced per switch: the backup fires once no new change
+    arrived for `debounce` seconds, or after 4x that at the latest, so a burst
+    of commits produces a single fetch.
+    """
+    DEFAULT_PATTERN = (r"running[- ]config|startup[- ]config|config(uration)?\s*(change|changed|modified|updated|saved|written)"
+                       r"|write memory|checkpoint")
+    SYSLOG_HOST_RE = re.compile(r"^<\d{1,3}>(?:1 \S+ |[A-Z][a-z]{2} [ \d]\d \d\d:\d\d:\d\d )?(\S+) ")
+
+    MAX_WEBHOOK_BODY = 65536
+    WEBHOOK_TIMEOUT = 10
+
+    def __init__(self, resolve, trigger, syslog_port=514, webhook_port=8514, debounce=30, pattern=None, bind_address="127.0.0.1"):
+        self.resolve = resolve
+        self.trigger = trigger
+        self.syslog_port = syslog_port
+        self.webhook_port = webhook_port
+        self.debounce = debounce
+        self.pattern = re.compile(pattern or self.DEFAULT_PATTERN, re.IGNORECASE)
+        self.bind_address = bind_address
+        self.pending = {}
+        self.condition = threading.Condition()
+        self.servers = []
+        self.serving = False
+        self.stopped = threading.Event()
+
+    def start(self):
+        """Bind every listener (raising OSError if a port is taken) and start the worker threads."""
+        listener = self
+
+        class SyslogUDPHandler(socketserver.BaseRequestHandler):
+            def handle(self):
+                listener.handle_syslog(self.request[0], self.client_address[0])
+
+        class SyslogTCPHandler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for message in listener.read_tcp_frames(self.rfile):
+                    listener.handle_syslog(message, self.client_address[0])
+
+        class WebhookHandler(BaseHTTPRequestHandler):
+            # Applied to the socket by StreamRequestHandler, so a stalled client cannot hold a thread
+            timeout = listener.WEBHOOK_TIMEOUT
+
+            def do_POST(self):
+                length = self.headers.get("Content-Length")
+                if length is None:
+                    return self.reply(411, {"error": "Content-Length required"}, close=True)
+                try:
+                    length = int(length)
+                except ValueError:
+                    return self.reply(400, {"error": "invalid Content-Length"}, close=True)
+                if length < 0:
+                    return self.reply(400, {"error": "invalid Content-Length"}, close=True)
+                if length > listener.MAX_WEBHOOK_BODY:
+                    return self.reply(413, {"error": f"body larger than {listener.MAX_WEBHOOK_BODY} bytes"}, close=True)
+                self.reply(*listener.handle_webhook(self.rfile.read(length)))
+
+            def reply(self, status, body, close=False):
+                # close: the body was not read, so the connection cannot carry another request
+                self.close_connection = self.close_connection or close
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                if close:
+                    self.send_header("Connection", "close")
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                logging.debug(f"Webhook: {format % args}")
+
+        class SyslogTCPServer(socketserver.ThreadingTCPServer):
+            allow_reuse_address = True
+
+        try:
+            if self.syslog_port:
+                # Datagrams are handled inline on the server thread; handle_syslog only matches and queues
+                self.servers.append(socketserver.UDPServer((self.bind_address, self.syslog_port), SyslogUDPHandler))
+                self.servers.append(SyslogTCPServer((self.bind_address, self.syslog_port), SyslogTCPHandler))
+            if self.webhook_port:
+                # The webhook has no authentication, so it only listens on loopback
+                self.servers.append(ThreadingHTTPServer(("127.0.0.1", self.webhook_port), WebhookHandler))
+        except OSError:
+            self.stop()
+            raise
+        for server in self.servers:
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.serving = True
+        threading.Thread(target=self._run_debounced, daemon=True).start()
+        syslog = f"{self.bind_address}:{self.syslog_port}" if self.syslog_port else 'off'
+        logging.info(f"Config change listener started (syslog udp/tcp {syslog}, webhook 127.0.0.1:{self.webhook_port or 'off'})")
+
+    def stop(self):
+        self.stopped.set()
+        with self.condition:
+            self.condition.notify_all()
+        for server in self.servers:
+            if self.serving:
+                server.shutdown()
+            server.server_close()
+        self.servers = []
+        self.serving = False
+
+    @staticmethod
+    def read_tcp_frames(stream):
+        """Yield syslog messages from a TCP stream using octet counting (RFC 6587) or newline framing."""
+        while True:
+            first = stream.read(1)
+            if not first:
+                return
+            if first.isdigit():
+                count = first
+                while True:
+                    char = stream.read(1)
+                    if not char or not char.isdigit():
+                        break
+                    count += char
+                if char == b" " and int(count) <= 65536:
+                    yield stream.read(int(count))
+                    continue
+                yield count + char + stream.readline(65536)
+            elif first not in b"\r\n":
+                yield first + stream.readline(65536)
+
+    def handle_syslog(self, data, source_ip):
+        message = data.decode('utf-8', errors='replace').strip()
+        if not self.pattern.search(message):
+            return
+        match = self.SYSLOG_HOST_RE.match(message)
+        name = self.resolve(source_ip, match.group(1) if match else None)
+        if name is None:
+            logging.info(f"Config change from {source_ip} does not match any inventory switch: {message[:120]}")
+            return
+        self.queue(name, f"syslog from {source_ip}")
+
+    def handle_webhook(self, body):
+        """Accept {"switch": name} or {"ip": address} (or {"message": syslog text}); returns (http status, reply)."""
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            return 400, {"error": "body must be JSON"}
+        if not isinstance(payload, dict):
+            return 400, {"error": "body must be a JSON object"}
+        for key in ("switch", "ip", "message"):
+            if payload.get(key) is not None and not isinstance(payload[key], str):
+                return 400, {"error": f"'{key}' must be a string"}
+        if payload.get("message") and not self.pattern.search(payload["message"]):
+            return 200, {"queued": None, "reason": "not a config change"}
+        name = self.resolve(payload.get("ip"), payload.get("switch"))
+        if name is None:
+            return 404, {"error": "switch not in inventory"}
+        self.queue(name, "webhook")
+        return 202, {"queued": name}
+
+    def queue(self, name, source):
+        now = time.monotonic()
+        with self.condition:
+            first_seen, _ = self.pending.get(name, (now, now))
+            self.pending[name] = (first_seen, now)
+            self.condition.notify()
+        logging.info(f"Config change on {name} ({source}); backup queued")
+
+    def _due(self, first_seen, last_seen):
+        return min(last_seen + self.debounce, first_seen + self.debounce * 4)
+
+    def _run_debounced(self):
+        while not self.stopped.is_set():
+            with self.condition:
+                now = time.monotonic()
+                due = [name for name, seen in self.pending.items() if self._due(*seen) <= now]
+                if not due:
+                    next_due = min((self._due(*seen) for seen in self.pending.values()), default=now + 60)
+                    self.condition.wait(max(0.05, next_due - now))
+                    continue
+                for name in due:
+                    del self.pending[name]
+            try:
+                self.trigger(due)
+            except Exception as e:
+                logging.error(f"Triggered backup of {', '.join(due)} failed: {str(e)}")
+
+RunStarted = namedtuple('RunStarted', 'run_id mode total completed')
+SwitchStarted = namedtuple('SwitchStarted', 'run_id name ip position total')
+PhaseTiming = namedtuple('PhaseTiming', 'name phase seconds')
+SwitchFinished = namedtuple('SwitchFinished', 'run_id name ip status seconds changes')
+UploadDone = namedtuple('UploadDone', 'target status seconds')
+RunFinished = namedtuple('RunFinished', 'run_id mode succeeded failed seconds')
+StatusMessage = namedtuple('StatusMessage', 'text')
+StatusChanged = namedtuple('StatusChanged', '')
+Alert = namedtuple('Alert', 'level title message')
+BackupTriggered = namedtuple('BackupTriggered', 'names')
+
+class EventBus:
+    """Synchronous in-process publish/subscribe keyed by event type.
+
+    Handlers run on the publishing (worker) thread and must be quick; the GUI
+    marshals onto Tk itself. Publishing a type nobody subscribed to costs one
+    dict lookup, and hot paths check wants() before even building the event.
+    """
+
+    def __init__(self):
+        self._handlers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, event_type, handler):
+        # Copy-on-write so publish() never needs the lock
+        with self._lock:
+            handlers = dict(self._handlers)
+            handlers[event_type] = handlers.get(event_type, ()) + (handler,)
+            self._handlers = handlers
+        return handler
+
+    def unsubscribe(self, event_type, handler):
+        with self._lock:
+            handlers = dict(self._handlers)
+            remaining = tuple(h for h in handlers.get(event_type, ()) if h is not handler)
+            if remaining:
+                handlers[event_type] = remaining
+            else:
+                handlers.pop(event_type, None)
+            self._handlers = handlers
+
+    def wants(self, event_type):
+        return event_type in self._handlers
+
+    def publish(self, event):
+        for handler in self._handlers.get(type(event), ()):
+            try:
+                handler(event)
+            except Exception as e:
+                logging.error(f"{type(event).__name__} handler failed: {str(e)}")
+
+class MetricsExporter:
+    """Event subscriber that writes per-run metrics in Prometheus textfile-collector format.
+
+    Timings are accumulated per run_id, so an on-demand run overlapping a full
+    run never skews its numbers. PhaseTiming carries only the switch name; its
+    timings are held until that switch's SwitchFinished names the run.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.pending_phases = {}
+        self.runs = {}
+        self.uploads = {}
+
+    def attach(self, bus):
+        bus.subscribe(PhaseTiming, self.on_phase)
+        bus.subscribe(SwitchFinished, self.on_switch)
+        bus.subscribe(UploadDone, self.on_upload)
+        bus.subscribe(RunFinished, self.on_run_finished)
+
+    def detach(self, bus):
+        bus.unsubscribe(PhaseTiming, self.on_phase)
+        bus.unsubscribe(SwitchFinished, self.on_switch)
+        bus.unsubscribe(UploadDone, self.on_upload)
+        bus.unsubscribe(RunFinished, self.on_run_finished)
+
+    def on_phase(self, event):
+        with self._lock:
+            self.pending_phases.setdefault(event.name, []).append((event.phase, event.seconds))
+
+    def on_switch(self, event):
+        with self._lock:
+            run = self.runs.setdefault(event.run_id, {'phases': {}, 'switch_seconds': 0.0})
+            run['switch_seconds'] += event.seconds
+            for phase, seconds in self.pending_phases.pop(event.name, ()):
+                stats = run['phases'].setdefault(phase, [0, 0.0])
+                stats[0] += 1
+                stats[1] += seconds
+
+    def on_upload(self, event):
+        with self._lock:
+            self.uploads[event.target] = (event.status, event.seconds)
+
+    def on_run_finished(self, event):
+        with self._lock:
+            run = self.runs.pop(event.run_id, {'phases': {}, 'switch_seconds': 0.0})
+            if event.mode == "Targeted":
+                # The file describes the last full run; on-demand timings are dropped with their run
+                return
+            lines = [
+                "# TYPE aoscx_backup_last_run_timestamp_seconds gauge",
+                f"aoscx_backup_last_run_timestamp_seconds {time.time():.0f}",
+                "# TYPE aoscx_backup_last_run_duration_seconds gauge",
+                f"aoscx_backup_last_run_duration_seconds {event.seconds:.3f}",
+                "# TYPE aoscx_backup_last_run_switches gauge",
+                f'aoscx_backup_last_run_switches{{result="success"}} {event.succeeded}',
+                f'aoscx_backup_last_run_switches{{result="failed"}} {event.failed}',
+                "# TYPE aoscx_backup_last_run_switch_seconds_total gauge",
+                f"aoscx_backup_last_run_switch_seconds_total {run['switch_seconds']:.3f}",
+                "# TYPE aoscx_backup_last_run_phase_seconds summary",
+            ]
+            for phase, (count, total) in sorted(run['phases'].items()):
+                lines.append(f'aoscx_backup_last_run_phase_seconds_sum{{phase="{phase}"}} {total:.3f}')
+                lines.append(f'aoscx_backup_last_run_phase_seconds_count{{phase="{phase}"}} {count}')
+            lines.append("# TYPE aoscx_backup_last_upload_success gauge")
+            for target, (status, seconds) in sorted(self.uploads.items()):
+                ok = 0 if status.startswith(("Failed", "Skipped")) else 1
+                lines.append(f'aoscx_backup_last_upload_success{{target="{target}"}} {ok}')
+            self.uploads = {}
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.error(f"Failed to write metrics file {self.path}: {str(e)}")
+
+class BackupEngine:
+    """Collection, storage and upload of switch configs, reporting progress on self.events."""
+    VERSION = "3.6"
+    STATUS_SAVE_INTERVAL = 2.0
+    WORKER_IDLE_SECONDS = 60
+
+    def __init__(self, base_dir_path=None):
+        if base_dir_path:
+            self.base_dir_path = base_dir_path
+        elif getattr(sys, 'frozen', False):
+            self.base_dir_path = os.path.dirname(sys.executable)
+        else:
+            self.base_dir_path = os.path.dirname(os.path.abspath(__file__))
+
+        if not os.path.exists(self.base_dir_path):
+            os.makedirs(self.base_dir_path)
+
+        self.config_file = os.path.join(self.base_dir_path, "backup_config.json")
+        self.status_file = os.path.join(self.base_dir_path, "switch_status.json")
+        self.log_file = os.path.join(self.base_dir_path, "log.txt")
+        self.key_file = os.path.join(self.base_dir_path, "encryption_key.key")
+        self.journal_file = os.path.join(self.base_dir_path, "run_journal.jsonl")
+        self.latency_file = os.path.join(self.base_dir_path, "latency_profile.json")
+        self.max_backups = 5
+        self.schedule_enabled = True
+        self.git_repo_url = None
+        self.git_token = None
+        self.git_enabled = False
+        self.last_git_status = "Not attempted"
+        self.wasabi_access_key = None
+        self.wasabi_secret_key = None
+        self.wasabi_bucket = None
+        self.wasabi_region = "us-east-1"
+        self.wasabi_enabled = False
+        self.last_wasabi_status = "Not attempted"
+        self.local_git_enabled = False
+        self.local_git_remote = ""
+        self.local_git_branch = "main"
+        self.last_local_git_status = "Not attempted"
+        self.diff_enabled = True
+        self.diff_ignore_patterns = list(ConfigDiffer.DEFAULT_IGNORE_PATTERNS)
+        self.differ = ConfigDiffer()
+        # {run_id: {switch name: change}}; on-demand runs overlap full runs
+        self.run_changes = {}
+        self.search_index_enabled = True
+        self.structured_capture = False
+        self.encrypt_backups = False
+        self.encryption_chunk_size = 64 * 1024
+        self.distributed_enabled = False
+        self.distributed_queue_path = ""
+        self.collector_name = ""
+        self.collector_region = ""
+        self.lease_seconds = 120
+        self.epoch_window_minutes = 30
+        self.max_claim_attempts = 3
+        self.search_index = None
+        self.index_lock = threading.Lock()
+        self.verify_ssl = False
+        self.backup_lock = threading.Lock()
+        self.job_queue = BackupJobQueue()
+        self.run_state_lock = threading.Lock()
+        self._on_demand_ids = itertools.count(1)
+        self._workers = []
+        self._workers_lock = threading.Lock()
+        self.total_switches = 0
+        self.current_switch = 0
+        self.fernet = None
+        self.backup_key = None
+        self.inventory = SwitchInventory()
+        self.journal = RunJournal(self.journal_file)
+        self.resume_window_hours = 12
+        self.latency = LatencyProfile(self.latency_file)
+        self.concurrent_backups = 1
+        # Re-entrant: save_status() snapshots under it and is also called with it held
+        self.status_lock = threading.RLock()
+        self.switch_status = None
+        self.local_git = None
+        self.events = EventBus()
+        self.sessions = SwitchSessionPool()
+        self.session_reuse_minutes = 0
+        self.tls_session_resumption = False
+        self.event_triggers_enabled = False
+        self.syslog_port = 514
+        # Loopback unless the user opts in: syslog is unauthenticated and triggers switch logins
+        self.syslog_bind_address = "127.0.0.1"
+        self.webhook_port = 8514
+        self.event_debounce_seconds = 30
+        self.event_trigger_pattern = ConfigChangeListener.DEFAULT_PATTERN
+        self.change_listener = None
+        self.metrics_enabled = False
+        self.metrics = None
+        self._status_saved_at = 0.0
+
+    def _initialize_encryption(self):
+        if not os.path.exists(self.key_file):
+            key = Fernet.generate_key()
+            with open(self.key_file, 'wb') as f:
+                f.write(key)
+            # Set restrictive permissions on encryption key (Windows: read/write for owner only)
+            try:
+                if sys.platform == 'win32':
+                    # Windows: Use os.chmod with appropriate flags
+                    os.chmod(self.key_file, stat.S_IREAD | stat.S_IWRITE)
+                else:
+                    # Unix/Mac: 600 permissions
+                    os.chmod(self.key_file, 0o600)
+                logging.info(f"Set restrictive permissions on {self.key_file}")
+            except Exception as e:
+                logging.warning(f"Failed to set key file permissions: {str(e)}")
+        else:
+            with open(self.key_file, 'rb') as f:
+                key = f.read()
+        # Backups at rest use a separate AES-256 key derived from the same key file
+        self.backup_key = HKDF(algorithm=hashes.SHA256(), length=32, salt=None,
+                               info=b"aos-cx-backup-at-rest-v1").derive(key.strip())
+        return Fernet(key)
+
+    def _encrypt(self, data):
+        if not data:
+            return ""
+        return self.fernet.encrypt(data.encode()).decode()
+
+    def _decrypt(self, encrypted_data):
+        if not encrypted_data:
+            return ""
+        try:
+            return self.fernet.decrypt(encrypted_data.encode()).decode()
+        except Exception as e:
+            logging.error(f"Decryption failed: {str(e)}")
+            return ""
+
+    def setup_logging(self):
+        try:
+            handler = RotatingFileHandler(
+                self.log_file, maxBytes=5*1024*1024, backupCount=3
+            )
+            handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+            logger = logging.getLogger()
+            logger.setLevel(logging.INFO)
+            logger.addHandler(handler)
+            logging.info("Logging initialized successfully")
+        except Exception as e:
+            logging.basicConfig(
+                level=logging.INFO,
+                format='%(asctime)s - %(levelname)s - %(message)s',
+                handlers=[logging.StreamHandler(sys.stdout)]
+            )
+            logging.error(f"Failed to set up file logging: {str(e)}")
+
+    def load_config(self):
+        default_config = {
+            'csv_path': os.path.join(self.base_dir_path, "switches.csv"),
+            'schedule_frequency': "daily",
+            'schedule_times': ["02:00"],
+            'schedule_day': "Monday",
+            'schedule_interval': 12,
+            'default_username': "",
+            'default_password': "",
+            'schedule_enabled': True,
+            'base_dir': '',
+            'timeout': 15,
+            'git_repo_url': '',
+            'git_token': '',
+            'git_enabled': False,
+            'wasabi_access_key': '',
+            'wasabi_secret_key': '',
+            'wasabi_bucket': '',
+            'wasabi_region': 'us-east-1',
+            'wasabi_enabled': False,
+            'verify_ssl': False,
+            'max_backups': 5,
+            'resume_window_hours': 12,
+            'concurrent_backups': 1,
+            'local_git_enabled': False,
+            'local_git_remote': '',
+            'local_git_branch': 'main',
+            'diff_enabled': True,
+            'diff_ignore_patterns': list(ConfigDiffer.DEFAULT_IGNORE_PATTERNS),
+            'search_index_enabled': True,
+            'structured_capture': False,
+            'distributed_enabled': False,
+            'distributed_queue_path': '',
+            'collector_name': '',
+            'collector_region': '',
+            'lease_seconds': 120,
+            'epoch_window_minutes': 30,
+            'max_claim_attempts': 3,
+            'encrypt_backups': False,
+            'encryption_chunk_size': 64 * 1024,
+            'metrics_enabled': False,
+            'session_reuse_minutes': 0,
+            'tls_session_resumption': False,
+            'event_triggers_enabled': False,
+            'syslog_port': 514,
+            'webhook_port': 8514,
+            'event_debounce_seconds': 30,
+            'event_trigger_pattern': ConfigChangeListener.DEFAULT_PATTERN,
+            'syslog_bind_address': "127.0.0.1"
+        }
+        try:
+            with open(self.config_file, 'r') as f:
+                config = json.load(f)
+                self.csv_file = config.get('csv_path', default_config['csv_path'])
+                self.schedule_frequency = config.get('schedule_frequency', default_config['schedule_frequency'])
+                self.schedule_times = config.get('schedule_times', default_config['schedule_times'])
+                self.schedule_day = config.get('schedule_day', default_config['schedule_day'])
+                self.schedule_interval = config.get('schedule_interval', default_config['schedule_interval'])
+                self.default_username = self._decrypt(config.get('default_username', default_config['default_username']))
+                self.default_password = self._decrypt(config.get('default_password', default_config['default_password']))
+                self.schedule_enabled = config.get('schedule_enabled', default_config['schedule_enabled'])
+                self.base_dir = config.get('base_dir', default_config['base_dir'])
+                self.timeout = config.get('timeout', default_config['timeout'])
+                self.git_repo_url = config.get('git_repo_url', default_config['git_repo_url'])
+                self.git_token = self._decrypt(config.get('git_token', default_config['git_token']))
+                self.git_enabled = config.get('git_enabled', default_config['git_enabled'])
+                self.wasabi_access_key = self._decrypt(config.get('wasabi_access_key', default_config['wasabi_access_key']))
+                self.wasabi_secret_key = self._decrypt(config.get('wasabi_secret_key', default_config['wasabi_secret_key']))
+                self.wasabi_bucket = config.get('wasabi_bucket', default_config['wasabi_bucket'])
+                self.wasabi_region = config.get('wasabi_region', default_config['wasabi_region'])
+                self.wasabi_enabled = config.get('wasabi_enabled', default_config['wasabi_enabled'])
+                self.verify_ssl = config.get('verify_ssl', default_config['verify_ssl'])
+                self.max_backups = config.get('max_backups', default_config['max_backups'])
+                self.resume_window_hours = config.get('resume_window_hours', default_config['resume_window_hours'])
+                self.concurrent_backups = config.get('concurrent_backups', default_config['concurrent_backups'])
+                self.local_git_enabled = config.get('local_git_enabled', default_config['local_git_enabled'])
+                self.local_git_remote = self._decrypt(config.get('local_git_remote', default_config['local_git_remote']))
+                self.local_git_branch = config.get('local_git_branch', default_config['local_git_branch'])
+                self.diff_enabled = config.get('diff_enabled', default_config['diff_enabled'])
+                self.diff_ignore_patterns = [ConfigDiffer.SUPERSEDED_PATTERNS.get(pattern, pattern)
+                                             for pattern in config.get('diff_ignore_patterns', default_config['diff_ignore_patterns'])]
+                self.search_index_enabled = config.get('search_index_enabled', default_config['search_index_enabled'])
+                self.structured_capture = config.get('structured_capture', default_config['structured_capture'])
+                self.distributed_enabled = config.get('distributed_enabled', default_config['distributed_enabled'])
+                self.distributed_queue_path = config.get('distributed_queue_path', default_config['distributed_queue_path'])
+                self.collector_name = config.get('collector_name', default_config['collector_name'])
+                self.collector_region = config.get('collector_region', default_config['collector_region'])
+                self.lease_seconds = config.get('lease_seconds', default_config['lease_seconds'])
+                self.epoch_window_minutes = config.get('epoch_window_minutes', default_config['epoch_window_minutes'])
+                self.max_claim_attempts = config.get('max_claim_attempts', default_config['max_claim_attempts'])
+                self.encrypt_backups = config.get('encrypt_backups', default_config['encrypt_backups'])
+                self.encryption_chunk_size = config.get('encryption_chunk_size', default_config['encryption_chunk_size'])
+                self.metrics_enabled = config.get('metrics_enabled', default_config['metrics_enabled'])
+                self.session_reuse_minutes = config.get('session_reuse_minutes', default_config['session_reuse_minutes'])
+                self.tls_session_resumption = config.get('tls_session_resumption', default_config['tls_session_resumption'])
+                self.event_triggers_enabled = config.get('event_triggers_enabled', default_config['event_triggers_enabled'])
+                self.syslog_port = config.get('syslog_port', default_config['syslog_port'])
+                self.webhook_port = config.get('webhook_port', default_config['webhook_port'])
+                self.event_debounce_seconds = config.get('event_debounce_seconds', default_config['event_debounce_seconds'])
+                self.event_trigger_pattern = config.get('event_trigger_pattern', default_config['event_trigger_pattern'])
+                self.syslog_bind_address = config.get('syslog_bind_address', default_config['syslog_bind_address'])
+                logging.info(f"Loaded config: git_enabled={self.git_enabled}, wasabi_enabled={self.wasabi_enabled}, verify_ssl={self.verify_ssl}")
+        except (FileNotFoundError, json.JSONDecodeError) as e:
+            self.csv_file = default_config['csv_path']
+            self.schedule_frequency = default_config['schedule_frequency']
+            self.schedule_times = default_config['schedule_times']
+            self.schedule_day = default_config['schedule_day']
+            self.schedule_interval = default_config['schedule_interval']
+            self.default_username = default_config['default_username']
+            self.default_password = default_config['default_password']
+            self.schedule_enabled = default_config['schedule_enabled']
+            self.base_dir = default_config['base_dir']
+            self.timeout = default_config['timeout']
+            self.git_repo_url = default_config['git_repo_url']
+            self.git_token = default_config['git_token']
+            self.git_enabled = default_config['git_enabled']
+            self.wasabi_access_key = default_config['wasabi_access_key']
+            self.wasabi_secret_key = default_config['wasabi_secret_key']
+            self.wasabi_bucket = default_config['wasabi_bucket']
+            self.wasabi_region = default_config['wasabi_region']
+            self.wasabi_enabled = default_config['wasabi_enabled']
+            self.verify_ssl = default_config['verify_ssl']
+            self.max_backups = default_config['max_backups']
+            self.resume_window_hours = default_config['resume_window_hours']
+            self.concurrent_backups = default_config['concurrent_backups']
+            self.local_git_enabled = default_config['local_git_enabled']
+            self.local_git_remote = default_config['local_git_remote']
+            self.local_git_branch = default_config['local_git_branch']
+            self.diff_enabled = default_config['diff_enabled']
+            self.diff_ignore_patterns = default_config['diff_ignore_patterns']
+            self.search_index_enabled = default_config['search_index_enabled']
+            self.structured_capture = default_config['structured_capture']
+            self.distributed_enabled = default_config['distributed_enabled']
+            self.distributed_queue_path = default_config['distributed_queue_path']
+            self.collector_name = default_config['collector_name']
+            self.collector_region = default_config['collector_region']
+            self.lease_seconds = default_config['lease_seconds']
+            self.epoch_window_minutes = default_config['epoch_window_minutes']
+            self.max_claim_attempts = default_config['max_claim_attempts']
+            self.encrypt_backups = default_config['encrypt_backups']
+            self.encryption_chunk_size = default_config['encryption_chunk_size']
+            self.metrics_enabled = default_config['metrics_enabled']
+            self.session_reuse_minutes = default_config['session_reuse_minutes']
+            self.tls_session_resumption = default_config['tls_session_resumption']
+            self.event_triggers_enabled = default_config['event_triggers_enabled']
+            self.syslog_port = default_config['syslog_port']
+            self.webhook_port = default_config['webhook_port']
+            self.event_debounce_seconds = default_config['event_debounce_seconds']
+            self.event_trigger_pattern = default_config['event_trigger_pattern']
+            self.syslog_bind_address = default_config['syslog_bind_address']
+            if isinstance(e, json.JSONDecodeError):
+                logging.warning("Configuration file is corrupted, using default settings")
+            else:
+                logging.info("Configuration file not found, using default settings")
+
+    def load_status(self):
+        try:
+            with open(self.status_file, 'r') as f:
+                self.switch_status = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError) as e:
+            self.switch_status = {}
+            if isinstance(e, json.JSONDecodeError):
+                logging.warning("Switch status file is corrupted, initializing empty status")
+            else:
+                logging.info("Switch status file not found, initializing empty status")
+
+    def save_status(self):
+        try:
+            with self.status_lock:
+                data = json.dumps(self.switch_status)
+            with open(self.status_file, 'w') as f:
+                f.write(data)
+            logging.info("Switch status saved successfully")
+        except Exception as e:
+            logging.error(f"Failed to save switch status: {str(e)}")
+
+    def save_config(self, switch_name=None, ip=None, config=None, structured=None, run_id=None):
+        if switch_name and ip and config:
+            if not self.base_dir:
+                logging.error("Backup directory not set.")
+                self.events.publish(StatusMessage("Error: Backup directory not set"))
+                self.events.publish(Alert("error", "Error", "Backup directory not set."))
+                return
+            safe_switch_name = self.safe_name(switch_name)
+            if not safe_switch_name:
+                logging.error(f"Invalid switch name: {switch_name}")
+                return
+            switch_dir = os.path.join(self.base_dir, safe_switch_name)
+            if not os.path.exists(switch_dir):
+                os.makedirs(switch_dir)
+
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            # Sanitize filename components
+            safe_ip = "".join(c for c in ip if c.isalnum() or c in ('.', '-'))
+            filename = f"{safe_switch_name}_{safe_ip}_{timestamp}.txt"
+            if self.encrypt_backups:
+                filename += ENCRYPTED_SUFFIX
+            filepath = os.path.join(switch_dir, filename)
+            # Written under a temporary name so a failed write never becomes the latest backup
+            tmp_path = filepath + ".tmp"
+            previous = self.latest_backup_file(switch_dir)
+
+            try:
+                if self.encrypt_backups:
+                    with open(tmp_path, 'wb') as raw, EncryptedBackupWriter(raw, self.backup_key, self.encryption_chunk_size) as f:
+                        f.write_text(config)
+                else:
+                    with open(tmp_path, 'w', encoding='utf-8') as f:
+                        f.write(config)
+                # Set appropriate file permissions
+                try:
+                    if sys.platform == 'win32':
+                        os.chmod(tmp_path, stat.S_IREAD | stat.S_IWRITE)
+                    else:
+                        os.chmod(tmp_path, 0o600)
+                except Exception as perm_error:
+                    logging.warning(f"Failed to set file permissions: {str(perm_error)}")
+                os.replace(tmp_path, filepath)
+                field_changes = None
+                if structured is not None:
+                    field_changes = self.save_structured(switch_name, switch_dir, filepath, structured)
+                if self.diff_enabled:
+                    self.record_changes(switch_name, ip, switch_dir, previous if previous != filepath else None, filepath, config,
+                                        field_changes=field_changes, run_id=run_id)
+                if self.search_available():
+                    self.index_backup(switch_name, ip, filepath, config)
+                self.manage_retention(switch_dir)
+                logging.info(f"Saved config for {switch_name} ({ip})")
+                return filepath
+            except Exception as e:
+                logging.error(f"Failed to save config for {switch_name} ({ip}): {str(e)}")
+                if os.path.exists(tmp_path):
+                    try:
+                        os.remove(tmp_path)
+                    except OSError:
+                        pass
+        else:
+            config = {
+                'csv_path': self.csv_file,
+                'schedule_frequency': self.schedule_frequency,
+                'schedule_times': self.schedule_times,
+                'schedule_day': self.schedule_day,
+                'schedule_interval': self.schedule_interval,
+                'default_username': self._encrypt(self.default_username),
+                'default_password': self._encrypt(self.default_password),
+                'schedule_enabled': self.schedule_enabled,
+                'base_dir': self.base_dir,
+                'timeout': self.timeout,
+                'git_repo_url': self.git_repo_url,
+                'git_token': self._encrypt(self.git_token),
+                'git_enabled': self.git_enabled,
+                'wasabi_access_key': self._encrypt(self.wasabi_access_key),
+                'wasabi_secret_key': self._encrypt(self.wasabi_secret_key),
+                'wasabi_bucket': self.wasabi_bucket,
+                'wasabi_region': self.wasabi_region,
+                'wasabi_enabled': self.wasabi_enabled,
+                'verify_ssl': self.verify_ssl,
+                'max_backups': self.max_backups,
+                'resume_window_hours': self.resume_window_hours,
+                'concurrent_backups': self.concurrent_backups,
+                'local_git_enabled': self.local_git_enabled,
+                'local_git_remote': self._encrypt(self.local_git_remote),
+                'local_git_branch': self.local_git_branch,
+                'diff_enabled': self.diff_enabled,
+                'diff_ignore_patterns': self.diff_ignore_patterns,
+                'search_index_enabled': self.search_index_enabled,
+                'structured_capture': self.structured_capture,
+                'distributed_enabled': self.distributed_enabled,
+                'distributed_queue_path': self.distributed_queue_path,
+                'collector_name': self.collector_name,
+                'collector_region': self.collector_region,
+                'lease_seconds': self.lease_seconds,
+                'epoch_window_minutes': self.epoch_window_minutes,
+                'max_claim_attempts': self.max_claim_attempts,
+                'encrypt_backups': self.encrypt_backups,
+                'encryption_chunk_size': self.encryption_chunk_size,
+                'metrics_enabled': self.metrics_enabled,
+                'session_reuse_minutes': self.session_reuse_minutes,
+                'tls_session_resumption': self.tls_session_resumption,
+                'event_triggers_enabled': self.event_triggers_enabled,
+                'syslog_port': self.syslog_port,
+                'webhook_port': self.webhook_port,
+                'event_debounce_seconds': self.event_debounce_seconds,
+                'event_trigger_pattern': self.event_trigger_pattern,
+                'syslog_bind_address': self.syslog_bind_address
+            }
+            try:
+                with open(self.config_file, 'w') as f:
+                    json.dump(config, f)
+                logging.info("Saved application configuration")
+            except Exception as e:
+                logging.error(f"Failed to save application configuration: {str(e)}")
+
+    @staticmethod
+    def safe_name(switch_name):
+        # Sanitize switch_name to prevent directory traversal; "" for names that would still escape or hit tool data
+        safe = "".join(c for c in switch_name if c.isalnum() or c in ('-', '_', '.'))
+        return "" if safe.strip('.') == "" or safe in TOOL_DIRS else safe
+
+    def switch_dirs(self):
+        """Sorted switch directory names in the backup directory."""
+        return sorted(d for d in os.listdir(self.base_dir) if d not in TOOL_DIRS and os.path.isdir(os.path.join(self.base_dir, d)))
+
+    def latest_backups(self):
+        """Return (file_path, relative_path) of the newest backup in each switch directory."""
+        latest = []
+        for switch_dir in self.switch_dirs():
+            switch_path = os.path.join(self.base_dir, switch_dir)
+            files = sorted([f for f in os.listdir(switch_path) if f.endswith(BACKUP_SUFFIXES)], reverse=True)
+            if files:
+                file_path = os.path.join(switch_path, files[0])
+                relative_path = os.path.relpath(file_path, self.base_dir).replace(os.sep, '/')
+                latest.append((file_path, relative_path))
+        return latest
+
+    @staticmethod
+    def latest_backup_file(switch_dir):
+        try:
+            files = sorted(f for f in os.listdir(switch_dir) if f.endswith(BACKUP_SUFFIXES))
+        except FileNotFoundError:
+            return None
+        return os.path.join(switch_dir, files[-1]) if files else None
+
+    def read_backup(self, path):
+        """Return a backup's text, decrypting it if it was stored encrypted."""
+        if not path.endswith(ENCRYPTED_SUFFIX):
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                return f.read()
+        with open(path, 'rb') as raw:
+            return EncryptedBackupReader(raw, self.backup_key).read().decode('utf-8', errors='replace')
+
+    def decrypt_backups(self, source, destination):
+        """Decrypt one file or a whole backup tree into destination; returns the number of files written."""
+        if os.path.isfile(source):
+            pairs = [(source, destination)]
+        else:
+            pairs = []
+            for folder, _, names in os.walk(source):
+                for name in names:
+                    if name.endswith(ENCRYPTED_SUFFIX):
+                        relative = os.path.relpath(os.path.join(folder, name), source)
+                        pairs.append((os.path.join(folder, name), os.path.join(destination, relative[:-len(ENCRYPTED_SUFFIX)])))
+        for src, dst in pairs:
+            os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok=True)
+            with open(src, 'rb') as raw, open(dst, 'wb') as out:
+                reader = EncryptedBackupReader(raw, self.backup_key)
+                while True:
+                    block = reader.read(reader.chunk_size)
+                    if not block:
+                        break
+                    out.write(block)
+            if sys.platform != 'win32':
+                os.chmod(dst, 0o600)
+        return len(pairs)
+
+    def save_structured(self, switch_name, switch_dir, filepath, data):
+        """Store the normalized JSON config next to the text backup; returns field changes vs the previous one."""
+        stem = filepath[:-len(ENCRYPTED_SUFFIX)] if filepath.endswith(ENCRYPTED_SUFFIX) else filepath
+        structured_path = stem[:-len('.txt')] + '.json.gz' + (ENCRYPTED_SUFFIX if self.encrypt_backups else '')
+        previous = sorted(f for f in os.listdir(switch_dir) if f.endswith(STRUCTURED_SUFFIXES))
+        try:
+            doc = StructuredConfig.normalize(data)
+            StructuredConfig.save(structured_path, doc, key=self.backup_key if self.encrypt_backups else None,
+                                  chunk_size=self.encryption_chunk_size)
+            if sys.platform != 'win32':
+                os.chmod(structured_path, 0o600)
+            if not previous or os.path.join(switch_dir, previous[-1]) == structured_path:
+                return None
+            return StructuredConfig.diff_fields(StructuredConfig.load(os.path.join(switch_dir, previous[-1]), self.backup_key), doc)
+        except Exception as e:
+            logging.error(f"Failed to save structured config for {switch_name}: {str(e)}")
+            return None
+
+    def record_changes(self, switch_name, ip, switch_dir, previous_path, filepath, config, field_changes=None, run_id=None):
+        """Diff a new backup against the previous one and append the changeset to changes.jsonl.
+
+        The change is also kept under run_id for that run's report.
+        """
+        change = {
+            'time': datetime.now().strftime("%Y-%m-%d %H:%M:%S"), 'switch': switch_name, 'ip': ip,
+            'from': os.path.basename(previous_path) if previous_path else None, 'to': os.path.basename(filepath),
+        }
+        try:
+            if previous_path is None:
+                change.update({'result': 'new', 'added': 0, 'removed': 0, 'hunks': []})
+            else:
+                delta = self.differ.diff(self.read_backup(previous_path), config)
+                if delta is None:
+                    change.update({'result': 'unchanged', 'added': 0, 'removed': 0, 'hunks': []})
+                else:
+                    change.update(delta, result='changed')
+            if field_changes:
+                change['fields'] = field_changes
+            if self.encrypt_backups:
+                # changes.jsonl and the reports are plaintext, so only the counts are kept
+                change['hunks'] = []
+                change['fields_changed'] = len(change.pop('fields', []))
+                change['withheld'] = True
+            if change['result'] != 'unchanged':
+                changes_path = os.path.join(switch_dir, "changes.jsonl")
+                with open(changes_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(change) + '\n')
+                self._trim_changes(changes_path)
+        except Exception as e:
+            change.update({'result': 'error', 'error': str(e), 'hunks': []})
+            logging.error(f"Failed to diff config for {switch_name}: {str(e)}")
+        if run_id is not None:
+            with self.status_lock:
+                self.run_changes.setdefault(run_id, {})[switch_name] = change
+        return change
+
+    @staticmethod
+    def _trim_changes(changes_path, keep=100):
+        with open(changes_path, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+        if len(lines) > 2 * keep:
+            with open(changes_path, 'w', encoding='utf-8') as f:
+                f.writelines(lines[-keep:])
+
+    def write_change_report(self, run_id):
+        """Write the fleet-wide JSON and HTML change report for a run into base_dir/.reports."""
+        with self.status_lock:
+            run_changes = self.run_changes.pop(run_id, {})
+        if not self.diff_enabled or not self.base_dir:
+            return None
+        changes = sorted(run_changes.values(), key=lambda c: (c['result'] != 'changed', c['switch']))
+        summary = {result: sum(1 for c in changes if c['result'] == result) for result in ('changed', 'new', 'unchanged', 'error')}
+        report = {'run_id': run_id, 'generated': datetime.now().strftime("%Y-%m-%d %H:%M:%S"), 'summary': summary,
+                  'switches': [c for c in changes if c['result'] != 'unchanged']}
+        report_dir = os.path.join(self.base_dir, ".reports")
+        try:
+            os.makedirs(report_dir, exist_ok=True)
+            base = os.path.join(report_dir, f"changes_{run_id}")
+            with open(base + ".json", 'w', encoding='utf-8') as f:
+                json.dump(report, f)
+            with open(base + ".html", 'w', encoding='utf-8') as f:
+                f.write(self._render_change_report(report))
+            reports = sorted(n for n in os.listdir(report_dir) if n.startswith("changes_"))
+            for name in reports[:-60]:
+                os.remove(os.path.join(report_dir, name))
+            logging.info(f"Change report written: {summary['changed']} changed, {summary['new']} new, {summary['unchanged']} unchanged")
+            return base + ".html"
+        except Exception as e:
+            logging.error(f"Failed to write change report: {str(e)}")
+            return None
+
+    @staticmethod
+    def _render_change_report(report):
+        esc = html.escape
+        summary = report['summary']
+        out = [
+            "<!DOCTYPE html><html><head><meta charset='utf-8'>",
+            f"<title>Config changes - run {esc(report['run_id'])}</title>",
+            "<style>body{font-family:sans-serif;background:#222;color:#ddd}pre{background:#111;padding:6px}"
+            ".a{color:#7c7}.r{color:#e77}summary{cursor:pointer}</style></head><body>",
+            f"<h2>Config changes - run {esc(report['run_id'])}</h2>",
+            f"<p>Generated {esc(report['generated'])}: {summary['changed']} changed, {summary['new']} new, "
+            f"{summary['unchanged']} unchanged, {summary['error']} errors</p>",
+        ]
+        for change in report['switches']:
+            title = f"{esc(change['switch'])} ({esc(change['ip'])}) - {change['result']}"
+            if change['result'] == 'changed':
+                title += f" +{change['added']}/-{change['removed']}"
+            out.append(f"<details><summary>{title}</summary><pre>")
+            for hunk in change.get('hunks', []):
+                out.append(f"@@ -{hunk['old_line']} +{hunk['new_line']} @@\n")
+                out.extend(f"<span class='r'>- {esc(line)}</span>\n" for line in hunk['old'])
+                out.extend(f"<span class='a'>+ {esc(line)}</span>\n" for line in hunk['new'])
+            for table_name, record_id, key, old, new in change.get('fields', []):
+                where = table_name + (f"[{record_id}]" if record_id is not None else "") + (f".{key}" if key is not None else "")
+                out.append(f"{esc(where)}: {esc(json.dumps(old))} -&gt; {esc(json.dumps(new))}\n")
+            if change.get('withheld'):
+                out.append(f"Changed lines and {change['fields_changed']} field change(s) withheld: backups are encrypted at rest\n")
+            if change.get('error'):
+                out.append(esc(change['error']))
+            out.append("</pre></details>")
+        out.append("</body></html>")
+        return ''.join(out)
+
+    def search_available(self):
+        """The index holds plaintext config lines, so it is not kept while backups are encrypted at rest."""
+        return self.search_index_enabled and not self.encrypt_backups
+
+    def get_search_index(self):
+        """Open (and on first use build) the search index for the current backup directory."""
+        if not self.base_dir or self.encrypt_backups:
+            return None
+        db_path = os.path.join(self.base_dir, ".index", "search.db")
+        with self.index_lock:
+            if self.search_index is None or self.search_index.db_path != db_path:
+                self.search_index = ConfigSearchIndex(db_path)
+                if self.search_index.version_count() == 0:
+                    self.rebuild_search_index()
+                else:
+                    # Retention may have deleted backups while the index was closed or disabled
+                    for path in self.search_index.paths():
+                        if not os.path.exists(os.path.join(self.base_dir, path)):
+                            self.search_index.remove_version(path)
+            return self.search_index
+
+    def rebuild_search_index(self):
+        """Index every backup on disk; used the first time and by 'search --reindex'."""
+        index = self.search_index
+        started = time.monotonic()
+        count = 0
+        for switch_dir in self.switch_dirs():
+            switch_path = os.path.join(self.base_dir, switch_dir)
+            for filename in sorted(f for f in os.listdir(switch_path) if f.endswith(BACKUP_SUFFIXES)):
+                file_path = os.path.join(switch_path, filename)
+                parts = filename.split('.txt')[0].rsplit('_', 3)
+                ip = parts[1] if len(parts) == 4 else ""
+                try:
+                    saved = datetime.strptime(parts[2] + parts[3], "%Y%m%d%H%M%S").strftime("%Y-%m-%d %H:%M:%S")
+                except (IndexError, ValueError):
+                    saved = datetime.fromtimestamp(os.path.getmtime(file_path)).strftime("%Y-%m-%d %H:%M:%S")
+                try:
+                    index.add_version(switch_dir, ip, f"{switch_dir}/{filename}", saved, self.read_backup(file_path))
+                    count += 1
+                except (OSError, ValueError, sqlite3.Error) as e:
+                    logging.error(f"Failed to index {file_path}: {str(e)}")
+        logging.info(f"Search index rebuilt: {count} backups in {time.monotonic() - started:.1f}s")
+
+    def index_backup(self, switch_name, ip, filepath, config):
+        try:
+            index = self.get_search_index()
+            relative_path = os.path.relpath(filepath, self.base_dir).replace(os.sep, '/')
+            index.add_version(self.safe_name(switch_name), ip, relative_path, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), config)
+        except (OSError, sqlite3.Error) as e:
+            logging.error(f"Failed to index config for {switch_name}: {str(e)}")
+
+    def search_configs(self, pattern, regex=False, all_versions=False, limit=1000):
+        """Search the index; returns (rows, elapsed seconds). Raises re.error for a bad regex."""
+        index = self.get_search_index()
+        if index is None:
+            return [], 0.0
+        started = time.perf_counter()
+        rows = index.search(pattern, regex=regex, all_versions=all_versions, limit=limit)
+        return rows, time.perf_counter() - started
+
+    def latest_backup_pairs(self):
+        """Yield (switch_dir, latest text path, latest structured path or None) per switch."""
+        for switch_dir in self.switch_dirs():
+            switch_path = os.path.join(self.base_dir, switch_dir)
+            names = os.listdir(switch_path)
+            texts = sorted(f for f in names if f.endswith(BACKUP_SUFFIXES))
+            structured = sorted(f for f in names if f.endswith(STRUCTURED_SUFFIXES))
+            if texts:
+                yield (switch_dir, os.path.join(switch_path, texts[-1]),
+                       os.path.join(switch_path, structured[-1]) if structured else None)
+
+    def query_structured(self, table_name, key):
+        """Yield (switch, record_id, value) for a field across the latest structured backups."""
+        for switch_dir, _, structured_path in self.latest_backup_pairs():
+            if structured_path:
+                for record_id, value in StructuredConfig.field(StructuredConfig.load(structured_path, self.backup_key), table_name, key).items():
+                    yield switch_dir, record_id, value
+
+    def run_benchmark(self):
+        """Compare size and query time of text vs structured backups; returns report lines."""
+        pairs = [p for p in self.latest_backup_pairs() if p[2]]
+        lines = [f"Switches with text and structured backups: {len(pairs)}"]
+        if not pairs:
+            lines.append("Enable structured capture and run a backup to benchmark structured storage.")
+            return lines + self.benchmark_encryption()
+        text_bytes = sum(os.path.getsize(text) for _, text, _ in pairs)
+        stored_bytes = sum(os.path.getsize(structured) for _, _, structured in pairs)
+        raw_bytes = normalized_bytes = 0
+        for _, _, structured in pairs:
+            doc = StructuredConfig.load(structured, self.backup_key)
+            normalized_bytes += len(json.dumps(doc, separators=(',', ':')))
+            raw_bytes += len(json.dumps(StructuredConfig.denormalize(doc), separators=(',', ':')))
+        lines += [
+            f"Text backups:              {text_bytes / 1024:10.1f} KiB",
+            f"Raw JSON (not stored):     {raw_bytes / 1024:10.1f} KiB",
+            f"Normalized JSON:           {normalized_bytes / 1024:10.1f} KiB",
+            f"Normalized JSON, gzip:     {stored_bytes / 1024:10.1f} KiB (stored)",
+        ]
+        # Same question both ways: which interfaces are administratively down?
+        started = time.perf_counter()
+        text_hits = 0
+        block = re.compile(r'^interface (\S+)\n((?:[ \t].*\n?)*)', re.MULTILINE)
+        for _, text, _ in pairs:
+            text_hits += sum(1 for m in block.finditer(self.read_backup(text)) if re.search(r'^\s+shutdown\s*$', m.group(2), re.MULTILINE))
+        text_time = time.perf_counter() - started
+        started = time.perf_counter()
+        structured_hits = 0
+        for _, _, structured in pairs:
+            admin = StructuredConfig.field(StructuredConfig.load(structured, self.backup_key), 'Interface', 'admin')
+            structured_hits += sum(1 for value in admin.values() if value == 'down')
+        structured_time = time.perf_counter() - started
+        lines += [
+            f"Query 'interfaces admin down', text regex:   {text_time * 1000:8.1f} ms ({text_hits} hits)",
+            f"Query 'interfaces admin down', structured:   {structured_time * 1000:8.1f} ms ({structured_hits} hits)",
+        ]
+        return lines + self.benchmark_encryption()
+
+    def benchmark_encryption(self, size_mb=64):
+        """Time streaming encryption/decryption of synthetic config text and report the per-GB cost."""
+        sample = ''.join(f"interface 1/1/{i}\n    description uplink-{i}\n    no shutdown\n    vlan access {i % 4094 + 1}\n"
+                         for i in range(2000)).encode('utf-8')
+        block = (sample * (1024 * 1024 // len(sample) + 1))[:1024 * 1024]
+        # Kept out of the backup directory so uploads and retention never see it
+        with tempfile.TemporaryDirectory() as scratch:
+            sink_path = os.path.join(scratch, "bench.enc")
+            started = time.perf_counter()
+            with open(sink_path, 'wb') as raw, EncryptedBackupWriter(raw, self.backup_key, self.encryption_chunk_size) as writer:
+                for _ in range(size_mb):
+                    writer.write(block)
+            encrypt_time = time.perf_counter() - started
+            started = time.perf_counter()
+            with open(sink_path, 'rb') as raw:
+                reader = EncryptedBackupReader(raw, self.backup_key)
+                while reader.read(reader.chunk_size):
+                    pass
+            decrypt_time = time.perf_counter() - started
+            overhead = os.path.getsize(sink_path) / (size_mb * 1024 * 1024) - 1
+        per_gb = 1024 / size_mb
+        return [
+            f"Encryption at rest (AES-256-GCM, {self.encryption_chunk_size // 1024} KiB chunks, {size_mb} MiB sample):",
+            f"  encrypt + write: {encrypt_time * per_gb:6.2f} s/GB ({size_mb / encrypt_time:7.1f} MiB/s)",
+            f"  read + decrypt:  {decrypt_time * per_gb:6.2f} s/GB ({size_mb / decrypt_time:7.1f} MiB/s)",
+            f"  size overhead:   {overhead * 100:6.3f} %",
+        ]
+
+    def setup_schedule(self):
+        # Use wrapper function to avoid lambda closure issues
+        def run_scheduled_backup():
+            try:
+                self.backup_switches(is_manual=False)
+            except Exception as e:
+                logging.error(f"Scheduled backup failed: {str(e)}")
+        
+        if self.schedule_frequency == "daily":
+            for t in self.schedule_times:
+                schedule.every().day.at(t).do(run_scheduled_backup)
+        elif self.schedule_frequency == "weekly":
+            getattr(schedule.every(), self.schedule_day.lower()).at(self.schedule_times[0]).do(run_scheduled_backup)
+        else:
+            getattr(schedule.every(), self.schedule_day.lower()).at(self.schedule_times[0]).do(run_scheduled_backup)
+
+    def switch_timeouts(self, name, override=None):
+        """Return (probe, login, download) timeouts learned for a switch, honouring a CSV override."""
+        if override:
+            return min(5, override), override, override
+        return (
+            self.latency.timeout(name, 'probe', 5, 2, 5),
+            self.latency.timeout(name, 'login', self.timeout, 5, 120),
+            self.latency.timeout(name, 'download', self.timeout, 5, 120),
+        )
+
+    def _observe_phase(self, name, phase, started):
+        seconds = time.monotonic() - started
+        self.latency.observe(name, phase, seconds)
+        if self.events.wants(PhaseTiming):
+            self.events.publish(PhaseTiming(name, phase, seconds))
+
+    def get_switch_config(self, ip, username, password, name=None, timeout_override=None):
+        return self.fetch_switch_config(ip, username, password, name=name, timeout_override=timeout_override)[0]
+
+    def fetch_switch_config(self, ip, username, password, name=None, timeout_override=None, want_json=False):
+        """Return (config_text, config_json); config_json is only requested when want_json is set."""
+        max_retries = 3
+        retry_delay = 5
+        config_text = None
+        config_json = None
+        name = name or ip
+        verify = self.verify_ssl
+        reuse = self.session_reuse_minutes > 0
+        probe_timeout, login_timeout, download_timeout = self.switch_timeouts(name, timeout_override)
+
+        with self.sessions.host(ip, verify, self.tls_session_resumption) as conn:
+            session = conn.session
+            # A live cached login proves connectivity; otherwise probe first so dead switches fail fast
+            while not conn.logged_in:
+                try:
+                    started = time.monotonic()
+                    response = session.get(f"https://{ip}", timeout=probe_timeout, verify=verify)
+                    self._observe_phase(name, 'probe', started)
+                    logging.info(f"Connectivity test to {ip}: {response.status_code}")
+                    break
+                except requests.exceptions.RequestException as e:
+                    if isinstance(e, requests.exceptions.Timeout) and not timeout_override and probe_timeout < 5:
+                        # The learned probe timeout may be stale; retry once with the full default
+                        self.latency.observe_timeout(name, 'probe', probe_timeout)
+                        logging.warning(f"Connectivity test to {ip} timed out after {probe_timeout:.1f}s, retrying with 5s")
+                        probe_timeout = 5
+                        continue
+                    logging.error(f"Connectivity test to {ip} failed: {str(e)}")
+                    return None, None
+
+            for attempt in range(max_retries):
+                phase = 'login'
+                try:
+                    reused = conn.logged_in and conn.username == username
+                    if not reused:
+                        started = time.monotonic()
+                        self.sessions.login(conn, ip, username, password, login_timeout)
+                        self._observe_phase(name, 'login', started)
+                        logging.info(f"Login successful for {ip} with API v10.04")
+
+                    config_url = f"https://{ip}/rest/v10.04/configs/running-config"
+                    phase = 'download'
+                    started = time.monotonic()
+                    config_response = session.get(config_url, headers={"Accept": "text/plain"}, verify=verify, timeout=download_timeout)
+                    if config_response.status_code == 401 and reused:
+                        # The switch expired the cached session; log in again once, right away
+                        logging.info(f"Cached REST session for {ip} expired, logging in again")
+                        conn.logged_in = False
+                        phase = 'login'
+                        self.sessions.login(conn, ip, username, password, login_timeout)
+                        phase = 'download'
+                        started = time.monotonic()
+                        config_response = session.get(config_url, headers={"Accept": "text/plain"}, verify=verify, timeout=download_timeout)
+                    config_response.raise_for_status()
+                    config_text = config_response.text
+                    self._observe_phase(name, 'download', started)
+                    logging.info(f"Retrieved config from {ip} with API v10.04")
+                    if want_json:
+                        try:
+                            json_response = session.get(config_url, headers={"Accept": "application/json"}, verify=verify, timeout=download_timeout)
+                            json_response.raise_for_status()
+                            config_json = json_response.json()
+                        except (requests.exceptions.RequestException, ValueError) as e:
+                            # The text backup is still valid; only the structured copy is skipped
+                            logging.warning(f"Structured config capture failed for {ip}: {str(e)}")
+                    break
+                except requests.exceptions.HTTPError as e:
+                    # More granular error reporting for API responses
+                    # An error Response is falsy, so test against None
+                    status = e.response.status_code if e.response is not None else "unknown"
+                    text = e.response.text[:200] if e.response is not None else ""
+                    logging.error(f"HTTP error {status} from {ip}: {text}")
+                    if attempt < max_retries - 1:
+                        time.sleep(retry_delay)
+                        continue
+                    return None, None
+                except requests.exceptions.RequestException as e:
+                    if isinstance(e, requests.exceptions.Timeout) and not timeout_override:
+                        # Timed-out attempts never produce a sample, so feed one in and widen the
+                        # retry; otherwise a switch that got slower would time out on every run
+                        if phase == 'login':
+                            self.latency.observe_timeout(name, phase, login_timeout)
+                            login_timeout = min(120, max(self.timeout, login_timeout * 2))
+                        else:
+                            self.latency.observe_timeout(name, phase, download_timeout)
+                            download_timeout = min(120, max(self.timeout, download_timeout * 2))
+                    if attempt < max_retries - 1:
+                        logging.warning(f"Attempt {attempt + 1} failed for {ip}: {str(e)}. Retrying...")
+                        time.sleep(retry_delay)
+                    else:
+                        logging.error(f"Failed to get config from {ip} after {max_retries} attempts: {str(e)}")
+                        return None, None
+                finally:
+                    if not reuse:
+                        self.sessions.logout(conn, ip, login_timeout)
+        return config_text, config_json
+
+    def manage_retention(self, switch_dir):
+        try:
+            structured = sorted([f for f in os.listdir(switch_dir) if f.endswith(STRUCTURED_SUFFIXES)], reverse=True)
+            while len(structured) > self.max_backups:
+                os.remove(os.path.join(switch_dir, structured.pop()))
+            files = sorted([f for f in os.listdir(switch_dir) if f.endswith(BACKUP_SUFFIXES)], reverse=True)
+            index = self.search_index
+            if index is None and len(files) > self.max_backups and self.search_available():
+                # Opened on demand so pruned versions leave the index even if nothing has searched yet
+                index = self.get_search_index()
+            while len(files) > self.max_backups:
+                removed = os.path.join(switch_dir, files.pop())
+                os.remove(removed)
+                logging.info(f"Removed old backup in {switch_dir}")
+                if index is not None:
+                    index.remove_version(os.path.relpath(removed, self.base_dir).replace(os.sep, '/'))
+        except Exception as e:
+            logging.error(f"Failed to manage retention for {switch_dir}: {str(e)}")
+
+    def git_upload(self, is_manual=False):
+        if not self.git_enabled or not self.git_repo_url or not self.git_token or not self.base_dir:
+            self.last_git_status = "Skipped: Git settings incomplete"
+            logging.info("Git upload skipped: settings incomplete")
+            return
+        started = time.monotonic()
+        try:
+            g = Github(self.git_token)
+            # Extract "owner/repo" from various URL formats or direct input
+            repo_name = self.git_repo_url.strip().rstrip('/')
+            repo_name = repo_name.replace('.git', '')
+            for prefix in ['https://github.com/', 'http://github.com/', 'github.com/']:
+                if repo_name.lower().startswith(prefix):
+                    repo_name = repo_name[len(prefix):]
+                    break
+            repo = g.get_repo(repo_name)
+            files_to_upload = self.latest_backups()
+            for file_path, relative_path in files_to_upload:
+                # Encrypted backups are uploaded as the ciphertext on disk
+                with open(file_path, 'rb' if file_path.endswith(ENCRYPTED_SUFFIX) else 'r') as f:
+                    content = f.read()
+                try:
+                    contents = repo.get_contents(relative_path)
+                    repo.update_file(relative_path, f"Update {relative_path}", content, contents.sha)
+                except Exception as e:
+                    # File doesn't exist, create it
+                    if "404" in str(e) or "Not Found" in str(e):
+                        repo.create_file(relative_path, f"Add {relative_path}", content)
+                    else:
+                        raise
+            self.last_git_status = "Success"
+            logging.info("Git upload successful")
+            if is_manual:
+                self.events.publish(StatusMessage("Status: Git upload completed"))
+        except Exception as e:
+            self.last_git_status = f"Failed: {str(e)}"
+            logging.error(f"Git upload failed: {str(e)}")
+            if is_manual:
+                self.events.publish(StatusMessage("Status: Git upload failed"))
+        self.events.publish(UploadDone("github", self.last_git_status, time.monotonic() - started))
+
+    def local_git_dir(self):
+        return os.path.join(self.base_dir, ".git-history")
+
+    def local_git_commit(self, run_id, mode, is_manual=False, switches=None):
+        """Commit this run's backups (or only the named switches') to the local history and optionally push them."""
+        if not self.local_git_enabled or not self.base_dir:
+            return
+        if not LocalGitStore.available():
+            self.last_local_git_status = "Skipped: git executable not found"
+            logging.warning("Local Git history skipped: git executable not found")
+            return
+        started = time.monotonic()
+        try:
+            commit = self.local_git.commit(f"{mode} backup run {run_id}",
+                                           switches=None if switches is None else [self.safe_name(name) for name in switches])
+            self.last_local_git_status = f"Committed {commit}" if commit else "No changes"
+            logging.info(f"Local Git history: {self.last_local_git_status}")
+        except (subprocess.SubprocessError, OSError) as e:
+            self.last_local_git_status = f"Failed: {self._git_error(e)}"
+            logging.error(f"Local Git commit failed: {self._git_error(e)}")
+            self.events.publish(UploadDone("local_git", self.last_local_git_status, time.monotonic() - started))
+            return
+        if self.local_git_remote:
+            try:
+                self.local_git.push(self.local_git_remote, self.local_git_branch or "main")
+                self.last_local_git_status += ", pushed"
+                logging.info("Local Git history pushed to remote")
+            except (subprocess.SubprocessError, OSError) as e:
+                if LocalGitStore.REJECTED_RE.search(getattr(e, 'stderr', None) or ''):
+                    # The remote has diverged; retrying next run would be rejected the same way
+                    self.last_local_git_status = f"Failed: push rejected by remote: {self._git_error(e)}"
+                    logging.error(f"Local Git push rejected, remote branch needs attention: {self._git_error(e)}")
+                else:
+                    # Commits stay local and go out with the next successful push
+                    self.last_local_git_status += ", push pending"
+                    logging.warning(f"Local Git push failed, will retry next run: {self._git_error(e)}")
+        if is_manual:
+            self.events.publish(StatusMessage(f"Status: Local Git {self.last_local_git_status}"))
+        self.events.publish(UploadDone("local_git", self.last_local_git_status, time.monotonic() - started))
+
+    @staticmethod
+    def _git_error(e):
+        stderr = getattr(e, 'stderr', None)
+        message = stderr.strip()[:200] if stderr else str(e)
+        # git may echo the remote URL, which can carry credentials
+        return re.sub(r'(\w+://)[^/@\s]+@', r'\1***@', message)
+
+    def wasabi_upload(self, is_manual=False):
+        if not self.wasabi_enabled or not self.wasabi_access_key or not self.wasabi_secret_key or not self.wasabi_bucket or not self.base_dir:
+            self.last_wasabi_status = "Skipped: Wasabi settings incomplete"
+            logging.info("Wasabi upload skipped: settings incomplete")
+            return
+        started = time.monotonic()
+        try:
+            s3_client = boto3.Session().client(
+                's3',
+                endpoint_url=f"https://s3.{self.wasabi_region}.wasabisys.com",
+                aws_access_key_id=self.wasabi_access_key,
+                aws_secret_access_key=self.wasabi_secret_key
+            )
+            files_to_upload = self.latest_backups()
+            for file_path, relative_path in files_to_upload:
+                with open(file_path, 'rb') as f:
+                    s3_client.upload_fileobj(f, self.wasabi_bucket, relative_path)
+            self.last_wasabi_status = "Success"
+            logging.info("Wasabi upload successful")
+            if is_manual:
+                self.events.publish(StatusMessage("Status: Wasabi upload completed"))
+        except Exception as e:
+            self.last_wasabi_status = f"Failed: {str(e)}"
+            logging.error(f"Wasabi upload failed: {str(e)}")
+            if is_manual:
+                self.events.publish(StatusMessage("Status: Wasabi upload failed"))
+        self.events.publish(UploadDone("wasabi", self.last_wasabi_status, time.monotonic() - started))
+
+    def backup_switches(self, is_manual=False):
+        self.collect(is_manual=is_manual)
+
+    def collect(self, inventory=None, is_manual=False):
+        """Back up an inventory and return {switch name: status entry} for the run.
+
+        inventory defaults to the configured CSV; a SwitchInventory or an iterable
+        of dicts with 'name' and 'ip' (optionally 'username', 'password', 'timeout')
+        can be passed instead. Returns None if the run could not start (another
+        full run holds the lock; use backup_now() to back up a few switches ahead
+        of it). Progress and errors are published on self.events.
+        """
+        # Try to acquire lock with timeout protection
+        if not self.backup_lock.acquire(blocking=False):
+            logging.warning("Backup already in progress")
+            self.events.publish(StatusMessage("Status: Backup in progress"))
+            if is_manual:
+                self.events.publish(Alert("warning", "Backup In Progress", "A backup is already running. Please wait."))
+            return None
+        try:
+            mode = "Manual" if is_manual else "Automatic"
+            started = time.monotonic()
+            self.events.publish(StatusMessage(f"Status: Running {mode.lower()} backup"))
+            logging.info(f"Starting {mode.lower()} backup")
+            if inventory is None:
+                try:
+                    self.inventory.load(self.csv_file)
+                except FileNotFoundError:
+                    self.events.publish(StatusMessage("Error: CSV not found"))
+                    logging.error(f"CSV not found: {self.csv_file}")
+                    return None
+                except ValueError as e:
+                    self.events.publish(StatusMessage("Error: CSV missing columns"))
+                    logging.error(str(e))
+                    return None
+                inventory = self.inventory
+            elif not isinstance(inventory, SwitchInventory):
+                inventory = SwitchInventory.from_rows(inventory)
+            self.record_inventory_errors(inventory)
+            if not self.base_dir:
+                logging.error("Backup directory not set.")
+                self.events.publish(StatusMessage("Error: Backup directory not set"))
+                self.events.publish(Alert("error", "Error", "Backup directory not set."))
+                return None
+            self.expire_sessions()
+            self._prepare_run_state()
+            distributed = self.distributed_enabled and bool(self.distributed_queue_path)
+            try:
+                if distributed:
+                    run_id, results = self._collect_distributed(inventory)
+                else:
+                    run_id, results = self._collect_journaled(mode, inventory)
+            except sqlite3.Error as e:
+                self.events.publish(StatusMessage("Error: Shared collector queue unavailable"))
+                logging.error(f"Shared collector queue {self.distributed_queue_path} unavailable: {str(e)}")
+                return None
+            finally:
+                self.latency.save()
+            has_failure = not all(results)
+            self.write_change_report(run_id)
+            # Local history is versioned even when some switches failed, and works offline
+            self.local_git_commit(run_id, mode, is_manual=is_manual)
+            if not has_failure:
+                self.git_upload(is_manual=is_manual)
+                with self.status_lock:
+                    for switch in self.switch_status:
+                        self.switch_status[switch]["git_status"] = self.last_git_status
+                self.wasabi_upload(is_manual=is_manual)
+                with self.status_lock:
+                    for switch in self.switch_status:
+                        self.switch_status[switch]["wasabi_status"] = self.last_wasabi_status
+            # Per-switch saves are throttled during the run, so always write the final state
+            self.save_status()
+            self.events.publish(StatusChanged())
+            if not distributed:
+                self.journal.finish()
+            self.events.publish(StatusMessage(f"Status: {mode} backup {'completed' if not has_failure else 'partially completed'}"))
+            logging.info(f"{mode} backup completed (run {run_id})")
+            self.events.publish(RunFinished(run_id, mode, results.count(True), results.count(False), time.monotonic() - started))
+            return {name: dict(status) for name, status in self.switch_status.items() if status.get("run_id") == run_id}
+        finally:
+            self.backup_lock.release()
+
+    def _configure_metrics(self):
+        """Attach or detach the Prometheus metrics file writer to match the metrics_enabled setting."""
+        if self.metrics_enabled and self.metrics is None:
+            self.metrics = MetricsExporter(os.path.join(self.base_dir, ".metrics", "aoscx_backup.prom"))
+            self.metrics.attach(self.events)
+        elif not self.metrics_enabled and self.metrics is not None:
+            self.metrics.detach(self.events)
+            self.metrics = None
+        if self.metrics is not None:
+            self.metrics.path = os.path.join(self.base_dir, ".metrics", "aoscx_backup.prom")
+
+    def _prepare_run_state(self):
+        """Point metrics, the local history store and the differ at the current settings.
+
+        Full and on-demand runs overlap, so objects are only replaced when a
+        setting changed; running jobs keep using the ones they already hold.
+        """
+        with self.run_state_lock:
+            self._configure_metrics()
+            if self.local_git is None or self.local_git.repo_dir != self.local_git_dir():
+                self.local_git = LocalGitStore(self.local_git_dir())
+            if self.differ.patterns != list(self.diff_ignore_patterns):
+                self.differ = ConfigDiffer(self.diff_ignore_patterns)
+
+    def backup_now(self, names, priority=BackupJobQueue.URGENT):
+        """Back up the named inventory switches ahead of scheduled work; returns {name: status entry}.
+
+        Does not wait for or interrupt a full run in progress: the jobs go to the
+        front of the shared queue and start on the next free worker. Their files
+        get their own local history commit; cloud uploads are left to the next
+        full run. Returns None if nothing could be queued.
+        """
+        queued = self._queue_on_demand(names, priority)
+        if queued is None:
+            return None
+        return self._finish_on_demand(*queued)
+
+    def queue_backup(self, names, priority=BackupJobQueue.URGENT):
+        """Like backup_now() but returns the run id as soon as the jobs are queued."""
+        queued = self._queue_on_demand(names, priority)
+        if queued is None:
+            return None
+        threading.Thread(target=self._finish_on_demand, args=queued, name="on-demand-backup", daemon=True).start()
+        return queued[0]
+
+    def _queue_on_demand(self, names, priority):
+        if not self.base_dir:
+            logging.error("Backup directory not set.")
+            self.events.publish(StatusMessage("Error: Backup directory not set"))
+            return None
+        try:
+            switches = self.inventory.load(self.csv_file)
+        except (OSError, ValueError, TypeError) as e:
+            logging.error(f"Could not load inventory for on-demand backup: {str(e)}")
+            self.events.publish(StatusMessage("Error: Could not load the switch CSV"))
+            return None
+        rows = [switches[name] for name in dict.fromkeys(names) if name in switches]
+        skipped = [name for name in names if name not in switches]
+        if skipped:
+            logging.warning(f"Not in the inventory, skipped: {', '.join(skipped)}")
+        if not rows:
+            self.events.publish(StatusMessage("Error: Selected switches are not in the inventory"))
+            return None
+        # Concurrent on-demand runs can start within the same millisecond, so ids carry a sequence number
+        run_id = f"tgt-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{next(self._on_demand_ids)}"
+        started = time.monotonic()
+        self.expire_sessions()
+        self._prepare_run_state()
+        logging.info(f"Queued on-demand backup {run_id}: {', '.join(row['name'] for row in rows)}")
+        self.events.publish(RunStarted(run_id, "Targeted", len(rows), 0))
+        return run_id, rows, self.enqueue(rows, run_id, priority, journaled=False, batch=True), started
+
+    def _finish_on_demand(self, run_id, rows, jobs, started):
+        results = self._wait_for(jobs)
+        self.latency.save()
+        self.local_git_commit(run_id, "Targeted", switches=[row['name'] for row, ok in zip(rows, results) if ok])
+        with self.status_lock:
+            # Targeted runs write no change report; their diffs are already in each switch's status
+            self.run_changes.pop(run_id, None)
+            self.save_status()
+        self.events.publish(StatusChanged())
+        self.events.publish(StatusMessage(f"Status: On-demand backup of {len(rows)} switch(es) {'completed' if all(results) else 'partially completed'}"))
+        self.events.publish(RunFinished(run_id, "Targeted", results.count(True), results.count(False), time.monotonic() - started))
+        with self.status_lock:
+            return {row['name']: dict(self.switch_status[row['name']]) for row in rows if row['name'] in self.switch_status}
+
+    def enqueue(self, rows, run_id, priority=BackupJobQueue.SCHEDULED, journaled=True, batch=False):
+        """Queue inventory rows for the backup workers and return their jobs (in row order)."""
+        jobs = [self.job_queue.put(row, run_id, priority, journaled, (index, len(rows)) if batch else None)
+                for index, row in enumerate(rows, 1)]
+        self._ensure_workers()
+        return jobs
+
+    @staticmethod
+    def _wait_for(jobs):
+        for job in jobs:
+            job.done.wait()
+        return [job.result for job in jobs]
+
+    def _ensure_workers(self):
+        """Start queue workers up to concurrent_backups; idle or surplus workers exit on their own."""
+        with self._workers_lock:
+            self._workers = [worker for worker in self._workers if worker.is_alive()]
+            for _ in range(len(self._workers), max(1, self.concurrent_backups)):
+                worker = threading.Thread(target=self._work_queue, name="backup-worker", daemon=True)
+                self._workers.append(worker)
+                worker.start()
+
+    def _work_queue(self):
+        me = threading.current_thread()
+        while True:
+            job = self.job_queue.get(timeout=self.WORKER_IDLE_SECONDS)
+            if job is not None:
+                self._run_job(job)
+            with self._workers_lock:
+                # Re-checked under the lock: enqueue() starts a replacement only after its put()
+                surplus = len(self._workers) > max(1, self.concurrent_backups)
+                if surplus or (job is None and not self.job_queue.pending()):
+                    self._workers.remove(me)
+                    return
+
+    def _run_job(self, job):
+        result = False
+        try:
+            result = self._backup_one(job.row, job.run_id, journaled=job.journaled, progress=job.progress)
+        except Exception as e:
+            logging.error(f"Backup of {job.row['name']} failed: {str(e)}")
+        finally:
+            with self.status_lock:
+                job.change = self.run_changes.get(job.run_id, {}).get(job.row['name'])
+            self.job_queue.task_done(job, result)
+
+    def queue_summary(self):
+        """One-line queue depth and wait times for the status view."""
+        stats = self.job_queue.stats()
+        waiting = sum(stats['waiting'].values())
+        if not waiting and not stats['running']:
+            text = "Queue: idle"
+        else:
+            depth = ", ".join(f"{count} {name}" for name, count in stats['waiting'].items() if count)
+            text = f"Queue: {waiting} waiting{f' ({depth})' if depth else ''}, {stats['running']} running"
+        waits = [f"{name} {stats['average'][name]:.1f} s avg"
+                 + (f", oldest {stats['oldest'][name]:.0f} s" if stats['waiting'][name] else "")
+                 for name in BackupJobQueue.NAMES.values() if name in stats['average']]
+        if waits:
+            text += " | Wait: " + "; ".join(waits)
+        return text
+
+    def _collect_journaled(self, mode, inventory):
+        """Back up the local inventory, resuming an interrupted run if one is recent enough."""
+        resume = self.journal.read_unfinished()
+        if resume and not self._is_resumable(resume):
+            logging.info(f"Interrupted run {resume['run_id']} is outside the resume window, starting a new run")
+            resume = None
+        run_id = self.journal.start(mode.lower(), resume)
+        completed = {name for name, status in self.journal.completed.items() if status == "Success"}
+        self.total_switches = len(inventory)
+        self.current_switch = sum(1 for name in completed if name in inventory.switches)
+        if resume:
+            logging.info(f"Resuming interrupted run {run_id}: {self.current_switch}/{self.total_switches} switches already completed")
+        self.events.publish(RunStarted(run_id, mode, self.total_switches, self.current_switch))
+        pending = [row for row in inventory if row['name'] not in completed]
+        if self.concurrent_backups > 1:
+            # Longest-expected first (never-profiled switches count as longest) shortens the makespan
+            pending.sort(key=lambda row: -(self.latency.expected_duration(row['name']) or float('inf')))
+        jobs = self.enqueue(pending, run_id)
+        adopted = [job for job in jobs if job.run_id != run_id]
+        if adopted:
+            # Already queued or running on demand: this run takes that backup instead of fetching again
+            logging.info(f"Using on-demand backups already under way for {len(adopted)} switch(es)")
+            with self.status_lock:
+                self.current_switch += len(adopted)
+        results = self._wait_for(jobs)
+        for job in adopted:
+            self.journal.record(job.row['name'], "Success" if job.result else "Failed")
+            if job.change is not None:
+                with self.status_lock:
+                    self.run_changes.setdefault(run_id, {})[job.row['name']] = job.change
+        return run_id, results
+
+    def _collect_distributed(self, inventory):
+        """Claim switches from the shared queue until the epoch has no outstanding work."""
+        queue = CollectorQueue(self.distributed_queue_path)
+        collector = self.collector_name or socket.gethostname()
+        epoch, created = queue.open_epoch(list(inventory), self.epoch_window_minutes * 60, collector)
+        run_id = f"dist-{epoch}"
+        logging.info(f"Collector {collector} {'started' if created else 'joined'} distributed run {run_id}")
+        self.total_switches = queue.size(epoch)
+        self.current_switch = 0
+        self.events.publish(RunStarted(run_id, "Distributed", self.total_switches, 0))
+        held = set()
+        held_lock = threading.Lock()
+        stop = threading.Event()
+
+        def renew_leases():
+            while not stop.wait(self.lease_seconds / 3):
+                with held_lock:
+                    switches = list(held)
+                try:
+                    queue.renew(epoch, collector, switches, self.lease_seconds)
+                except sqlite3.Error as e:
+                    logging.warning(f"Lease renewal failed: {str(e)}")
+
+        def work():
+            results = []
+            while True:
+                claim = queue.claim(epoch, collector, self.collector_region, self.lease_seconds, self.max_claim_attempts)
+                if claim is None:
+                    if queue.outstanding(epoch) == 0:
+                        return results
+                    # Other collectors hold live leases; wait in case one expires
+                    time.sleep(min(10, self.lease_seconds / 2))
+                    continue
+                name, ip = claim
+                row = inventory.switches.get(name) or {'name': name, 'ip': ip, 'username': None, 'password': None, 'timeout': None}
+                with held_lock:
+                    held.add(name)
+                success = False
+                try:
+                    success = self._backup_one(row, run_id, journaled=False)
+                finally:
+                    with held_lock:
+                        held.discard(name)
+                    result = self.switch_status.get(name, {})
+                    if success:
+                        queue.complete(epoch, name, collector, result)
+                    else:
+                        queue.release(epoch, name, collector, result, self.max_claim_attempts)
+                results.append(success)
+
+        renewer = threading.Thread(target=renew_leases, daemon=True)
+        renewer.start()
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrent_backups) as executor:
+                futures = [executor.submit(work) for _ in range(self.concurrent_backups)]
+                results = [success for future in futures for success in future.result()]
+        finally:
+            stop.set()
+        self.merge_collector_status(queue)
+        return run_id, results
+
+    def merge_collector_status(self, queue=None):
+        """Fold every collector's latest results into the local status view."""
+        if not (self.distributed_enabled and self.distributed_queue_path):
+            return
+        try:
+            merged = (queue or CollectorQueue(self.distributed_queue_path)).merged_status()
+        except sqlite3.Error as e:
+            logging.warning(f"Could not read shared collector status: {str(e)}")
+            return
+        with self.status_lock:
+            self.switch_status.update(merged)
+            self.save_status()
+        self.events.publish(StatusChanged())
+
+    def _backup_one(self, row, run_id, journaled=True, progress=None):
+        """Back up a single inventory entry and record its status; returns True on success."""
+        if progress is None:
+            with self.status_lock:
+                self.current_switch += 1
+                progress = (self.current_switch, self.total_switches)
+        if self.events.wants(SwitchStarted):
+            self.events.publish(SwitchStarted(run_id, row['name'], row['ip'], *progress))
+        logging.info(f"Backing up {row['name']} ({row['ip']})")
+        started = time.monotonic()
+        config, config_json = self.fetch_switch_config(row['ip'], row['username'] or self.default_username, row['password'] or self.default_password,
+                                                       name=row['name'], timeout_override=row['timeout'], want_json=self.structured_capture)
+        if config:
+            filepath = self.save_config(row['name'], row['ip'], config, structured=config_json, run_id=run_id)
+            if filepath and self.local_git_enabled:
+                try:
+                    digest = hmac.new(self.backup_key, config.encode('utf-8'), hashlib.sha256).hexdigest() if self.encrypt_backups else None
+                    self.local_git.stage(self.safe_name(row['name']), filepath, digest=digest)
+                except (subprocess.SubprocessError, OSError) as e:
+                    logging.error(f"Failed to stage {row['name']} in local Git history: {self._git_error(e)}")
+        with self.status_lock:
+            if config:
+                self.switch_status[row['name']] = {
+                    "name": row['name'], "ip": row['ip'], "last_backup": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    "status": "Success", "git_status": self.last_git_status, "wasabi_status": self.last_wasabi_status,
+                    "run_id": run_id, "changes": self._describe_change(row['name'], run_id)
+                }
+            else:
+                self.switch_status[row['name']] = {
+                    "name": row['name'], "ip": row['ip'], "last_backup": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    "status": "Failed", "git_status": "Not attempted", "wasabi_status": "Not attempted",
+                    "run_id": run_id
+                }
+            entry = self.switch_status[row['name']]
+            if journaled:
+                self.journal.record(row['name'], entry["status"])
+            self._save_status_throttled()
+        if self.events.wants(SwitchFinished):
+            self.events.publish(SwitchFinished(run_id, row['name'], row['ip'], entry["status"], time.monotonic() - started, entry.get("changes", "")))
+        return bool(config)
+
+    def _save_status_throttled(self):
+        """Save status at most every STATUS_SAVE_INTERVAL seconds mid-run; the run journal covers the gap."""
+        now = time.monotonic()
+        if now - self._status_saved_at >= self.STATUS_SAVE_INTERVAL:
+            self.save_status()
+            self._status_saved_at = now
+
+    def _describe_change(self, switch_name, run_id):
+        change = self.run_changes.get(run_id, {}).get(switch_name)
+        if not change:
+            return ""
+        if change['result'] == 'changed':
+            return f"+{change['added']}/-{change['removed']}"
+        return {'new': "First backup", 'unchanged': "No change"}.get(change['result'], "Diff failed")
+
+    def _is_resumable(self, run):
+        return self.resume_window_hours > 0 and time.time() - run['started'] <= self.resume_window_hours * 3600
+
+    def mark_interrupted_run(self):
+        """Flag switches left pending by a run that died before finishing."""
+        run = self.journal.read_unfinished()
+        if not run:
+            return
+        try:
+            names = list(self.inventory.load(self.csv_file))
+        except (OSError, ValueError):
+            names = list(self.switch_status)
+        pending = [name for name in names if run['completed'].get(name) != "Success"]
+        for name in pending:
+            previous = self.switch_status.get(name, {})
+            self.switch_status[name] = {
+                "name": name, "ip": previous.get("ip", self.inventory.switches.get(name, {}).get("ip", "")),
+                "last_backup": previous.get("last_backup", "Never"), "status": "Interrupted",
+                "git_status": previous.get("git_status", "Not attempted"), "wasabi_status": previous.get("wasabi_status", "Not attempted"),
+                "run_id": run['run_id']
+            }
+        action = "will resume on next run" if self._is_resumable(run) else "is outside the resume window"
+        logging.warning(f"Run {run['run_id']} was interrupted with {len(pending)} switches pending; it {action}")
+        self.save_status()
+
+    def record_inventory_errors(self, inventory=None):
+        """Log invalid inventory rows and surface named ones in the status view."""
+        inventory = self.inventory if inventory is None else inventory
+        errors = inventory.errors
+        for line_no, name, reason in errors[:20]:
+            logging.warning(f"Inventory row {line_no} skipped ({name or 'unnamed'}): {reason}")
+        if len(errors) > 20:
+            logging.warning(f"{len(errors) - 20} more invalid inventory rows skipped")
+        for line_no, name, reason in errors:
+            if name and name not in inventory.switches:
+                previous = self.switch_status.get(name, {})
+                self.switch_status[name] = {
+                    "name": name, "ip": previous.get("ip", ""), "last_backup": previous.get("last_backup", "Never"),
+                    "status": f"Invalid: {reason}", "git_status": "Not attempted", "wasabi_status": "Not attempted"
+                }
+        if errors:
+            self.save_status()
+            self.events.publish(StatusChanged())
+
+    def run_schedule(self):
+        if self.schedule_enabled:
+            self.setup_schedule()
+            logging.info(f"Scheduled backups set up")
+        while True:
+            schedule.run_pending()
+            self.expire_sessions()
+            time.sleep(60)
+
+    def expire_sessions(self):
+        """Log out cached REST sessions idle past the reuse window, well before the switch's own idle timeout."""
+        self.sessions.expire_idle(self.session_reuse_minutes * 60)
+
+    def shutdown(self):
+        """Stop the change listener and log out of every switch still holding a cached REST session."""
+        self.stop_event_triggers()
+        self.sessions.close_all()
+
+    def start_event_triggers(self):
+        """(Re)start the syslog/webhook listener to match the settings; returns an error message or None."""
+        self.stop_event_triggers()
+        if not self.event_triggers_enabled:
+            return None
+        try:
+            listener = ConfigChangeListener(self.resolve_switch, self.backup_triggered, syslog_port=self.syslog_port,
+                                            webhook_port=self.webhook_port, debounce=self.event_debounce_seconds,
+                                            pattern=self.event_trigger_pattern, bind_address=self.syslog_bind_address)
+            listener.start()
+        except (OSError, re.error) as e:
+            logging.error(f"Could not start config change listener: {str(e)}")
+            return str(e)
+        self.change_listener = listener
+        return None
+
+    def stop_event_triggers(self):
+        if self.change_listener is not None:
+            self.change_listener.stop()
+            self.change_listener = None
+
+    def resolve_switch(self, address, hostname=None):
+        """Map a message source (IP address and/or syslog hostname) to an inventory switch name."""
+        try:
+            switches = self.inventory.load(self.csv_file)
+        except (OSError, ValueError, TypeError):
+            return None
+        for row in switches.values():
+            if address and row['ip'] == address:
+                return row['name']
+        if hostname:
+            lowered = hostname.lower()
+            for row in switches.values():
+                if row['name'].lower() == lowered or row['ip'].lower() == lowered or row['name'].lower() == lowered.split('.')[0]:
+                    return row['name']
+        return None
+
+    def backup_triggered(self, names):
+        """Targeted backup for the change listener; queued ahead of scheduled work without waiting for it."""
+        names = [name for name in names if name in self.inventory.switches]
+        if names:
+            self.events.publish(BackupTriggered(names))
+            self.queue_backup(names, priority=BackupJobQueue.TRIGGERED)
+
+    def initialize(self):
+        if self.fernet is None:
+            self.fernet = self._initialize_encryption()
+        self.setup_logging()
+        self.load_config()
+        self.load_status()
+        self.latency.load()
+        self.mark_interrupted_run()
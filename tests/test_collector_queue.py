@@ -0,0 +1,84 @@
+import time
+
+import pytest
+
+from aoscx_backup_engine import CollectorQueue
+
+SWITCHES = [{'name': 'sw1', 'ip': '10.0.0.1'}]
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return CollectorQueue(str(tmp_path / "queue.db"))
+
+
+@pytest.fixture
+def epoch(queue):
+    epoch, created = queue.open_epoch(SWITCHES, 3600, "a")
+    assert created
+    return epoch
+
+
+def test_joining_collectors_share_the_epoch(queue, epoch):
+    assert queue.open_epoch(SWITCHES + [{'name': 'sw2', 'ip': '10.0.0.2'}], 3600, "b") == (epoch, False)
+    assert queue.size(epoch) == 2
+
+
+def test_complete_by_lease_holder(queue, epoch):
+    assert queue.claim(epoch, "a", "", 60, 3) == ("sw1", "10.0.0.1")
+    assert queue.claim(epoch, "b", "", 60, 3) is None
+    queue.complete(epoch, "sw1", "a", {"status": "Success"})
+    assert queue.outstanding(epoch) == 0
+    assert queue.merged_status() == {"sw1": {"status": "Success", "collector": "a"}}
+
+
+def test_expired_lease_is_reclaimed(queue, epoch):
+    queue.claim(epoch, "a", "", 0.05, 3)
+    time.sleep(0.1)
+    assert queue.claim(epoch, "b", "", 60, 3) == ("sw1", "10.0.0.1")
+    # The original holder finishing late must not overwrite the new owner's claim
+    queue.complete(epoch, "sw1", "a", {"status": "Success"})
+    assert queue.outstanding(epoch) == 1
+    assert queue.merged_status() == {}
+    queue.complete(epoch, "sw1", "b", {"status": "Success"})
+    assert queue.outstanding(epoch) == 0
+    assert queue.merged_status()["sw1"]["collector"] == "b"
+
+
+def test_renewed_lease_is_not_reclaimed(queue, epoch):
+    queue.claim(epoch, "a", "", 0.2, 3)
+    queue.renew(epoch, "a", ["sw1"], 60)
+    time.sleep(0.3)
+    assert queue.claim(epoch, "b", "", 60, 3) is None
+
+
+def test_renewal_by_another_collector_is_ignored(queue, epoch):
+    queue.claim(epoch, "a", "", 0.05, 3)
+    queue.renew(epoch, "b", ["sw1"], 60)
+    time.sleep(0.1)
+    assert queue.claim(epoch, "b", "", 60, 3) == ("sw1", "10.0.0.1")
+
+
+def test_expired_lease_gives_up_after_max_attempts(queue, epoch):
+    queue.claim(epoch, "a", "", 0.05, 1)
+    time.sleep(0.1)
+    assert queue.claim(epoch, "b", "", 60, 1) is None
+    assert queue.outstanding(epoch) == 0
+
+
+def test_released_switch_prefers_another_collector(queue, epoch):
+    queue.open_epoch([{'name': 'sw2', 'ip': '10.0.0.2'}], 3600, "a")
+    assert queue.claim(epoch, "a", "", 60, 3)[0] == "sw1"
+    queue.release(epoch, "sw1", "a", {"status": "Failed"}, 3)
+    # sw2 has never been tried by "a", so it comes before the switch "a" just failed
+    assert queue.claim(epoch, "a", "", 60, 3)[0] == "sw2"
+    assert queue.claim(epoch, "b", "", 60, 3)[0] == "sw1"
+
+
+def test_new_epoch_after_window_keeps_previous_results(queue, epoch):
+    queue.claim(epoch, "a", "", 60, 3)
+    queue.complete(epoch, "sw1", "a", {"status": "Success"})
+    new_epoch, created = queue.open_epoch(SWITCHES, 0, "a")
+    assert created and new_epoch != epoch
+    assert queue.outstanding(new_epoch) == 1
+    assert queue.merged_status()["sw1"]["status"] == "Success"
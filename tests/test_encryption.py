@@ -0,0 +1,111 @@
+import io
+import os
+import struct
+
+import pytest
+
+from aoscx_backup_engine import EncryptedBackupReader, EncryptedBackupWriter
+
+CHUNK = 1024
+HEADER = len(EncryptedBackupWriter.MAGIC) + 12
+RECORD = 4 + CHUNK + 16
+
+
+def seal(data, key, chunk_size=CHUNK):
+    buffer = io.BytesIO()
+    with EncryptedBackupWriter(buffer, key, chunk_size) as writer:
+        writer.write(data)
+    return buffer.getvalue()
+
+
+def open_sealed(blob, key):
+    return EncryptedBackupReader(io.BytesIO(blob), key).read()
+
+
+@pytest.fixture
+def key():
+    return os.urandom(32)
+
+
+@pytest.mark.parametrize("size", [0, 1, CHUNK - 1, CHUNK, CHUNK + 1, 3 * CHUNK, 3 * CHUNK + 17])
+def test_round_trip(key, size):
+    data = os.urandom(size)
+    assert open_sealed(seal(data, key), key) == data
+
+
+def test_write_text_round_trip(key):
+    text = "hostname core-1\n" + "interface 1/1/1\n    description üplink → core\n" * 200
+    buffer = io.BytesIO()
+    with EncryptedBackupWriter(buffer, key, CHUNK) as writer:
+        writer.write_text(text)
+    assert open_sealed(buffer.getvalue(), key).decode('utf-8') == text
+
+
+def test_sized_reads_cross_chunk_boundaries(key):
+    data = os.urandom(5 * CHUNK + 3)
+    reader = EncryptedBackupReader(io.BytesIO(seal(data, key)), key)
+    parts = []
+    while True:
+        part = reader.read(700)
+        if not part:
+            break
+        parts.append(part)
+    assert b"".join(parts) == data
+
+
+def test_same_plaintext_encrypts_differently(key):
+    assert seal(b"config", key) != seal(b"config", key)
+
+
+def test_flipped_ciphertext_byte_is_rejected(key):
+    blob = bytearray(seal(os.urandom(2 * CHUNK), key))
+    blob[HEADER + 4 + 10] ^= 0x01
+    with pytest.raises(ValueError, match="authentication"):
+        open_sealed(bytes(blob), key)
+
+
+def test_tampered_header_is_rejected(key):
+    blob = bytearray(seal(b"config", key))
+    # The nonce prefix is bound into every chunk's AAD
+    blob[HEADER - 1] ^= 0x01
+    with pytest.raises(ValueError):
+        open_sealed(bytes(blob), key)
+
+
+def test_reordered_chunks_are_rejected(key):
+    blob = seal(os.urandom(3 * CHUNK), key)
+    first, second = blob[HEADER:HEADER + RECORD], blob[HEADER + RECORD:HEADER + 2 * RECORD]
+    swapped = blob[:HEADER] + second + first + blob[HEADER + 2 * RECORD:]
+    with pytest.raises(ValueError):
+        open_sealed(swapped, key)
+
+
+@pytest.mark.parametrize("cut", [1, 4, RECORD])
+def test_truncated_file_is_rejected(key, cut):
+    blob = seal(os.urandom(2 * CHUNK + 100), key)
+    with pytest.raises(ValueError):
+        open_sealed(blob[:-cut], key)
+
+
+def test_dropping_the_final_chunk_is_rejected(key):
+    blob = seal(os.urandom(2 * CHUNK), key)
+    # Two full chunks plus an empty final one: cutting the last record must not look complete
+    final_length = struct.unpack(">I", blob[HEADER + 2 * RECORD:HEADER + 2 * RECORD + 4])[0]
+    assert final_length & EncryptedBackupWriter.FINAL
+    with pytest.raises(ValueError):
+        open_sealed(blob[:HEADER + 2 * RECORD], key)
+
+
+def test_trailing_data_is_rejected(key):
+    with pytest.raises(ValueError, match="trailing"):
+        open_sealed(seal(b"config", key) + b"x", key)
+
+
+def test_wrong_key_is_rejected(key):
+    with pytest.raises(ValueError, match="authentication"):
+        open_sealed(seal(b"config", key), os.urandom(32))
+
+
+def test_plaintext_file_is_not_an_encrypted_backup(key):
+    with pytest.raises(ValueError, match="Not an encrypted backup"):
+        open_sealed(b"hostname core-1\ninterface 1/1/1\n", key)
@@ -0,0 +1,92 @@
+import threading
+
+from aoscx_backup_engine import BackupJobQueue
+
+URGENT, TRIGGERED, SCHEDULED = BackupJobQueue.URGENT, BackupJobQueue.TRIGGERED, BackupJobQueue.SCHEDULED
+
+
+def row(name):
+    return {'name': name, 'ip': '10.0.0.1', 'username': None, 'password': None, 'timeout': None}
+
+
+def drain(queue):
+    jobs = []
+    while True:
+        job = queue.get(timeout=0)
+        if job is None:
+            return jobs
+        jobs.append(job)
+
+
+def test_more_urgent_jobs_are_served_first_fifo_within_priority():
+    queue = BackupJobQueue()
+    for name in ("a", "b"):
+        queue.put(row(name), "full", SCHEDULED)
+    queue.put(row("t"), "tgt-1", TRIGGERED)
+    queue.put(row("u"), "tgt-2", URGENT)
+    assert [job.row['name'] for job in drain(queue)] == ["u", "t", "a", "b"]
+
+
+def test_urgent_request_promotes_waiting_job():
+    queue = BackupJobQueue()
+    scheduled = queue.put(row("a"), "full", SCHEDULED)
+    queue.put(row("b"), "full", SCHEDULED)
+    promoted = queue.put(row("a"), "tgt-1", URGENT)
+    assert promoted is scheduled
+    assert promoted.priority == URGENT and promoted.run_id == "full"
+    jobs = drain(queue)
+    # The stale scheduled heap entry must not hand the same job out twice
+    assert [job.row['name'] for job in jobs] == ["a", "b"]
+    assert not queue.pending()
+
+
+def test_promotion_updates_stats():
+    queue = BackupJobQueue()
+    queue.put(row("a"), "full", SCHEDULED)
+    queue.put(row("b"), "full", SCHEDULED)
+    queue.put(row("a"), "tgt-1", URGENT)
+    assert queue.stats()['waiting'] == {"on-demand": 1, "triggered": 0, "scheduled": 1}
+
+
+def test_less_urgent_request_adopts_waiting_job():
+    queue = BackupJobQueue()
+    urgent = queue.put(row("a"), "tgt-1", URGENT)
+    assert queue.put(row("a"), "full", SCHEDULED) is urgent
+    assert urgent.priority == URGENT
+    assert len(drain(queue)) == 1
+
+
+def test_less_urgent_request_adopts_running_job():
+    queue = BackupJobQueue()
+    urgent = queue.put(row("a"), "tgt-1", URGENT)
+    assert queue.get(timeout=0) is urgent
+    assert queue.put(row("a"), "full", SCHEDULED) is urgent
+    assert queue.get(timeout=0) is None
+
+
+def test_more_urgent_request_does_not_adopt_running_job():
+    queue = BackupJobQueue()
+    scheduled = queue.put(row("a"), "full", SCHEDULED)
+    queue.get(timeout=0)
+    # The running fetch may predate the change that prompted the request
+    urgent = queue.put(row("a"), "tgt-1", URGENT)
+    assert urgent is not scheduled
+    assert queue.get(timeout=0) is urgent
+
+
+def test_finished_job_is_not_adopted():
+    queue = BackupJobQueue()
+    first = queue.put(row("a"), "tgt-1", URGENT)
+    queue.task_done(queue.get(timeout=0), True)
+    assert first.done.is_set() and first.result is True
+    assert queue.put(row("a"), "full", SCHEDULED) is not first
+
+
+def test_get_waits_for_a_job():
+    queue = BackupJobQueue()
+    timer = threading.Timer(0.05, queue.put, args=(row("a"), "tgt-1", URGENT))
+    timer.start()
+    job = queue.get(timeout=5)
+    timer.join()
+    assert job is not None and job.row['name'] == "a"
+    assert queue.stats()['running'] == 1